@@ -0,0 +1,173 @@
+"""複数の軌跡CSVをまとめてリサンプリングするコマンドラインツール
+
+GUI (tkinter) を使わないため、ディスプレイのない CI 環境でも実行できる。
+
+使用例:
+    python batch_resample.py racelines/ --mode resample
+    python batch_resample.py "racelines/*.csv" --mode sample --points 200 --output-dir out/
+    python batch_resample.py a.csv --mode range --center 42 --range-size 10
+    python batch_resample.py racelines/ --mode resample --speed-profile --max-speed 8.3
+
+終了コード: 0 = すべて成功, 1 = 失敗したファイルあり, 2 = 引数エラー/対象ファイルなし
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import curve_engine
+import speed_profile
+from trajectory import Trajectory
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+
+def collect_inputs(patterns, skip_suffix=None):
+    """ファイル・ディレクトリ・glob パターンから対象CSVの一覧を作る
+
+    skip_suffix を渡すと、ディレクトリや glob パターンを展開したときに、名前 (拡張子を除く) が
+    skip_suffix で終わるファイル (以前の出力) を除く。直接指定したファイルは除かない。
+    """
+    def expand(matches):
+        if skip_suffix:
+            matches = [f for f in matches if not os.path.splitext(os.path.basename(f))[0].endswith(skip_suffix)]
+        return sorted(matches)
+
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            files.extend(expand(glob.glob(os.path.join(pattern, "*.csv"))))
+        elif os.path.isfile(pattern):
+            files.append(pattern)
+        else:
+            files.extend(expand(glob.glob(pattern, recursive=True)))
+    # 重複を除き、指定順を保つ
+    return list(dict.fromkeys(os.path.abspath(f) for f in files))
+
+
+def output_path_for(input_path, output_dir, suffix):
+    stem, ext = os.path.splitext(os.path.basename(input_path))
+    directory = output_dir or os.path.dirname(input_path)
+    return os.path.join(directory, f"{stem}{suffix}{ext}")
+
+
+def process_file(input_path, output_path, mode, num_points=None, center=None, range_size=None,
+                 orientation_from_tangent=True, speed_limits=None):
+    """1ファイルを処理して結果の辞書を返す (ワーカープロセスで実行される)
+
+    speed_limits に speed_profile.limit_speeds のキーワード引数の辞書を渡すと、
+    処理後に speed 列を曲率から計算し直す。
+    """
+    start = time.perf_counter()
+    data = Trajectory.from_csv(input_path)
+    points_in = len(data)
+
+    if mode == "resample":
+        data = curve_engine.resample_all(data, orientation_from_tangent)
+    elif mode == "sample":
+        data = curve_engine.sample_closed_curve(data, num_points, orientation_from_tangent)
+    elif mode == "range":
+        indices, new_points = curve_engine.resample_window(data, center, range_size)
+        data.xy[indices] = new_points
+    else:
+        raise ValueError(f"不明なモードです: {mode}")
+    if speed_limits is not None:
+        data = speed_profile.apply_speed_profile(data, **speed_limits)
+
+    data.to_csv(output_path)
+    return {
+        "input": input_path,
+        "output": output_path,
+        "points_in": points_in,
+        "points_out": len(data),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="軌跡CSVを並列でリサンプリングします。")
+    parser.add_argument("inputs", nargs="+", help="入力CSVファイル、ディレクトリ、または glob パターン")
+    parser.add_argument("--mode", choices=("resample", "sample", "range"), default="resample",
+                        help="resample: 点数を保って全体を再配置 / sample: 曲線上を指定点数でサンプリング / "
+                             "range: 指定点の前後だけを再配置")
+    parser.add_argument("--points", type=int, default=100, help="sample モードの点数 (既定: 100)")
+    parser.add_argument("--center", type=int, help="range モードの中心インデックス")
+    parser.add_argument("--range-size", type=int, default=10, help="range モードで対象とする前後の点数 (既定: 10)")
+    parser.add_argument("--slerp", action="store_true",
+                        help="クォータニオンを接線方向から再計算せず、前後の点の間で球面線形補間する")
+    parser.add_argument("--speed-profile", action="store_true", help="処理後に speed 列を曲率と加減速の上限から計算し直す")
+    parser.add_argument("--max-speed", type=float, default=speed_profile.DEFAULT_MAX_SPEED,
+                        help="--speed-profile の最高速度 m/s (既定: %(default).2f)")
+    parser.add_argument("--max-lateral-accel", type=float, default=speed_profile.DEFAULT_MAX_LATERAL_ACCEL,
+                        help="--speed-profile の横加速度の上限 m/s^2 (既定: %(default)s)")
+    parser.add_argument("--max-accel", type=float, default=speed_profile.DEFAULT_MAX_ACCEL,
+                        help="--speed-profile の加速度の上限 m/s^2 (既定: %(default)s)")
+    parser.add_argument("--max-decel", type=float, default=speed_profile.DEFAULT_MAX_DECEL,
+                        help="--speed-profile の減速度の上限 m/s^2 (既定: %(default)s)")
+    parser.add_argument("--output-dir", help="出力先ディレクトリ (省略時は入力と同じ場所)")
+    parser.add_argument("--suffix", default="_resampled", help="出力ファイル名の接尾辞 (既定: _resampled)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="並列プロセス数 (既定: CPU コア数)")
+    parser.add_argument("--report", help="処理結果の JSON レポートを書き出すパス")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.mode == "range" and args.center is None:
+        parser.error("range モードには --center が必要です。")
+
+    files = collect_inputs(args.inputs, skip_suffix=args.suffix)
+    if not files:
+        print("エラー: 対象のCSVファイルが見つかりません。", file=sys.stderr)
+        return EXIT_USAGE
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    speed_limits = None
+    if args.speed_profile:
+        speed_limits = {"max_speed": args.max_speed, "max_lateral_accel": args.max_lateral_accel,
+                        "max_accel": args.max_accel, "max_decel": args.max_decel}
+
+    started = time.perf_counter()
+    results = []
+    failures = []
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {
+            executor.submit(process_file, path, output_path_for(path, args.output_dir, args.suffix),
+                            args.mode, args.points, args.center, args.range_size, not args.slerp, speed_limits): path
+            for path in files
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures.append({"input": path, "error": str(e)})
+                print(f"[{done}/{len(files)}] 失敗 {path}: {e}", flush=True)
+                continue
+            results.append(result)
+            print(f"[{done}/{len(files)}] 完了 {path} ({result['points_in']} -> {result['points_out']}点, "
+                  f"{result['seconds']:.2f}秒)", flush=True)
+
+    elapsed = time.perf_counter() - started
+    print(f"\n成功: {len(results)} / 失敗: {len(failures)} / 合計: {len(files)} ファイル ({elapsed:.2f}秒)")
+    for failure in failures:
+        print(f"  失敗: {failure['input']}: {failure['error']}")
+
+    if args.report:
+        with open(args.report, mode='w', encoding='utf-8') as outfile:
+            json.dump({"mode": args.mode, "seconds": elapsed, "succeeded": results, "failed": failures},
+                      outfile, ensure_ascii=False, indent=2)
+
+    return EXIT_FAILED if failures else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,459 @@
+"""エディタの主要な処理の実行時間とピークメモリを計測するベンチマーク
+
+Tk のメインループを起動せず、matplotlib の Agg バックエンドで描画するため、
+ディスプレイのない環境でも実行できる。点数の異なる合成コース (周回軌跡と
+内外のレーン境界) を生成し、読み込み・描画・選択・ドラッグ・リサンプリング・
+保存などを実際のエディタのメソッド経由で実行する。
+
+使用例:
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 100 10000 --cases plot_data drag_frame
+    python benchmark.py --sizes 1000000 --repeat 1 --no-memory
+    python benchmark.py --baseline bench.json --threshold 0.25
+
+終了コード: 0 = 正常終了, 1 = ベースラインより遅くなった項目あり, 2 = 引数エラー
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+from matplotlib.backend_bases import MouseEvent
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import tkinter as tk
+
+import csv_editor
+import curve_engine
+from curve_engine import MIN_SPLINE_POINTS
+from history import PointEdit
+from trajectory import Trajectory
+
+EXIT_OK = 0
+EXIT_REGRESSION = 1
+EXIT_USAGE = 2
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000) # 100万点は時間がかかるため --sizes で指定したときだけ計測する
+TRACK_RADIUS = (300.0, 180.0) # 合成コースの楕円の半径(m)
+LANE_HALF_WIDTH = 3.0 # 合成コースの中心線からレーン境界までの距離(m)
+DRAG_FRAMES = 20 # drag_frame で計測するマウス移動の回数
+NOISE_FLOOR_SECONDS = 0.002 # これより短い差はベースラインとの比較で無視する
+
+# 計測する処理の名前。--cases で絞り込める
+CASES = ("load_csv", "startup", "plot_data", "refresh_view", "rect_select", "drag_frame", "drag_release",
+         "history_push", "undo_redo", "resample_range", "resample_points", "sample_curve_points",
+         "speed_profile", "save_csv", "switch_trajectory")
+
+
+def generate_track(num_points, seed=0):
+    """num_points 点の閉じた合成コースを返す (中心線の Trajectory, 内側レーン, 外側レーン)"""
+    rng = np.random.default_rng(seed)
+    t = np.linspace(0.0, 2 * np.pi, num_points, endpoint=False)
+    # 楕円に低周波のうねりを加え、曲率が場所によって変わるコースにする
+    wobble = 1.0 + 0.08 * np.sin(3 * t) + 0.04 * np.cos(7 * t + 0.5)
+    x = TRACK_RADIUS[0] * wobble * np.cos(t)
+    y = TRACK_RADIUS[1] * wobble * np.sin(t)
+    center = np.column_stack((x, y))
+
+    tangent = np.gradient(center, axis=0)
+    tangent /= np.maximum(np.linalg.norm(tangent, axis=1, keepdims=True), 1e-12)
+    normal = np.column_stack((-tangent[:, 1], tangent[:, 0]))
+    yaw = np.arctan2(tangent[:, 1], tangent[:, 0])
+
+    columns = {
+        'z': np.zeros(num_points),
+        'x_quat': np.zeros(num_points),
+        'y_quat': np.zeros(num_points),
+        'z_quat': np.sin(yaw / 2),
+        'w_quat': np.cos(yaw / 2),
+        'speed': rng.uniform(1.5, 8.3, num_points),
+    }
+    fieldnames = ['x', 'y'] + list(columns)
+    data = Trajectory(fieldnames, center, columns)
+    return data, center + LANE_HALF_WIDTH * normal, center - LANE_HALF_WIDTH * normal
+
+
+def write_track_files(directory, num_points):
+    """合成コースを CSV に書き出し、(軌跡, 内側レーン, 外側レーン) のパスを返す"""
+    data, inner, outer = generate_track(num_points)
+    paths = [os.path.join(directory, f"{name}_{num_points}.csv") for name in ("track", "inner", "outer")]
+    data.to_csv(paths[0])
+    for path, lane in zip(paths[1:], (inner, outer)):
+        Trajectory(['x', 'y'], lane).to_csv(path)
+    return paths
+
+
+class _SilentMessagebox:
+    """ダイアログを表示せず、確認には常に OK と答える messagebox の代わり"""
+
+    def __init__(self):
+        self.messages = []
+
+    def _record(self, *args, **kwargs):
+        self.messages.append(args)
+
+    showinfo = showwarning = showerror = _record
+
+    def askokcancel(self, *args, **kwargs):
+        return True
+
+
+class _NullWidget:
+    def config(self, *args, **kwargs):
+        pass
+
+    configure = start = stop = current = pack = pack_forget = config
+
+
+class _HeadlessTk(tk.Tk):
+    """Tk のウィンドウを作らずに after だけを自前のキューで代行する基底クラス"""
+
+    def __init__(self):
+        self.tk = None
+        self._after_queue = {}
+        self._after_serial = 0
+
+    def after(self, ms, func=None, *args):
+        self._after_serial += 1
+        job_id = f"after#{self._after_serial}"
+        self._after_queue[job_id] = (func, args)
+        return job_id
+
+    def after_cancel(self, job_id):
+        self._after_queue.pop(job_id, None)
+
+    def run_pending(self):
+        """予約された after のコールバックを待ち時間なしで実行する (実行中に予約された分は次回)"""
+        pending, self._after_queue = self._after_queue, {}
+        for func, args in pending.values():
+            if func is not None:
+                func(*args)
+
+    def protocol(self, *args):
+        pass
+
+    def bind_all(self, *args):
+        pass
+
+    def destroy(self):
+        pass
+
+
+class HeadlessEditor(csv_editor.CsvCurveEditor, _HeadlessTk):
+    """Tk を起動せずに動かす CsvCurveEditor。キャンバスには Agg を使う"""
+
+    def __init__(self, input_file, output_file, lane_files=()):
+        self._lane_files = lane_files
+        super().__init__(input_file, output_file, None)
+        # ファイルはバックグラウンドで読み込まれるため、編集できる状態になるまで待つ
+        self.wait_for_jobs()
+
+    def load_lane_boundaries(self):
+        lanes = [self._load_lane_csv(path) for path in self._lane_files] + [np.empty((0, 2))] * 2
+        return lanes[:2]
+
+    def create_widgets(self):
+        self.fig = csv_editor.Figure(figsize=(8, 6), dpi=100)
+        self.ax = self.fig.add_subplot(111)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.status_label = self.progress_bar = self.cancel_button = self.clearance_label = _NullWidget()
+        self.deviation_label = self.trajectory_selector = _NullWidget()
+
+    def wait_for_jobs(self):
+        """バックグラウンド処理がすべて終わり、結果が反映されるまで待つ"""
+        while self.worker.jobs:
+            concurrent.futures.wait([job.future for job in self.worker.jobs])
+            self.run_pending()
+        self.run_pending()
+
+    def mouse_event(self, name, x, y, button=1, key=None):
+        """データ座標 (x, y) でのマウスイベントを作る"""
+        px, py = self.ax.transData.transform((x, y))
+        return MouseEvent(name, self.canvas, px, py, button=button, key=key)
+
+
+class BenchmarkCases:
+    """1つの点数について、各処理の「準備をして計測対象を返す」関数を提供する
+
+    準備関数は計測後の後始末が必要なら self._cleanup に設定する。
+    """
+
+    def __init__(self, directory, num_points):
+        self.num_points = num_points
+        self.track_file, self.inner_file, self.outer_file = write_track_files(directory, num_points)
+        self.output_file = os.path.join(directory, f"output_{num_points}.csv")
+        self._cleanup = None
+        self.editor = self._new_editor()
+        # 初回のプロセス起動を計測に含めないよう、ワーカープロセスを先に立ち上げておく
+        self.editor.worker.submit("準備", curve_engine.preload, use_process=True)
+        self.editor.wait_for_jobs()
+
+    def _new_editor(self):
+        editor = HeadlessEditor(self.track_file, self.output_file, (self.inner_file, self.outer_file))
+        editor.canvas.draw()
+        return editor
+
+    def _reset(self):
+        """編集結果が次の計測に影響しないよう、元の軌跡に戻す"""
+        editor = self.editor
+        while editor.history.can_undo:
+            editor.undo()
+        editor.history.clear()
+        editor.selected_indices.clear()
+
+    def _point(self, index):
+        return self.editor.data.xy[index % len(self.editor.data)]
+
+    def load_csv(self):
+        return self.editor.load_csv
+
+    def startup(self):
+        return self._new_editor
+
+    def plot_data(self):
+        return self.editor.plot_data
+
+    def refresh_view(self):
+        def run():
+            self.editor._refresh_view()
+            self.editor.canvas.draw()
+        return run
+
+    def rect_select(self):
+        self._reset()
+        editor = self.editor
+        (xmin, xmax), (ymin, ymax) = editor.ax.get_xlim(), editor.ax.get_ylim()
+        # 何もない左下から表示範囲の4分の1を囲む
+        start = (xmin + 0.01 * (xmax - xmin), ymin + 0.01 * (ymax - ymin))
+        end = (xmin + 0.5 * (xmax - xmin), ymin + 0.5 * (ymax - ymin))
+
+        def run():
+            editor.on_press(editor.mouse_event('button_press_event', *start))
+            editor.on_motion(editor.mouse_event('motion_notify_event', *end))
+            editor._flush_motion()
+            editor.on_release(editor.mouse_event('button_release_event', *end))
+        return run
+
+    def _start_drag(self):
+        self._reset()
+        editor = self.editor
+        x, y = self._point(self.num_points // 3)
+        editor.on_press(editor.mouse_event('button_press_event', x, y))
+        return x, y
+
+    def drag_frame(self):
+        editor = self.editor
+        x, y = self._start_drag()
+        events = [editor.mouse_event('motion_notify_event', x + 0.05 * step, y) for step in range(1, DRAG_FRAMES + 1)]
+
+        def run():
+            for event in events:
+                editor.on_motion(event)
+                editor._flush_motion()
+        # ボタンを離す処理は drag_release で別に計測する
+        self._cleanup = lambda: editor.on_release(editor.mouse_event('button_release_event', x, y))
+        return run
+
+    def drag_release(self):
+        editor = self.editor
+        x, y = self._start_drag()
+        editor.on_motion(editor.mouse_event('motion_notify_event', x + 0.5, y))
+        editor._flush_motion()
+        return lambda: editor.on_release(editor.mouse_event('button_release_event', x + 0.5, y))
+
+    def history_push(self):
+        self._reset()
+        editor = self.editor
+        indices = np.arange(0, len(editor.data), max(1, len(editor.data) // 100))
+        before = editor.data.xy[indices]
+        return lambda: editor.history.push(PointEdit(indices, before, before + 0.1))
+
+    def undo_redo(self):
+        self._reset()
+        editor = self.editor
+        index = self.num_points // 2
+        editor.history.push(PointEdit([index], editor.data.xy[[index]], editor.data.xy[[index]]))
+
+        def run():
+            editor.undo()
+            editor.redo()
+        return run
+
+    def resample_range(self):
+        self._reset()
+        self.editor._last_edited_index = self.num_points // 2
+        return self.editor.resample_range
+
+    def resample_points(self):
+        self._reset()
+
+        def run():
+            self.editor.resample_points()
+            self.editor.wait_for_jobs()
+        return run
+
+    def sample_curve_points(self):
+        self._reset()
+
+        def run():
+            self.editor.sample_curve_points(self.num_points)
+            self.editor.wait_for_jobs()
+        return run
+
+    def speed_profile(self):
+        self._reset()
+        return self.editor.generate_speed_profile
+
+    def save_csv(self):
+        def run():
+            self.editor.save_csv()
+            self.editor.wait_for_jobs()
+        return run
+
+    def switch_trajectory(self):
+        editor = self.editor
+        if len(editor.session) < 2:
+            # うねりの異なる合成コースを2本目の候補として開き、読み込み済みにしておく
+            candidate, _, _ = generate_track(self.num_points, seed=1)
+            candidate.xy[:] *= 1.01
+            path = os.path.join(os.path.dirname(self.track_file), f"candidate_{self.num_points}.csv")
+            candidate.to_csv(path)
+            editor.session.add(path, os.path.join(os.path.dirname(path), f"candidate_output_{self.num_points}.csv"))
+            editor.switch_trajectory(1)
+            editor.wait_for_jobs()
+        # 読み込み済みの軌跡どうしの切り替え (ファイルの読み込みを含まない)
+        other = 1 - editor.session.index(editor.session.active)
+        return lambda: editor.switch_trajectory(other)
+
+    def _run_once(self, prepare, trace_memory=False):
+        """準備をして計測対象を1回実行し、(秒数, ピークメモリMB または None) を返す"""
+        target = prepare()
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            target()
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024) if trace_memory else None
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            if self._cleanup is not None:
+                self._cleanup()
+                self._cleanup = None
+        return seconds, peak
+
+    def run(self, name, repeat, memory):
+        """name の処理を repeat 回計測し、(各回の秒数, ピークメモリMB) を返す
+
+        ピークメモリは tracemalloc で計測が遅くなるため、別に1回実行して求める。
+        drag_frame の秒数はマウス移動1回あたりの値にする。
+        """
+        prepare = getattr(self, name)
+        per_call = DRAG_FRAMES if name == "drag_frame" else 1
+        times = [self._run_once(prepare)[0] / per_call for _ in range(repeat)]
+        peak = self._run_once(prepare, trace_memory=True)[1] if memory else None
+        return times, peak
+
+    def close(self):
+        self.editor.worker.shutdown()
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """ベースラインより threshold の割合を超えて遅くなった項目のリストを返す"""
+    previous = {(r["case"], r["points"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        old = previous.get((result["case"], result["points"]))
+        if old is None or old["min_seconds"] <= 0:
+            continue
+        # 中央値より揺れの小さい最短時間どうしで比べる
+        result["baseline_min_seconds"] = old["min_seconds"]
+        result["ratio"] = result["min_seconds"] / old["min_seconds"]
+        if result["ratio"] > 1 + threshold and result["min_seconds"] - old["min_seconds"] > NOISE_FLOOR_SECONDS:
+            regressions.append(result)
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="エディタの主要な処理を合成コースで計測します。")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="計測する軌跡の点数 (既定: 100 1000 10000 100000)")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES), help="計測する処理 (既定: すべて)")
+    parser.add_argument("--repeat", type=int, default=3, help="各処理の繰り返し回数。中央値を結果とする (既定: 3)")
+    parser.add_argument("--no-memory", action="store_true", help="ピークメモリの計測 (1回分の追加実行) を省略する")
+    parser.add_argument("--output", help="結果の JSON を書き出すパス")
+    parser.add_argument("--baseline", help="比較するベースラインの JSON (以前の --output の結果)")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="ベースラインに対してこの割合を超えて遅くなったら失敗とする (既定: 0.25)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.repeat < 1 or any(n < MIN_SPLINE_POINTS for n in args.sizes):
+        parser.error(f"--repeat は1以上、--sizes は{MIN_SPLINE_POINTS}以上にしてください。")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as infile:
+            baseline = json.load(infile)
+
+    # ダイアログ・自動保存・ジャーナル・GUI のテーマは使わない
+    csv_editor.messagebox = _SilentMessagebox()
+    csv_editor.AUTOSAVE_INTERVAL_SEC = 0
+    csv_editor.JOURNAL_ENABLED = False
+    # エディタは sv_ttk をテーマの適用時に読み込むため、読み込みが ImportError になるようにしておく
+    sys.modules['sv_ttk'] = None
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="csv_editor_bench_") as directory:
+        for num_points in args.sizes:
+            print(f"--- {num_points}点 ---", flush=True)
+            cases = BenchmarkCases(directory, num_points)
+            try:
+                for name in args.cases:
+                    times, peak = cases.run(name, args.repeat, not args.no_memory)
+                    result = {"case": name, "points": num_points, "seconds": statistics.median(times),
+                              "min_seconds": min(times), "repeat": len(times), "peak_mb": peak}
+                    results.append(result)
+                    memory = f", ピーク {peak:.1f} MB" if peak is not None else ""
+                    print(f"{name:20s} {result['seconds'] * 1000:10.2f} ms{memory}", flush=True)
+            finally:
+                cases.close()
+
+    regressions = compare_with_baseline(results, baseline, args.threshold) if baseline else []
+    if baseline:
+        print("\nベースラインとの比較:")
+        for result in results:
+            if "ratio" in result:
+                mark = " <-- 遅くなりました" if result in regressions else ""
+                print(f"{result['case']:20s} {result['points']:>8d}点 x{result['ratio']:.2f}{mark}")
+
+    if args.output:
+        report = {
+            "created": datetime.now().isoformat(timespec='seconds'),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "matplotlib": matplotlib.__version__,
+            "platform": platform.platform(),
+            "results": results,
+        }
+        with open(args.output, mode='w', encoding='utf-8') as outfile:
+            json.dump(report, outfile, ensure_ascii=False, indent=2)
+
+    return EXIT_REGRESSION if regressions else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
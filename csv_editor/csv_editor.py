@@ -1,30 +1,50 @@
-import csv
+import time
+STARTUP_ORIGIN = time.perf_counter() # 起動時間の計測の起点 (このモジュールの読み込み開始時刻)
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import os
 import numpy as np
-from scipy.interpolate import splprep, splev
+from matplotlib import colormaps
+from matplotlib.collections import LineCollection
+from matplotlib.colors import Normalize
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
 
-try:
-    import sv_ttk
-except ImportError:
-    sv_ttk = None
+import csv_loader
+import curve_engine
+import deviation
+import lod
+import pose_feed
+import profiling
+import project
+import session
+import speed_profile
+import journal
+from history import ColumnEdit, CompoundEdit, EditHistory, PointEdit, ReplaceEdit
+from lane_clearance import LaneDistanceField
+from spatial_index import PointGridIndex
+from trajectory import Trajectory
+from workers import BackgroundRunner
 
 # ========== 設定エリア ==========
 # ファイルパス設定
 INPUT_FILE = "input.csv"  # 入力CSVファイルのパス
 OUTPUT_FILE = "output.csv"  # 出力CSVファイルのパス
 BACKGROUND_FILE = "background.csv" # 背景として表示するCSVファイルのパス
+PROJECT_FILE = "project.npz" # 軌跡・レーン境界・背景・表示範囲・履歴をまとめたプロジェクトファイル。存在すれば起動時にCSVの代わりに開く
 
 # --- 外観設定 ---
 THEME = "dark"  # "dark" または "light" を選択 (sv_ttk が必要)
 SHOW_POINT_INDICES = True  # Trueにすると点の横にインデックス番号を表示
+INDEX_LABEL_MIN_SPACING_PX = 25  # インデックス番号どうしの最小間隔(ピクセル)。密集時はこれより近い番号を省略
+MAX_INDEX_LABELS = 400  # 一度に表示するインデックス番号の最大数
 POINT_SIZE = 25  # データ点のマーカーサイズ
 SELECTED_POINT_HIGHLIGHT_SIZE = 80 # 選択された点のハイライトサイズ
+PICK_RADIUS_PX = 8 # クリックで点を選択できる距離(画面上のピクセル)
+ZOOM_STEP = 1.2 # マウスホイール1段あたりの拡大率 (右ドラッグで表示範囲を移動)
+FRAME_BUDGET_MS = 16 # ドラッグ中の再描画の最短間隔(ミリ秒)。間に届いたマウス移動は最新の1件だけを処理する
+DRAG_SETTLE_MS = 150 # ドラッグ中にポインタがこの時間止まったら、スプライン全体の再計算など重い処理を行う
 
 # --- 色設定 ---
 # HTMLカラーコード (例: '#FF0000') や色の名前 (例: 'red') で指定できます
@@ -32,100 +52,246 @@ MAIN_CURVE_COLOR = '#00A0FF' # 編集対象のカーブの色
 BACKGROUND_CURVE_COLOR = '#FF4444' # 背景カーブの色
 LANE_BOUNDARY_COLOR = '#888888' # レーン境界線の色
 SELECTED_POINT_EDGE_COLOR = 'yellow' # 選択された点のハイライト色
+LANE_VIOLATION_COLOR = '#FF00FF' # レーン境界に近づきすぎた点・曲線の強調色
+POSE_TRAIL_COLOR = '#00FF66' # 受信した車両の走行軌跡と現在位置の色
+INACTIVE_CURVE_COLOR = '#999999' # 表示していない他の軌跡の色 (SESSION_SHOW_INACTIVE)
 
 # --- 機能設定 ---
 RESAMPLE_RANGE_SIZE = 10 # 「範囲リサンプリング」で対象とする前後の点数
 DEFAULT_CURVE_SAMPLE_POINTS = 100 # 「曲線上サンプリング」のデフォルト点数
-MAX_HISTORY_SIZE = 20 # 元に戻す/やり直しの最大履歴数
+ORIENTATION_FROM_TANGENT = True # リサンプリング時にクォータニオンを曲線の接線方向から再計算する (Falseなら前後の点を球面線形補間)
+HISTORY_MEMORY_LIMIT_MB = 64 # 元に戻す/やり直し履歴が使用するメモリの上限(MB)
+AUTOSAVE_INTERVAL_SEC = 60 # 編集内容を自動保存する間隔(秒)。0 にすると自動保存しない
+AUTOSAVE_SUFFIX = ".autosave.csv" # 自動保存ファイルの名前 (出力ファイルの拡張子をこれに置き換える)
+JOURNAL_ENABLED = True # Trueにすると編集操作を出力ファイルの隣のジャーナルに記録し、次回起動時に続きから再開できる
+JOURNAL_SUFFIX = ".journal" # ジャーナルファイルの名前 (出力ファイルの拡張子をこれに置き換える)
+JOURNAL_CHECKPOINT_MB = 256 # ジャーナルがこの大きさ(MB)を超えたら、現在の状態をチェックポイントとして書き直す
+AUTO_SPEED_PROFILE = False # Trueにすると点の移動やリサンプリングのたびに speed 列を曲率から計算し直す
+SPEED_MAX = 30.0 / 3.6 # 速度プロファイルの最高速度(m/s)
+SPEED_MAX_LATERAL_ACCEL = 3.0 # 速度プロファイルの横加速度の上限(m/s^2)
+SPEED_MAX_ACCEL = 2.0 # 速度プロファイルの加速度の上限(m/s^2)
+SPEED_MAX_DECEL = 3.0 # 速度プロファイルの減速度の上限(m/s^2)
+PROFILE = False # Trueにすると処理時間を計測し、グラフ左上にフレーム時間とその内訳を表示する
+PROFILE_TRACE_FILE = "profile_trace.json" # PROFILE が True のとき、終了時に計測結果を Chrome のトレース形式で書き出すファイル
+STARTUP_TIMING = False # Trueにすると起動の各段階 (モジュールの読み込み・ウィンドウ作成・ファイル読み込みなど) の所要時間を表示する
+LANE_MIN_CLEARANCE = 0.0 # レーン境界までの距離がこの値(m)未満の点と曲線を違反として強調表示する (コース外は負の距離)
+DEVIATION_COLOR_RANGE = 1.0 # 参照線(背景)からのずれの表示で、色が最も濃くなる横方向のずれ(m)
+DEVIATION_COLORMAP = 'coolwarm' # 参照線からのずれの表示に使うカラーマップ (参照線の進行方向の右が青、左が赤)
+DEVIATION_COLOR_LEVELS = 33 # 曲線の色分けの段階数。同じ段階が続く区間を1本の線として描く
+POSE_FEED_ENABLED = False # Trueにするとシミュレーターなどから UDP で送られる車両の姿勢を受信し、走行軌跡を重ねて表示する
+POSE_FEED_HOST = "127.0.0.1" # 姿勢を受信するアドレス
+POSE_FEED_PORT = 47800 # 姿勢を受信するポート (試験用の送信側: python pose_feed.py input.csv --rate 200)
+POSE_TRAIL_LENGTH = 3000 # 走行軌跡として表示する直近の姿勢の数 (受信用のリングバッファの長さ)
+POSE_REFRESH_HZ = 30 # 走行軌跡を描き直す頻度の上限(回/秒)。受信の頻度が高くてもこれ以上は描き直さない
+SESSION_FILES = [] # INPUT_FILE と一緒に開き、切り替えて編集する軌跡CSV。パスまたは glob パターン (例: ["racelines/*.csv"])
+SESSION_OUTPUT_SUFFIX = "_edited" # SESSION_FILES などで追加した軌跡の保存先 (入力と同じ場所で、ファイル名の末尾にこれを付ける)
+SESSION_MEMORY_LIMIT_MB = 1024 # 読み込んだ軌跡 (履歴を含む) の合計がこれを超えたら、しばらく表示していないものから解放する
+SESSION_SHOW_INACTIVE = True # Trueにすると、読み込み済みの他の軌跡を細い線で重ねて表示する
 # ===============================
 
 class CsvCurveEditor(tk.Tk):
-    def __init__(self, input_file, output_file, background_file=None):
-        super().__init__()
+    # 軌跡ごとの状態として、表示する軌跡を切り替えるときに入れ替える属性 (session.TrajectorySlot を参照)
+    SLOT_STATE = ('data', 'history', 'journal', 'source_file', 'input_file', 'output_file', 'autosave_file',
+                  '_autosaved_version', 'data_version', 'spline_preview', 'point_index', 'point_clearance',
+                  'point_deviation', '_curve_deviation', 'selected_indices', '_last_edited_index')
+
+    def __init__(self, input_file, output_file, background_file=None, project_file=None):
+        self.startup_timer = profiling.StartupTimer(STARTUP_ORIGIN, PROFILER)
+        self.startup_timer.record("モジュールの読み込み", STARTUP_ORIGIN)
+        with self.startup_timer.stage("Tk の初期化"):
+            super().__init__()
         self.input_file = input_file
         self.output_file = output_file
         self.background_file = background_file
+        self.project_file = project_file
 
-        if sv_ttk:
+        with self.startup_timer.stage("テーマの適用"):
             try:
-                sv_ttk.set_theme(THEME)
-            except tk.TclError:
-                print(f"警告: テーマ '{THEME}' はsv_ttkでサポートされていません。デフォルトのテーマを使用します。")
+                import sv_ttk # 任意のテーマ拡張。テーマを適用するときにだけ読み込む
+            except ImportError:
+                sv_ttk = None
+            if sv_ttk:
+                try:
+                    sv_ttk.set_theme(THEME)
+                except tk.TclError:
+                    print(f"警告: テーマ '{THEME}' はsv_ttkでサポートされていません。デフォルトのテーマを使用します。")
         self.dark_mode = (THEME == "dark" and sv_ttk is not None)
 
-        self.data = []
-        self.inner_lane_data = []
-        self.outer_lane_data = []
-        self.background_data = []
-        self.fieldnames = []
+        self.data = None
+        self.inner_lane_data = np.empty((0, 2))
+        self.outer_lane_data = np.empty((0, 2))
+        self.background_data = np.empty((0, 2))
+        self.lane_field = None
+        self.point_clearance = np.empty(0)
+        self.reference_line = None # 背景の軌跡を参照線とした、ずれの計算用のインデックス
+        self.show_deviation = False
+        self.point_deviation = np.empty(0) # 各点の参照線からの符号付き横方向オフセット (表示中だけ計算する)
+        self._curve_deviation = None # (曲線のサンプル, オフセット) 動いていないサンプルの計算を省くためのキャッシュ
+        self.source_file = None # 編集の元になったファイル (入力CSVまたはプロジェクトファイル)
+        self.initial_view = None
         self._last_edited_index = None
-        self._epsilon = 5
+        self.point_index = None
+        self.data_version = 0
+        self.spline_preview = curve_engine.SplinePreview()
 
         self.selected_indices = set()
         self.drag_mode = None
         self.rect_start_pos = None
         self.drag_start_pos = None
         self.selection_rect = None
+        self.pan_start = None
+        self.lasso_line = None
+        self.lasso_vertices = []
         self.original_data_on_drag = None
-
-        self.history = []
-        self.redo_stack = []
-        self.max_history = MAX_HISTORY_SIZE
-
-        self.load_csv()
-        self.load_lane_boundaries()
-        self.load_background_data()
-        if not self.data:
-            self.destroy()
-            return
-            
-        self.create_widgets()
-        self.plot_data()
-        self.connect_events()
-
-    def save_history_state(self):
-        self.redo_stack.clear()
-        if len(self.history) >= self.max_history:
-            self.history.pop(0)
-        self.history.append([row.copy() for row in self.data])
+        self._pending_motion = None
+        self._motion_job = None
+        self._settle_job = None
+        self._last_frame_time = 0.0
+
+        self.history = EditHistory(HISTORY_MEMORY_LIMIT_MB * 1024 * 1024)
+        self.worker = BackgroundRunner(self)
+        self.worker.on_status = self._update_status
+        self.journal = None
+        self._load_messages = [] # 読み込み中に出たメッセージ (ワーカースレッドからは表示できないため後でまとめて表示する)
+        self.edit_buttons = [] # 軌跡を読み込むまで押せないボタン
+        self._window_created_at = None
+        self.pose_receiver = None
+        self._pose_job = None
+        self.session = None # 開いている軌跡の一覧。最初の軌跡を読み込んだときに作る
+        self._pose_received = 0 # 最後に描いたときまでに受信した姿勢の数
+
+        self.autosave_file = None # 出力ファイルのパスが確定する読み込み後に決める (_on_files_loaded)
+        self._autosaved_version = self.data_version
+        self._autosave_job = None
+
+        # ウィンドウと空のグラフを先に作って表示し、ファイルはバックグラウンドで読み込む。
+        # 読み込みが終わると表示を更新し、編集の操作を受け付ける (_on_files_loaded)
+        with self.startup_timer.stage("ウィジェットの作成"):
+            self.create_widgets()
+            self.setup_plot()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self._window_created_at = time.perf_counter()
+        # 読み込みが終わらないと何も編集できないため、キャンセルボタンでは止めない
+        self.worker.submit("読み込み", self._read_files, on_done=self._on_files_loaded, on_error=self._on_load_error,
+                           cancellable=False)
 
     def undo(self, event=None):
-        if not self.history:
+        if not self.history.can_undo:
             messagebox.showinfo("元に戻す", "元に戻す操作はありません。")
             return
-        self.redo_stack.append([row.copy() for row in self.data])
-        self.data = self.history.pop()
+        self.data, changed = self.history.undo(self.data)
+        self._append_journal(journal.UNDO, self.history.redo_stack[-1])
+        self._on_data_changed(changed)
         self.plot_data()
 
     def redo(self, event=None):
-        if not self.redo_stack:
+        if not self.history.can_redo:
             messagebox.showinfo("やり直し", "やり直す操作はありません。")
             return
-        self.history.append([row.copy() for row in self.data])
-        self.data = self.redo_stack.pop()
+        self.data, changed = self.history.redo(self.data)
+        self._append_journal(journal.REDO, self.history.undo_stack[-1])
+        self._on_data_changed(changed)
         self.plot_data()
 
+    def _push_edit(self, record):
+        """適用済みの変更を履歴に積み、ジャーナルに追記する"""
+        self.history.push(record)
+        self._append_journal(journal.EDIT, record)
+
+    def open_journal(self, confirm=True):
+        """前回のジャーナルが残っていれば再生するか確認し、このセッションの記録を始める
+
+        confirm が False なら確認せずに再生する (メモリの上限で解放した軌跡を読み込み直すとき)。
+        """
+        path = os.path.splitext(self.output_file)[0] + JOURNAL_SUFFIX
+        try:
+            self.journal = journal.EditJournal(path, journal.source_stamp(self.source_file))
+            pending = self.journal.pending_edits()
+            if pending and (not confirm or messagebox.askyesno(
+                    "復元", f"前回の編集内容 ({pending}件) が残っています。続きから再開しますか？")):
+                try:
+                    self.data = self.journal.replay(self.data, self.history)
+                    return
+                except journal.JournalError as e:
+                    print(f"ジャーナル再生エラー: {e}")
+                    messagebox.showerror("エラー", f"前回の編集内容を復元できませんでした: {e}")
+            self.journal.reset()
+        except OSError as e:
+            print(f"ジャーナル作成エラー: {e}")
+            messagebox.showwarning("警告", f"編集内容のジャーナルを作成できないため、記録せずに続けます: {e}")
+            self.journal = None
+
+    def _append_journal(self, kind, record):
+        if self.journal is None:
+            return
+        try:
+            self.journal.append(kind, record, self.data)
+            if self.journal.nbytes > JOURNAL_CHECKPOINT_MB * 1024 * 1024:
+                # 再生に時間がかからないよう、現在の状態から記録し直す
+                self.journal.reset(self.data)
+        except OSError as e:
+            print(f"ジャーナル書き込みエラー: {e}")
+            messagebox.showwarning("警告", f"編集内容のジャーナルを書き込めないため、記録を停止します: {e}")
+            self.journal.close()
+            self.journal = None
+
+    def _on_data_changed(self, changed_indices=None):
+        """データのバージョンを進め、座標が変わった点を空間インデックスに反映する
+
+        changed_indices が None なら軌跡全体が変わったものとしてインデックスを作り直す。
+        """
+        self.data_version += 1
+        if changed_indices is None or self.point_index.xy is not self.data.xy:
+            self.point_index.rebuild(self.data.xy)
+        else:
+            self.point_index.update(changed_indices)
+        self._update_clearance(changed_indices)
+        self._update_deviation(changed_indices)
+
+    def _update_clearance(self, changed_indices=None):
+        """各点のレーン境界までのクリアランスを更新する。changed_indices を指定するとその点だけを計算し直す"""
+        if not self.lane_field:
+            return
+        if changed_indices is None or len(self.point_clearance) != len(self.data):
+            self.point_clearance = self.lane_field.clearance(self.data.xy)
+        else:
+            indices = np.asarray(list(changed_indices), dtype=np.intp)
+            self.point_clearance[indices] = self.lane_field.clearance(self.data.xy[indices])
+
+    def _update_deviation(self, changed_indices=None):
+        """各点の参照線からの横方向オフセットを更新する。changed_indices を指定するとその点だけを計算し直す"""
+        if not self.show_deviation or not self.reference_line:
+            return
+        if changed_indices is None or len(self.point_deviation) != len(self.data):
+            self.point_deviation = self.reference_line.project(self.data.xy)[1]
+        else:
+            indices = np.asarray(list(changed_indices), dtype=np.intp)
+            self.point_deviation[indices] = self.reference_line.project(self.data.xy[indices])[1]
+
+    def _add_load_message(self, show, title, message):
+        """読み込み中のメッセージを記録する。show は messagebox の関数の名前"""
+        self._load_messages.append((show, title, message))
+
+    def _check_speed_column(self, data):
+        if 'speed' not in data:
+            self._add_load_message("showwarning", "警告", "CSVに 'speed' 列がありません。速度による色分けは無効になります。")
+
+    def _show_load_messages(self):
+        messages, self._load_messages = self._load_messages, []
+        for show, title, message in messages:
+            getattr(messagebox, show)(title, message)
+
     def _load_lane_csv(self, file_path):
-        data = []
         try:
-            with open(file_path, mode='r', newline='', encoding='utf-8') as infile:
-                reader = csv.DictReader(infile)
-                if 'x' not in reader.fieldnames or 'y' not in reader.fieldnames:
-                    return []
-                
-                temp_data = list(reader)
-                for row in temp_data:
-                    try:
-                        data.append({'x': float(row['x']), 'y': float(row['y'])})
-                    except (ValueError, TypeError):
-                        pass
-        except FileNotFoundError:
+            return csv_loader.load_xy(file_path)
+        except (FileNotFoundError, ValueError):
             pass
         except Exception as e:
-            messagebox.showwarning("警告", f"{os.path.basename(file_path)} の読み込み中にエラーが発生しました: {e}")
-        return data
+            self._add_load_message("showwarning", "警告", f"{os.path.basename(file_path)} の読み込み中にエラーが発生しました: {e}")
+        return np.empty((0, 2))
 
     def load_lane_boundaries(self):
+        """内側・外側のレーン境界を読み込み、[内側, 外側] を返す (ない場合は空の配列)"""
         try:
             __cd__ = os.path.dirname(os.path.abspath(__file__))
         except NameError:
@@ -134,13 +300,12 @@ class CsvCurveEditor(tk.Tk):
         inner_lane_file = os.path.join(__cd__, "lane/inner_lane_bound.csv")
         outer_lane_file = os.path.join(__cd__, "lane/out_lane_bound.csv")
         
-        self.inner_lane_data = self._load_lane_csv(inner_lane_file)
-        self.outer_lane_data = self._load_lane_csv(outer_lane_file)
+        return [self._load_lane_csv(inner_lane_file), self._load_lane_csv(outer_lane_file)]
 
     def load_background_data(self):
-        """第三のCSVファイルから背景データを読み込む"""
+        """第三のCSVファイルから背景データを読み込んで返す"""
         if not self.background_file:
-            return
+            return np.empty((0, 2))
 
         try:
             try:
@@ -149,30 +314,94 @@ class CsvCurveEditor(tk.Tk):
                  __cd__ = os.path.dirname(os.path.abspath('__main__'))
 
             background_path = os.path.join(__cd__, self.background_file)
-            
-            with open(background_path, mode='r', newline='', encoding='utf-8') as infile:
-                reader = csv.DictReader(infile)
-                if not reader.fieldnames:
-                    messagebox.showwarning("警告", f"背景CSVファイル {self.background_file} にヘッダーがありません。")
-                    return
-                if 'x' not in reader.fieldnames or 'y' not in reader.fieldnames:
-                    messagebox.showwarning("警告", f"背景CSVファイル {self.background_file} には 'x' と 'y' の列が必要です。")
-                    return
-
-                temp_data = list(reader)
-                self.background_data = []
-                for row in temp_data:
-                    try:
-                        self.background_data.append({'x': float(row['x']), 'y': float(row['y'])})
-                    except (ValueError, TypeError):
-                        pass
+            return csv_loader.load_xy(background_path)
 
         except FileNotFoundError:
-            messagebox.showwarning("警告", f"背景ファイルが見つかりません: {self.background_file}")
+            self._add_load_message("showwarning", "警告", f"背景ファイルが見つかりません: {self.background_file}")
+        except ValueError as e:
+            self._add_load_message("showwarning", "警告", str(e))
         except Exception as e:
-            messagebox.showwarning("警告", f"背景CSV読み込み中にエラーが発生しました: {e}")
+            self._add_load_message("showwarning", "警告", f"背景CSV読み込み中にエラーが発生しました: {e}")
+        return np.empty((0, 2))
+
+    def load_project(self):
+        """プロジェクトファイルがあれば、軌跡・レーン境界・背景・表示範囲・履歴をまとめて開く
+
+        配列はメモリマップで開くため、点数が多くても読み込みはほぼ一瞬で終わる。
+        _read_files() と同じ形の辞書を返す。開けなかった場合は None を返し、CSVから読み込む。
+        """
+        if not self.project_file:
+            return None
+        try:
+            __cd__ = os.path.dirname(os.path.abspath(__file__))
+        except NameError:
+            __cd__ = os.path.dirname(os.path.abspath('__main__'))
+        self.project_file = os.path.join(__cd__, self.project_file)
+        if not os.path.exists(self.project_file):
+            return None
+
+        try:
+            opened = project.Project(self.project_file)
+            data = opened.trajectory()
+            lanes = (opened.lanes() + [np.empty((0, 2))] * 2)[:2]
+            lane_field = opened.lane_field(lanes)
+            background = opened.background()
+            history = EditHistory(HISTORY_MEMORY_LIMIT_MB * 1024 * 1024)
+            opened.restore_history(history)
+        except Exception as e:
+            print(f"プロジェクト読み込みエラー: {e}")
+            self._add_load_message("showerror", "エラー", f"プロジェクトファイルを開けないため、CSVから読み込みます: {e}")
+            return None
+
+        self.input_file = os.path.join(__cd__, self.input_file)
+        self.output_file = os.path.join(__cd__, self.output_file)
+        return {"data": data, "source_file": self.project_file, "lanes": lanes, "lane_field": lane_field,
+                "background": background, "view": opened.view, "history": history}
+
+    def save_project(self):
+        """現在の軌跡・レーン境界・背景・表示範囲・履歴をプロジェクトファイルに保存する"""
+        if self.session is not None and self.session.active is not self.session.slots[0]:
+            messagebox.showinfo("情報", "プロジェクトに保存できるのは、起動時に開いた軌跡だけです。")
+            return
+        view = {"xlim": list(self.ax.get_xlim()), "ylim": list(self.ax.get_ylim())}
+        try:
+            self._copy_project_arrays_to_memory()
+            project.save_project(self.project_file, self.data, [self.inner_lane_data, self.outer_lane_data],
+                                 self.background_data, view, self.history, self.lane_field)
+        except Exception as e:
+            print(f"プロジェクト保存エラー: {e}")
+            messagebox.showerror("エラー", f"プロジェクト保存中にエラーが発生しました: {e}")
+            return
+
+        # 次回はプロジェクトから開くため、ジャーナルもプロジェクトを元に記録し直す
+        self.source_file = self.project_file
+        if self.journal is not None:
+            try:
+                self.journal.reset(source=journal.source_stamp(self.project_file))
+            except OSError as e:
+                print(f"ジャーナル書き込みエラー: {e}")
+        messagebox.showinfo("成功", f"プロジェクトが {self.project_file} に保存されました")
+
+    def _copy_project_arrays_to_memory(self):
+        """プロジェクトから開いたメモリマップの配列をすべてメモリ上にコピーし、ファイルを参照しないようにする
+
+        開いたプロジェクトへ上書き保存するとき、マップしたままのファイルを置き換えないようにするため。
+        """
+        project.trajectory_in_memory(self.data)
+        project.history_in_memory(self.history)
+        if self.point_index is not None and self.point_index.xy is not self.data.xy:
+            self.point_index.rebuild(self.data.xy)
+        self.inner_lane_data = project.in_memory(self.inner_lane_data)
+        self.outer_lane_data = project.in_memory(self.outer_lane_data)
+        self.background_data = project.in_memory(self.background_data)
+        self.lane_lines = [(line, project.in_memory(lane)) for line, lane in self.lane_lines]
+        if self.lane_field:
+            arrays = {name: project.in_memory(values) for name, values in self.lane_field.to_arrays().items()}
+            self.lane_field = LaneDistanceField.from_arrays(self.lane_field.boundaries, arrays,
+                                                            self.lane_field.resolution)
 
     def load_csv(self):
+        """入力CSVを読み込んで返す。読み込めなければ None を返す"""
         try:
             try:
                  __cd__ = os.path.dirname(os.path.abspath(__file__))
@@ -182,34 +411,261 @@ class CsvCurveEditor(tk.Tk):
             self.input_file = os.path.join(__cd__, self.input_file)
             self.output_file = os.path.join(__cd__, self.output_file)
             
-            with open(self.input_file, mode='r', newline='', encoding='utf-8') as infile:
-                reader = csv.DictReader(infile)
-                if not reader.fieldnames:
-                    messagebox.showerror("エラー", "CSVファイルにヘッダーがありません。")
-                    return
-                self.fieldnames = reader.fieldnames
-                if 'x' not in self.fieldnames or 'y' not in self.fieldnames:
-                    messagebox.showerror("エラー", "CSVには 'x' と 'y' の列が必要です。")
-                    return
-                if 'speed' not in self.fieldnames:
-                    messagebox.showwarning("警告", "CSVに 'speed' 列がありません。速度による色分けは無効になります。")
-
-                temp_data = list(reader)
-                self.data = []
-                for row in temp_data:
-                    try:
-                        row['x'] = float(row['x'])
-                        row['y'] = float(row['y'])
-                        if 'speed' in row:
-                            row['speed'] = float(row['speed'])
-                        self.data.append(row)
-                    except (ValueError, TypeError):
-                        pass
+            data = Trajectory.from_csv(self.input_file)
+            self._check_speed_column(data)
+            return data
 
         except FileNotFoundError:
-            messagebox.showerror("エラー", f"入力ファイルが見つかりません: {self.input_file}")
+            self._add_load_message("showerror", "エラー", f"入力ファイルが見つかりません: {self.input_file}")
+        except ValueError as e:
+            self._add_load_message("showerror", "エラー", str(e))
         except Exception as e:
-            messagebox.showerror("エラー", f"CSV読み込み中にエラーが発生しました: {e}")
+            self._add_load_message("showerror", "エラー", f"CSV読み込み中にエラーが発生しました: {e}")
+        return None
+
+    def _read_files(self, report):
+        """起動時に開くファイルを読み込む (ワーカースレッドで実行するため Tk には触れない)
+
+        プロジェクトファイルを開けなければCSVから読み込む。表示に必要なものを辞書で返す。
+        """
+        timer = self.startup_timer
+        report(None, "プロジェクト")
+        with timer.stage("プロジェクトの読み込み"):
+            loaded = self.load_project()
+        if loaded is None:
+            report(None, "軌跡")
+            with timer.stage("軌跡の読み込み"):
+                data = self.load_csv()
+            report(None, "レーン境界・背景")
+            with timer.stage("レーン境界・背景の読み込み"):
+                lanes = self.load_lane_boundaries()
+                background = self.load_background_data()
+            loaded = {"data": data, "source_file": self.input_file, "lanes": lanes, "lane_field": None,
+                      "background": background, "view": None, "history": None}
+        # 最初のスプラインの計算でメインスレッドを止めないよう、scipy をここで読み込んでおく
+        report(None, "スプライン計算の準備")
+        with timer.stage("scipy の読み込み"):
+            curve_engine.preload()
+        return loaded
+
+    def _on_load_error(self, e):
+        print(f"読み込みエラー: {e}")
+        self._show_load_messages()
+        messagebox.showerror("エラー", f"ファイル読み込み中にエラーが発生しました: {e}")
+        self.on_close()
+
+    def _on_files_loaded(self, loaded):
+        """読み込んだ軌跡・レーン境界・背景を表示し、編集を受け付ける"""
+        self._show_load_messages()
+        if not loaded["data"]:
+            self.on_close()
+            return
+        self.data = loaded["data"]
+        self.source_file = loaded["source_file"]
+        self.inner_lane_data, self.outer_lane_data = loaded["lanes"]
+        self.lane_field = loaded["lane_field"]
+        self.background_data = loaded["background"]
+        self.initial_view = loaded["view"]
+        if loaded["history"] is not None:
+            self.history = loaded["history"]
+        # 出力ファイルのパスは読み込み (load_csv / load_project) で絶対パスになる
+        self.autosave_file = os.path.splitext(self.output_file)[0] + AUTOSAVE_SUFFIX
+        if JOURNAL_ENABLED:
+            self.open_journal()
+        self._start_session()
+
+        with self.startup_timer.stage("軌跡の表示"):
+            self.point_index = PointGridIndex(self.data.xy)
+            self._update_clearance()
+            self.setup_layers()
+            self.plot_data()
+        self.connect_events()
+        for button in self.edit_buttons:
+            button.config(state=tk.NORMAL)
+        self.trajectory_selector.config(state='readonly')
+        if AUTOSAVE_INTERVAL_SEC > 0:
+            self._autosave_job = self.after(int(AUTOSAVE_INTERVAL_SEC * 1000), self.autosave)
+        if POSE_FEED_ENABLED:
+            self.start_pose_feed()
+
+        lanes = [self.inner_lane_data, self.outer_lane_data]
+        build_lane_field = self.lane_field is None and any(len(lane) for lane in lanes)
+        if build_lane_field or len(self.background_data):
+            # 境界までの距離場と参照線のインデックスは作るのに時間がかかるため、軌跡を表示してから
+            # バックグラウンドで作る。一度作れば編集中はこれを参照する
+            self.worker.submit("距離場・参照線の準備", self._build_indexes, lanes if build_lane_field else None,
+                               self.background_data, on_done=self._on_indexes_built, on_error=self._on_indexes_error,
+                               on_cancel=self._on_startup_finished)
+        else:
+            self._on_startup_finished()
+
+    def _build_indexes(self, report, lanes, background):
+        """レーン境界の距離場 (lanes が None なら作らない) と参照線のインデックスを作る"""
+        lane_field = reference_line = None
+        if lanes is not None:
+            with self.startup_timer.stage("レーン境界の距離場の作成"):
+                lane_field = LaneDistanceField(lanes)
+        if len(background):
+            report(None, "参照線")
+            with self.startup_timer.stage("参照線のインデックスの作成"):
+                reference_line = deviation.ReferenceLine(background)
+        return lane_field, reference_line
+
+    def _on_indexes_built(self, result):
+        # 変わるのは違反の強調表示だけなので、点や曲線は描き直さずにその部分だけ更新する
+        lane_field, self.reference_line = result
+        if lane_field is not None:
+            self.lane_field = lane_field
+            self._update_clearance()
+            if self.lane_field:
+                self._update_curve_violations(*self.curve_line.get_data())
+                self._update_violations()
+                self._blit()
+        self._on_startup_finished()
+
+    def _on_indexes_error(self, e):
+        print(f"距離場・参照線の準備エラー: {e}")
+        messagebox.showwarning("警告", f"レーン境界までの距離と参照線からのずれを計算できないため、表示しません: {e}")
+        self._on_startup_finished()
+
+    def _on_startup_finished(self):
+        """起動時の読み込みがすべて終わったときに呼ばれる"""
+        self.startup_timer.record("起動全体", STARTUP_ORIGIN)
+        if STARTUP_TIMING:
+            print("起動時間の内訳:")
+            print("\n".join(self.startup_timer.report_lines()))
+
+    def _start_session(self):
+        """起動時に開いた軌跡と SESSION_FILES の軌跡で、切り替えて編集できる一覧を作る"""
+        self.session = session.TrajectorySession(SESSION_MEMORY_LIMIT_MB * 1024 * 1024)
+        self.session.activate(self.session.add(self.input_file, self.output_file))
+        __cd__ = os.path.dirname(os.path.abspath(__file__))
+        for path in session.expand_inputs(SESSION_FILES, __cd__):
+            self.session.add(path, session.output_path_for(path, SESSION_OUTPUT_SUFFIX))
+        self._update_trajectory_selector()
+
+    def _update_trajectory_selector(self):
+        self.trajectory_selector.config(values=[slot.name for slot in self.session.slots])
+        self.trajectory_selector.current(self.session.index(self.session.active))
+
+    def add_trajectories(self):
+        """選んだ軌跡CSVを一覧に加え、最初のものを表示する"""
+        paths = filedialog.askopenfilenames(title="追加する軌跡CSVを選択",
+                                            filetypes=[("CSVファイル", "*.csv"), ("すべてのファイル", "*.*")])
+        if not paths:
+            return
+        slots = [self.session.add(path, session.output_path_for(path, SESSION_OUTPUT_SUFFIX)) for path in paths]
+        self._update_trajectory_selector()
+        self.switch_trajectory(self.session.index(slots[0]))
+
+    def _switch_relative(self, step):
+        if self.session is not None and len(self.session) > 1:
+            self.switch_trajectory((self.session.index(self.session.active) + step) % len(self.session))
+
+    def switch_trajectory(self, index):
+        """index 番目の軌跡を表示する。まだ読み込んでいなければバックグラウンドで読み込んでから表示する
+
+        レーン境界・背景・距離場・参照線・表示範囲は切り替えても共有する。
+        """
+        slot = self.session.slots[index]
+        if slot is self.session.active:
+            return
+        # 実行中の処理の結果は表示中の軌跡に反映されるため、終わるまで切り替えない
+        if self.drag_mode is not None or self.worker.busy:
+            messagebox.showinfo("情報", "別の処理を実行中です。完了してから切り替えてください。")
+            self._update_trajectory_selector()
+            return
+        if slot.state is not None:
+            self._store_active_slot()
+            for name, value in self.session.take(slot).items():
+                setattr(self, name, value)
+            self.session.activate(slot)
+            self._show_active_slot()
+            return
+        self.worker.submit("軌跡の読み込み", self._read_slot, slot,
+                           on_done=lambda data: self._on_slot_loaded(slot, data),
+                           on_error=lambda e: self._on_slot_load_error(slot, e),
+                           on_cancel=self._update_trajectory_selector)
+
+    def _read_slot(self, report, slot):
+        report(None, slot.name)
+        data = Trajectory.from_csv(slot.input_file)
+        self._check_speed_column(data)
+        return data
+
+    def _on_slot_load_error(self, slot, e):
+        print(f"軌跡読み込みエラー: {e}")
+        messagebox.showerror("エラー", f"{slot.name} を読み込めませんでした: {e}")
+        self._update_trajectory_selector()
+
+    def _on_slot_loaded(self, slot, data):
+        """読み込んだ軌跡を新しい状態として表示する"""
+        self._store_active_slot()
+        self.session.activate(slot)
+        self.data = data
+        self.source_file = self.input_file = slot.input_file
+        self.output_file = slot.output_file
+        self.autosave_file = os.path.splitext(self.output_file)[0] + AUTOSAVE_SUFFIX
+        self.history = EditHistory(HISTORY_MEMORY_LIMIT_MB * 1024 * 1024)
+        self.journal = None
+        self.data_version = self._autosaved_version = 0
+        self.spline_preview = curve_engine.SplinePreview()
+        self.selected_indices = set()
+        self._last_edited_index = None
+        self.point_clearance = np.empty(0)
+        self.point_deviation = np.empty(0)
+        self._curve_deviation = None
+        if JOURNAL_ENABLED:
+            self.open_journal(confirm=not slot.resume_journal)
+        self.point_index = PointGridIndex(self.data.xy)
+        self._show_active_slot()
+        self._show_load_messages()
+
+    def _store_active_slot(self):
+        self.session.store(self.session.active, {name: getattr(self, name) for name in self.SLOT_STATE})
+
+    def _show_active_slot(self):
+        """表示する軌跡を入れ替えた後、共有の距離場などで計算する値をそろえて全体を描き直す"""
+        # 距離場などは、この軌跡を表示していない間に作られた場合がある
+        if len(self.point_clearance) != len(self.data):
+            self._update_clearance()
+        if len(self.point_deviation) != len(self.data):
+            self._update_deviation()
+        self._update_trajectory_selector()
+        self._update_inactive_line()
+        self._blit_background = self._pose_background = None
+        self.plot_data()
+        self._unload_over_limit()
+
+    def _unload_over_limit(self):
+        """読み込んだ軌跡の合計がメモリの上限を超えていれば、しばらく表示していないものを解放する"""
+        active_nbytes = session.state_nbytes({name: getattr(self, name) for name in self.SLOT_STATE})
+        for slot in self.session.slots_to_unload(active_nbytes, self._can_unload_slot):
+            state = self.session.unload(slot)
+            if state["journal"] is not None:
+                state["journal"].close()
+                slot.resume_journal = True
+
+    @staticmethod
+    def _can_unload_slot(slot):
+        # 入力CSVとジャーナルから同じ状態に戻せる軌跡だけを解放する。プロジェクトから開いた軌跡や、
+        # ジャーナルに記録できずに編集した軌跡はメモリに残す
+        state = slot.state
+        return state["source_file"] == slot.input_file and (state["journal"] is not None or state["data_version"] == 0)
+
+    def _update_inactive_line(self):
+        """読み込み済みの他の軌跡を、表示範囲に合わせて間引いた1本の線 (NaN で区切る) として描く"""
+        if not SESSION_SHOW_INACTIVE or self.session is None:
+            return
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
+        pixel_size = self._pixel_size()
+        xs, ys = [], []
+        for slot in self.session.slots:
+            if slot.state is not None:
+                x, y = lod.decimate_polyline(slot.state["data"].xy, xlim, ylim, pixel_size)
+                xs += [x, [np.nan]]
+                ys += [y, [np.nan]]
+        self.inactive_line.set_data(np.concatenate(xs) if xs else [], np.concatenate(ys) if ys else [])
 
     def create_widgets(self):
         bg_color = "#2b2b2b" if self.dark_mode else "white"
@@ -227,6 +683,17 @@ class CsvCurveEditor(tk.Tk):
         for spine in self.ax.spines.values():
             spine.set_edgecolor(fg_color)
 
+        session_frame = ttk.Frame(self)
+        session_frame.pack(fill=tk.X, padx=10, pady=(5, 0))
+        ttk.Label(session_frame, text="軌跡:").pack(side=tk.LEFT)
+        # 開いている軌跡の切り替え (Ctrl+PageUp / Ctrl+PageDown でも切り替えられる)
+        self.trajectory_selector = ttk.Combobox(session_frame, state=tk.DISABLED, width=50)
+        self.trajectory_selector.pack(side=tk.LEFT, padx=5)
+        self.trajectory_selector.bind("<<ComboboxSelected>>",
+                                      lambda event: self.switch_trajectory(self.trajectory_selector.current()))
+        add_trajectory_button = ttk.Button(session_frame, text="軌跡を追加...", command=self.add_trajectories)
+        add_trajectory_button.pack(side=tk.LEFT, padx=5)
+
         control_frame = ttk.Frame(self)
         control_frame.pack(fill=tk.X, padx=10, pady=5)
 
@@ -241,15 +708,97 @@ class CsvCurveEditor(tk.Tk):
             text=f"曲線上サンプリング({DEFAULT_CURVE_SAMPLE_POINTS}点)",
             command=self.sample_curve_points
         )
-        sample_curve_button.pack(side=tk.LEFT, padx=(5, 0))
+        sample_curve_button.pack(side=tk.LEFT, padx=(5, 5))
+
+        speed_button = ttk.Button(control_frame, text="速度プロファイル計算", command=self.generate_speed_profile)
+        speed_button.pack(side=tk.LEFT, padx=(5, 0))
+
+        self.clearance_label = ttk.Label(control_frame, text="")
+        self.clearance_label.pack(side=tk.RIGHT)
+
+        analysis_frame = ttk.Frame(self)
+        analysis_frame.pack(fill=tk.X, padx=10, pady=(0, 5))
+        deviation_button = ttk.Button(analysis_frame, text="参照線とのずれを表示", command=self.toggle_deviation)
+        deviation_button.pack(side=tk.LEFT, padx=(0, 5))
+        deviation_columns_button = ttk.Button(analysis_frame, text="ずれを列に追加", command=self.add_deviation_columns)
+        deviation_columns_button.pack(side=tk.LEFT, padx=(5, 0))
+        self.deviation_label = ttk.Label(analysis_frame, text="")
+        self.deviation_label.pack(side=tk.RIGHT)
 
         canvas_frame = ttk.Frame(self)
         canvas_frame.pack(fill=tk.BOTH, expand=True)
         self.canvas = FigureCanvasTkAgg(self.fig, master=canvas_frame)
         self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
 
-        save_button = ttk.Button(self, text="編集内容を保存", command=self.save_csv)
-        save_button.pack(pady=10)
+        save_frame = ttk.Frame(self)
+        save_frame.pack(pady=10)
+        save_button = ttk.Button(save_frame, text="編集内容を保存", command=self.save_csv)
+        save_button.pack(side=tk.LEFT, padx=(0, 5))
+        self.edit_buttons = [resample_button, resample_all_button, sample_curve_button, speed_button,
+                             deviation_button, deviation_columns_button, save_button, add_trajectory_button]
+        if self.project_file:
+            project_button = ttk.Button(save_frame, text="プロジェクトを保存", command=self.save_project)
+            project_button.pack(side=tk.LEFT, padx=(5, 0))
+            self.edit_buttons.append(project_button)
+        for button in self.edit_buttons:
+            button.config(state=tk.DISABLED) # 軌跡を読み込むまでは押せないようにする
+
+        # バックグラウンド処理の状態表示
+        status_frame = ttk.Frame(self)
+        status_frame.pack(fill=tk.X, padx=10, pady=(0, 5))
+        self.status_label = ttk.Label(status_frame, text="")
+        self.status_label.pack(side=tk.LEFT)
+        self.cancel_button = ttk.Button(status_frame, text="キャンセル", command=self.worker.cancel_all, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT)
+        self.progress_bar = ttk.Progressbar(status_frame, length=200, mode='determinate', maximum=1.0)
+        self.progress_bar.pack(side=tk.RIGHT, padx=5)
+
+    def _update_status(self, runner):
+        if not runner.jobs:
+            self.status_label.config(text="")
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', value=0)
+            self.cancel_button.config(state=tk.DISABLED)
+            self.cancel_button.pack(side=tk.RIGHT, before=self.progress_bar)
+            return
+        job = runner.jobs[-1]
+        self.status_label.config(text=f"{job.label}: {job.message}")
+        if job.progress is None:
+            self.progress_bar.config(mode='indeterminate')
+            self.progress_bar.start(20)
+        else:
+            self.progress_bar.stop()
+            self.progress_bar.config(mode='determinate', value=job.progress)
+        # 起動時の読み込みなど止められないジョブだけが実行中なら、キャンセルボタンを隠す
+        if runner.cancellable:
+            self.cancel_button.config(state=tk.NORMAL)
+            self.cancel_button.pack(side=tk.RIGHT, before=self.progress_bar)
+        else:
+            self.cancel_button.pack_forget()
+
+    def _run_replace_job(self, label, error_label, success_message, fn, *args):
+        """軌跡全体を置き換える処理をワーカープロセスで実行し、完了したら履歴に記録して反映する"""
+        if self.worker.busy:
+            messagebox.showinfo("情報", "別の処理を実行中です。完了してから実行してください。")
+            return
+        version = self.data_version
+
+        def on_done(new_data):
+            if self.data_version != version:
+                messagebox.showwarning("警告", f"{label}の実行中にデータが編集されたため、結果を破棄しました。")
+                return
+            record = ReplaceEdit(self.data, label)
+            self.data = new_data
+            self._on_data_changed()
+            self._push_edit(self._with_auto_speed_profile(record))
+            self.plot_data()
+            messagebox.showinfo("成功", success_message)
+
+        def on_error(e):
+            print(f"{error_label}エラー: {e}")
+            messagebox.showerror("エラー", f"{error_label}中にエラーが発生しました: {e}")
+
+        self.worker.submit(label, fn, *args, use_process=True, on_done=on_done, on_error=on_error)
 
     def sample_curve_points(self, num_points=None):
         if num_points is None:
@@ -258,126 +807,436 @@ class CsvCurveEditor(tk.Tk):
         if len(self.data) < 4:
             messagebox.showwarning("警告", "サンプリングするには点が少なすぎます。")
             return
-        try:
-            from scipy.spatial import KDTree
-            self.save_history_state()
-            old_data = [row.copy() for row in self.data]
-            points = np.array([[row['x'] for row in old_data], [row['y'] for row in old_data]])
-            tck, u = splprep(points, s=0, per=True)
-            u_new = np.linspace(u.min(), u.max(), num_points)
-            new_points = splev(u_new, tck, der=0)
-            original_points = np.column_stack((points[0], points[1]))
-            tree = KDTree(original_points)
-            new_data = []
-            for i in range(num_points):
-                x_new, y_new = new_points[0][i], new_points[1][i]
-                _, idx = tree.query([x_new, y_new])
-                base_row = old_data[idx].copy()
-                base_row['x'] = x_new
-                base_row['y'] = y_new
-                new_data.append(base_row)
-            self.data = new_data
-            self.plot_data()
-            messagebox.showinfo("成功", f"曲線上を{num_points}点でサンプリングしました。")
-        except Exception as e:
-            print(f"曲線サンプリングエラー: {e}")
-            messagebox.showerror("エラー", f"曲線サンプリング中にエラーが発生しました: {e}")
-
-    def plot_data(self):
-        self.ax.clear()
+        self._run_replace_job("曲線上サンプリング", "曲線サンプリング", f"曲線上を{num_points}点でサンプリングしました。",
+                              curve_engine.sample_closed_curve, self.data, num_points, ORIENTATION_FROM_TANGENT)
 
-        fg_color = "white" if self.dark_mode else "black"
-        plot_bg_color = "#3c3c3c" if self.dark_mode else "white"
+    def setup_plot(self):
+        """グリッドと動的アーティストを一度だけ生成する。背景とレーンは setup_layers() で追加する"""
         grid_color = '#555555' if self.dark_mode else '#cccccc'
-        
-        self.ax.set_facecolor(plot_bg_color)
-        self.ax.set_xlabel("X", color=fg_color)
-        self.ax.set_ylabel("Y", color=fg_color)
         self.ax.grid(True, color=grid_color)
-        self.ax.axis('equal')
-        self.ax.tick_params(axis='x', colors=fg_color)
-        self.ax.tick_params(axis='y', colors=fg_color)
-        for spine in self.ax.spines.values():
-            spine.set_edgecolor(fg_color)
-
-        if self.background_data:
-            bg_points = np.array([[row['x'] for row in self.background_data], [row['y'] for row in self.background_data]])
-            self.ax.plot(bg_points[0], bg_points[1], '-', color=BACKGROUND_CURVE_COLOR, linewidth=1, alpha=0.7, zorder=0)
-            self.ax.scatter(bg_points[0], bg_points[1], color=BACKGROUND_CURVE_COLOR, s=5, zorder=0)
+        self.ax.set_aspect('equal', adjustable='datalim')
+        self.background_line = self.background_scatter = None
+        self.lane_lines = []
+        self.inactive_line, = self.ax.plot([], [], '-', color=INACTIVE_CURVE_COLOR, linewidth=1, alpha=0.6, zorder=2)
+
+        # ドラッグ中に更新されるアーティストは animated=True にしてブリッティングで描画する
+        self.curve_line, = self.ax.plot([], [], '-', color=MAIN_CURVE_COLOR, zorder=4, animated=True)
+        self.violation_line, = self.ax.plot([], [], '-', color=LANE_VIOLATION_COLOR, linewidth=3, zorder=4, animated=True)
+        # 参照線からのずれの表示。曲線をずれの大きさで色分けした線分の集まりとして重ねる
+        self.deviation_colormap = colormaps[DEVIATION_COLORMAP]
+        self.deviation_norm = Normalize(vmin=-DEVIATION_COLOR_RANGE, vmax=DEVIATION_COLOR_RANGE)
+        self.deviation_curve = LineCollection([], cmap=self.deviation_colormap, norm=self.deviation_norm,
+                                              linewidths=4, zorder=4, animated=True)
+        self.ax.add_collection(self.deviation_curve, autolim=False)
+        # 受信した車両の走行軌跡と現在位置。編集用のアーティストとは別に描き直す (_blit_pose を参照)
+        self.pose_trail_line, = self.ax.plot([], [], '-', color=POSE_TRAIL_COLOR, linewidth=1.5, alpha=0.8,
+                                             zorder=7, animated=True)
+        self.pose_marker, = self.ax.plot([], [], linestyle='none', marker=(3, 0, 0), markersize=12,
+                                         color=POSE_TRAIL_COLOR, markeredgecolor='black', zorder=8, animated=True)
+        self.point_scatter = self.ax.scatter([], [], s=POINT_SIZE, zorder=5, animated=True)
+        self.violation_scatter = self.ax.scatter([], [], marker='x', color=LANE_VIOLATION_COLOR,
+                                                 s=SELECTED_POINT_HIGHLIGHT_SIZE, zorder=6, animated=True)
+        self._curve_clearance = np.inf
+        self.selected_scatter = self.ax.scatter([], [], facecolors='none', edgecolors=SELECTED_POINT_EDGE_COLOR,
+                                                s=SELECTED_POINT_HIGHLIGHT_SIZE, linewidth=2, zorder=6, animated=True)
+        self.index_labels = []
+        self._label_slots = {}
+        self._static_labels = None # 背景の画像に描いてあるインデックス番号 [(番号, 位置)]。変わったら背景を描き直す
+        self._blit_background = None
+        self._pose_background = None # 編集用のアーティストまで描いた画像。走行軌跡だけを描き直すときに使う
+        self.profile_text = None
+        if PROFILER is not None:
+            self.profile_text = self.ax.text(0.01, 0.99, "", transform=self.ax.transAxes, va='top', ha='left',
+                                             fontsize=8, family='monospace', color='white', zorder=9, animated=True,
+                                             bbox=dict(facecolor='black', alpha=0.6, edgecolor='none'))
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+        self.canvas.mpl_connect('resize_event', lambda event: self._refresh_view())
+        self._refresh_view()
+
+    def setup_layers(self):
+        """読み込んだ背景とレーンの静的レイヤーを追加し、全体が収まる表示範囲にする"""
+        # 背景とレーンは表示範囲に合わせて間引いた点だけを描画する (_refresh_view で更新)
+        if len(self.background_data):
+            self.background_line, = self.ax.plot([], [], '-', color=BACKGROUND_CURVE_COLOR, linewidth=1, alpha=0.7, zorder=0)
+            self.background_scatter = self.ax.scatter([], [], color=BACKGROUND_CURVE_COLOR, s=5, zorder=0)
+            self.ax.update_datalim(self.background_data)
 
         lane_color = LANE_BOUNDARY_COLOR
-        if self.inner_lane_data:
-            inner_points = np.array([[row['x'] for row in self.inner_lane_data], [row['y'] for row in self.inner_lane_data]])
-            self.ax.plot(inner_points[0], inner_points[1], '--', color=lane_color, linewidth=0.5, zorder=1)
-        if self.outer_lane_data:
-            outer_points = np.array([[row['x'] for row in self.outer_lane_data], [row['y'] for row in self.outer_lane_data]])
-            self.ax.plot(outer_points[0], outer_points[1], '--', color=lane_color, linewidth=0.5, zorder=1)
-
-        if not self.data:
+        for lane in (self.inner_lane_data, self.outer_lane_data):
+            if len(lane):
+                line, = self.ax.plot([], [], '--', color=lane_color, linewidth=0.5, zorder=1)
+                self.lane_lines.append((line, lane))
+                self.ax.update_datalim(lane)
+
+        if self.data:
+            self.ax.update_datalim(self.data.xy)
+        self.ax.autoscale_view()
+        if self.initial_view:
+            # プロジェクトに保存されていた表示範囲を復元する。ウィンドウの縦横比が保存時と
+            # 異なっても縦横比を保つよう、横の範囲に合わせて縦の幅を決め、中心だけを復元する
+            xlim = self.initial_view["xlim"]
+            yc = sum(self.initial_view["ylim"]) / 2
+            box = self.ax.get_window_extent()
+            half_height = (xlim[1] - xlim[0]) * box.height / box.width / 2
+            self.ax.set_xlim(xlim)
+            self.ax.set_ylim(yc - half_height, yc + half_height)
+        self._refresh_view()
+
+    def _pixel_size(self):
+        """現在の表示で1ピクセルに相当するデータ座標の長さ"""
+        xlim = self.ax.get_xlim()
+        return (xlim[1] - xlim[0]) / max(self.ax.bbox.width, 1.0)
+
+    def _view_state(self):
+        return tuple(self.ax.get_xlim()), tuple(self.ax.get_ylim()), self._pixel_size()
+
+    def _update_curve_line(self, changed_indices=None):
+        # スプラインはバージョンと表示範囲ごとにキャッシュされ、ドラッグ中は動いた点の周辺だけ再計算される。
+        # 局所的に更新できない場合の全体の再計算は、ポインタが止まるか離されるまで行わない
+        x, y = self.spline_preview.evaluate(self.data.xy, self.data_version, self._view_state(),
+                                            changed_indices, local_only=changed_indices is not None)
+        self.curve_line.set_data(x, y)
+        if self.lane_field:
+            self._update_curve_violations(x, y)
+        if self.show_deviation and self.reference_line:
+            self._update_curve_deviation(x, y)
+
+    def _update_curve_violations(self, x, y):
+        """表示範囲内の曲線のうち、レーン境界に近づきすぎた部分を強調表示する"""
+        curve = np.column_stack((x, y))
+        visible = lod.view_mask(curve, self.ax.get_xlim(), self.ax.get_ylim())
+        clearance = np.full(len(curve), np.inf)
+        clearance[visible] = self.lane_field.clearance(curve[visible])
+        self._curve_clearance = clearance.min() if len(clearance) else np.inf
+
+        violated = clearance < LANE_MIN_CLEARANCE
+        # 違反したサンプルの前後の線分まで描く
+        shown = violated.copy()
+        shown[1:] |= violated[:-1]
+        shown[:-1] |= violated[1:]
+        self.violation_line.set_data(np.where(shown, x, np.nan), np.where(shown, y, np.nan))
+
+    def _update_curve_deviation(self, x, y):
+        """表示範囲内の曲線を参照線からの横方向のずれで色分けする
+
+        前回から動いていないサンプルは前回の結果を使い、ドラッグで動いた部分だけを計算し直す。
+        """
+        curve = np.column_stack((x, y))
+        if len(curve) < 2:
+            self.deviation_curve.set_segments([])
+            return
+        offsets = np.full(len(curve), np.nan)
+        if self._curve_deviation is not None and len(self._curve_deviation[0]) == len(curve):
+            previous, previous_offsets = self._curve_deviation
+            unchanged = (previous == curve).all(axis=1)
+            offsets[unchanged] = previous_offsets[unchanged]
+        # 表示範囲をまたぐ線分も描くため、範囲内のサンプルの両隣まで計算する
+        visible = lod.view_mask(curve, self.ax.get_xlim(), self.ax.get_ylim())
+        near = visible.copy()
+        near[1:] |= visible[:-1]
+        near[:-1] |= visible[1:]
+        missing = np.flatnonzero(near & np.isnan(offsets) & np.isfinite(curve).all(axis=1))
+        if len(missing):
+            offsets[missing] = self.reference_line.project(curve[missing])[1]
+        self._curve_deviation = (curve, offsets)
+
+        # 隣り合うサンプルを結ぶ線分を両端のずれの平均で段階分けし、同じ段階が続く区間を1本の線にまとめる
+        # (線分を1本ずつ渡すと、LineCollection の Path の作成に時間がかかる)
+        levels = np.rint(self.deviation_norm((offsets[:-1] + offsets[1:]) / 2).filled(np.nan)
+                         * (DEVIATION_COLOR_LEVELS - 1))
+        levels = np.clip(levels, 0, DEVIATION_COLOR_LEVELS - 1)
+        levels[~(near[:-1] & near[1:])] = np.nan
+        boundaries = np.flatnonzero(np.diff(levels) != 0) + 1 # NaN どうしも != で区切られる
+        starts = np.concatenate(([0], boundaries))
+        stops = np.append(boundaries, len(levels))
+        runs = [(start, stop) for start, stop in zip(starts, stops) if not np.isnan(levels[start])]
+        self.deviation_curve.set_segments([curve[start:stop + 1] for start, stop in runs])
+        self.deviation_curve.set_array(self.deviation_norm.inverse(
+            np.array([levels[start] for start, _ in runs]) / (DEVIATION_COLOR_LEVELS - 1)))
+
+    def _refresh_view(self):
+        """表示範囲に合わせて背景・レーン・インデックス番号を間引き直し、全体を再描画する"""
+        self.ax.apply_aspect()
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
+        pixel_size = self._pixel_size()
+
+        if self.background_line is not None:
+            self.background_line.set_data(*lod.decimate_polyline(self.background_data, xlim, ylim, pixel_size))
+            self.background_scatter.set_offsets(lod.decimate_points(self.background_data, xlim, ylim, pixel_size))
+        for line, lane in self.lane_lines:
+            line.set_data(*lod.decimate_polyline(lane, xlim, ylim, pixel_size))
+        self._update_inactive_line()
+
+        if self.data:
+            self._update_curve_line()
+            if SHOW_POINT_INDICES:
+                self._update_index_labels(self.data.xy)
+
+        self._blit_background = self._pose_background = None
+        self.canvas.draw_idle()
+
+    def _on_draw(self, event):
+        if self._window_created_at is not None:
+            self.startup_timer.record("ウィンドウの表示", self._window_created_at)
+            self._window_created_at = None
+        # 静的レイヤー描画直後の画像をキャッシュし、その上に動的アーティストを重ねる
+        self._blit_background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self._draw_animated()
+
+    def _animated_artists(self):
+        artists = [self.curve_line, self.deviation_curve, self.violation_line, self.point_scatter, self.violation_scatter,
+                   self.selected_scatter]
+        artists.extend(label for label in self._label_slots.values() if label.get_animated())
+        if self.selection_rect is not None:
+            artists.append(self.selection_rect)
+        if self.lasso_line is not None:
+            artists.append(self.lasso_line)
+        if self.profile_text is not None:
+            artists.append(self.profile_text)
+        return artists
+
+    def _draw_animated(self):
+        if self.profile_text is not None:
+            self._update_profile_text()
+        for artist in self._animated_artists():
+            self.ax.draw_artist(artist)
+        if self.pose_receiver is not None:
+            self._pose_background = self.canvas.copy_from_bbox(self.ax.bbox)
+            self.ax.draw_artist(self.pose_trail_line)
+            self.ax.draw_artist(self.pose_marker)
+
+    def _update_profile_text(self):
+        lines = PROFILER.summary_lines()
+        if self.data:
+            lines.append(f"points {len(self.data)} / selected {len(self.selected_indices)} / "
+                         f"labels {len(self._label_slots)} / curve {len(self.curve_line.get_xdata())}")
+        self.profile_text.set_text("\n".join(lines))
+
+    def _blit(self):
+        if self._blit_background is None:
             self.canvas.draw()
             return
+        self.canvas.restore_region(self._blit_background)
+        self._draw_animated()
+        self.canvas.blit(self.ax.bbox)
 
-        points = np.array([[row['x'] for row in self.data], [row['y'] for row in self.data]])
-        speeds = np.array([row.get('speed', 0) for row in self.data])
+    def start_pose_feed(self):
+        """車両の姿勢の受信を始め、走行軌跡を POSE_REFRESH_HZ 以下の頻度で描き直す"""
+        host, port = POSE_FEED_HOST, POSE_FEED_PORT
+        try:
+            self.pose_receiver = pose_feed.UdpPoseReceiver(pose_feed.PoseRingBuffer(POSE_TRAIL_LENGTH), host, port)
+        except OSError as e:
+            print(f"姿勢の受信エラー: {e}")
+            messagebox.showwarning("警告", f"{host}:{port} で車両の姿勢を受信できないため、走行軌跡を表示しません: {e}")
+            return
+        self.pose_receiver.start()
+        self._pose_received = 0
+        self._pose_job = self.after(int(1000 / POSE_REFRESH_HZ), self._refresh_pose)
+
+    def stop_pose_feed(self):
+        if self._pose_job is not None:
+            self.after_cancel(self._pose_job)
+            self._pose_job = None
+        if self.pose_receiver is not None:
+            self.pose_receiver.stop()
+            self.pose_receiver = None
+
+    def _refresh_pose(self):
+        """前回から新しい姿勢が届いていれば走行軌跡と現在位置を更新する"""
+        self._pose_job = self.after(int(1000 / POSE_REFRESH_HZ), self._refresh_pose)
+        buffer = self.pose_receiver.buffer
+        if buffer.received == self._pose_received:
+            return
+        self._pose_received = buffer.received
+        poses = buffer.latest()
+        self.pose_trail_line.set_data(poses[:, 1], poses[:, 2])
+        _, x, y, heading = poses[-1]
+        self.pose_marker.set_data([x], [y])
+        # 三角形の頂点 (既定では上向き) を進行方向に向ける
+        self.pose_marker.set_marker((3, 0, np.degrees(heading) - 90))
+        # ドラッグ中は次のフレームで編集用のアーティストと一緒に描かれるため、ここでは描かない
+        if self.drag_mode is None:
+            self._blit_pose()
+
+    def _blit_pose(self):
+        """編集用のアーティストまで描いた画像を戻し、走行軌跡と現在位置だけを描き直す"""
+        if self._pose_background is None:
+            self._blit()
+            return
+        self.canvas.restore_region(self._pose_background)
+        self.ax.draw_artist(self.pose_trail_line)
+        self.ax.draw_artist(self.pose_marker)
+        self.canvas.blit(self.ax.bbox)
+
+    def _update_index_labels(self, xy, indices=None):
+        """表示範囲内で重ならない点にだけインデックス番号を表示する
+
+        indices を指定した場合は、表示中の番号のうちその点の位置だけを更新する。
+        番号は数が多いとフレームごとに描くのが重いため、選択中 (ドラッグで動く) の点の番号だけを
+        animated にし、それ以外はキャッシュした背景の画像に描いておく。
+        """
+        xlim = self.ax.get_xlim()
+        ylim = self.ax.get_ylim()
+        dx = (xlim[1] - xlim[0]) * 0.01
+        dy = (ylim[1] - ylim[0]) * 0.01
+
+        if indices is not None:
+            for idx in indices:
+                label = self._label_slots.get(idx)
+                if label is not None:
+                    label.set_position((xy[idx, 0] + dx, xy[idx, 1] + dy))
+                    if not label.get_animated():
+                        self._blit_background = None # 背景に描いた番号が動いたので、背景から描き直す
+            return
+
+        shown = lod.visible_label_indices(xy, xlim, ylim, self._pixel_size(),
+                                          INDEX_LABEL_MIN_SPACING_PX, MAX_INDEX_LABELS)
+        fg_color = "white" if self.dark_mode else "black"
+        # テキストアーティストは使い回し、足りない分だけ作る
+        while len(self.index_labels) < len(shown):
+            self.index_labels.append(self.ax.text(0, 0, "", color=fg_color, fontsize=8, zorder=7, clip_on=True))
+        self._label_slots = {}
+        static_labels = []
+        for label, idx in zip(self.index_labels, shown.tolist()):
+            position = (xy[idx, 0] + dx, xy[idx, 1] + dy)
+            label.set_text(str(idx))
+            label.set_position(position)
+            label.set_visible(True)
+            label.set_animated(idx in self.selected_indices)
+            if not label.get_animated():
+                static_labels.append((idx, position))
+            self._label_slots[idx] = label
+        for label in self.index_labels[len(shown):]:
+            label.set_visible(False)
+        if static_labels != self._static_labels:
+            self._static_labels = static_labels
+            self._blit_background = None
+
+    def plot_data(self, changed_indices=None):
+        """動的アーティストのデータだけを更新してブリッティングで再描画する
+
+        changed_indices を指定すると、インデックスラベルはその点だけ更新する。
+        """
+        if not self.data:
+            self.point_scatter.set_offsets(np.empty((0, 2)))
+            self.selected_scatter.set_offsets(np.empty((0, 2)))
+            self.curve_line.set_data([], [])
+            self._blit()
+            return
 
-        if 'speed' in self.fieldnames and len(speeds) > 0:
-            cmap = plt.get_cmap('jet')
-            norm = plt.Normalize(vmin=speeds.min(), vmax=speeds.max())
-            colors = cmap(norm(speeds))
-            self.ax.scatter(points[0], points[1], c=colors, s=POINT_SIZE, zorder=5)
+        speeds = self.data.numeric_column('speed')
+
+        self.point_scatter.set_offsets(self.data.xy)
+        if self.show_deviation and len(self.point_deviation) == len(self.data):
+            # ずれの表示中は、点も速度の代わりにずれで色分けする
+            self.point_scatter.set_facecolors(self.deviation_colormap(self.deviation_norm(self.point_deviation)))
+            self._update_deviation_label()
+        elif speeds is not None and len(speeds) > 0:
+            cmap = colormaps['jet']
+            norm = Normalize(vmin=speeds.min(), vmax=speeds.max())
+            self.point_scatter.set_facecolors(cmap(norm(speeds)))
         else:
-            self.ax.scatter(points[0], points[1], color=MAIN_CURVE_COLOR, s=POINT_SIZE, zorder=5)
+            self.point_scatter.set_facecolors(MAIN_CURVE_COLOR)
 
+        # 点数が変わる操作(曲線上サンプリングや元に戻す)の後は範囲外の選択を外す
+        self.selected_indices = {i for i in self.selected_indices if i < len(self.data)}
         if self.selected_indices:
-            selected_points = np.array([[self.data[i]['x'] for i in self.selected_indices],
-                                        [self.data[i]['y'] for i in self.selected_indices]])
-            self.ax.scatter(selected_points[0], selected_points[1],
-                            facecolors='none', edgecolors=SELECTED_POINT_EDGE_COLOR, s=SELECTED_POINT_HIGHLIGHT_SIZE, linewidth=2, zorder=6)
+            selected = sorted(self.selected_indices)
+            self.selected_scatter.set_offsets(self.data.xy[selected])
+        else:
+            self.selected_scatter.set_offsets(np.empty((0, 2)))
 
         if SHOW_POINT_INDICES:
-            try:
-                xlim = self.ax.get_xlim()
-                ylim = self.ax.get_ylim()
-                dx = (xlim[1] - xlim[0]) * 0.01
-                dy = (ylim[1] - ylim[0]) * 0.01
-            except Exception:
-                dx = dy = 0.5
-            for idx in range(points.shape[1]):
-                self.ax.text(points[0][idx] + dx, points[1][idx] + dy, str(idx), color=fg_color, fontsize=8, zorder=7)
-
-        if len(self.data) > 3:
-            try:
-                tck, u = splprep(points, s=0, per=True) # スムージングなし(s=0)に固定
-                unew = np.linspace(u.min(), u.max(), 1000)
-                xnew, ynew = splev(unew, tck, der=0)
-                self.ax.plot(xnew, ynew, '-', color=MAIN_CURVE_COLOR, zorder=4)
-            except Exception:
-                self.ax.plot(np.append(points[0], points[0][0]), np.append(points[1], points[1][0]), '-', color=MAIN_CURVE_COLOR, zorder=4)
+            self._update_index_labels(self.data.xy, changed_indices)
+
+        self._update_curve_line(changed_indices)
+        if self.lane_field:
+            self._update_violations()
+
+        self._blit()
+
+    def _update_deviation_label(self):
+        offsets = self.point_deviation
+        magnitude = np.abs(offsets)
+        if not np.isfinite(magnitude).any():
+            self.deviation_label.config(text="参照線からのずれ: -")
+            return
+        worst = int(np.nanargmax(magnitude))
+        self.deviation_label.config(
+            text=f"参照線からのずれ 最大: {offsets[worst]:+.2f} m (#{worst}) / 平均: {np.nanmean(magnitude):.2f} m "
+                 f"(左が正)")
+
+    def toggle_deviation(self):
+        """参照線 (背景の軌跡) からのずれの色分け表示を切り替える"""
+        if not self.reference_line:
+            messagebox.showinfo("情報", "参照線 (背景の軌跡) が読み込まれていないか、準備中です。")
+            return
+        self.show_deviation = not self.show_deviation
+        self._curve_deviation = None
+        if self.show_deviation:
+            self._update_deviation()
         else:
-            self.ax.plot(np.append(points[0], points[0][0]), np.append(points[1], points[1][0]), '-', color=MAIN_CURVE_COLOR, zorder=4)
-        
-        if self.drag_mode == 'selection' and self.selection_rect:
-            self.ax.add_patch(self.selection_rect)
+            self.point_deviation = np.empty(0)
+            self.deviation_curve.set_segments([])
+            self.deviation_label.config(text="")
+        self.plot_data()
 
-        self.canvas.draw()
+    def add_deviation_columns(self):
+        """各点の参照線までの距離と横方向のずれを列として追加する (保存するとCSVに書き出される)"""
+        if not self.reference_line:
+            messagebox.showinfo("情報", "参照線 (背景の軌跡) が読み込まれていないか、準備中です。")
+            return
+        distance, offset = self.reference_line.project(self.data.xy)
+        record = CompoundEdit([ColumnEdit(name, self.data.column(name), values) for name, values in
+                               ((deviation.DISTANCE_COLUMN, distance), (deviation.OFFSET_COLUMN, offset))])
+        record.redo(self.data)
+        self._push_edit(record)
+        self._on_data_changed(record.changed_indices)
+        self.plot_data()
+        messagebox.showinfo("成功", f"参照線からのずれを列 {deviation.DISTANCE_COLUMN}, {deviation.OFFSET_COLUMN} に"
+                                    f"追加しました。点を動かした後はもう一度実行してください。")
+
+    def _update_violations(self):
+        """レーン境界に近づきすぎた点を強調表示し、最小クリアランスを表示する"""
+        violated = self.point_clearance < LANE_MIN_CLEARANCE
+        self.violation_scatter.set_offsets(self.data.xy[violated])
+        nearest = int(self.point_clearance.argmin())
+        curve_text = f"{self._curve_clearance:.2f} m" if np.isfinite(self._curve_clearance) else "-"
+        self.clearance_label.config(
+            text=f"最小クリアランス 点: {self.point_clearance[nearest]:.2f} m (#{nearest}) / "
+                 f"曲線(表示範囲): {curve_text} / 違反: {int(violated.sum())}点")
 
     def connect_events(self):
         self.canvas.mpl_connect('button_press_event', self.on_press)
         self.canvas.mpl_connect('button_release_event', self.on_release)
         self.canvas.mpl_connect('motion_notify_event', self.on_motion)
+        self.canvas.mpl_connect('scroll_event', self.on_scroll)
         self.bind_all("<Control-z>", self.undo)
         self.bind_all("<Control-y>", self.redo)
+        self.bind_all("<Control-Next>", lambda event: self._switch_relative(1))
+        self.bind_all("<Control-Prior>", lambda event: self._switch_relative(-1))
+
+    def on_scroll(self, event):
+        if event.inaxes != self.ax:
+            return
+        scale = 1 / ZOOM_STEP if event.button == 'up' else ZOOM_STEP
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
+        self.ax.set_xlim(event.xdata + (np.array(xlim) - event.xdata) * scale)
+        self.ax.set_ylim(event.ydata + (np.array(ylim) - event.ydata) * scale)
+        self._refresh_view()
 
     def on_press(self, event):
         if event.inaxes != self.ax:
             return
 
-        points = np.array([[row['x'] for row in self.data], [row['y'] for row in self.data]])
-        d = np.sqrt((points[0] - event.xdata)**2 + (points[1] - event.ydata)**2)
-        
-        clicked_on_point = d.min() < self._epsilon
-        if clicked_on_point:
-            clicked_index = d.argmin()
+        if event.button == 3:
+            # 右ドラッグで表示範囲を移動する
+            self.drag_mode = 'pan'
+            self.pan_start = (event.x, event.y, self.ax.get_xlim(), self.ax.get_ylim())
+            return
+
+        clicked_index = self.point_index.nearest(event.xdata, event.ydata, self._pick_radius(event))
+        if clicked_index is not None:
             
             if clicked_index in self.selected_indices:
                 self.drag_mode = 'move'
@@ -387,46 +1246,118 @@ class CsvCurveEditor(tk.Tk):
                 self.drag_mode = 'move'
 
             if self.drag_mode == 'move':
-                self.save_history_state()
-                self.original_data_on_drag = [row.copy() for row in self.data]
+                self.original_data_on_drag = self.data.xy[sorted(self.selected_indices)]
                 self.drag_start_pos = (event.xdata, event.ydata)
 
+        elif event.key == 'shift':
+            # Shift を押しながらドラッグすると投げ縄選択
+            self.drag_mode = 'lasso'
+            self.selected_indices.clear()
+            self.lasso_vertices = [(event.xdata, event.ydata)]
+            self.lasso_line, = self.ax.plot([event.xdata], [event.ydata], '--', color='blue', zorder=8, animated=True)
+
         else:
             self.drag_mode = 'selection'
             self.selected_indices.clear()
             self.rect_start_pos = (event.xdata, event.ydata)
             self.selection_rect = Rectangle(self.rect_start_pos, 0, 0,
                                             facecolor='blue', alpha=0.2,
-                                            edgecolor='blue', linestyle='--', zorder=8)
+                                            edgecolor='blue', linestyle='--', zorder=8, animated=True)
             self.ax.add_patch(self.selection_rect)
 
         self.plot_data()
 
+    def _pick_radius(self, event):
+        """画面上の PICK_RADIUS_PX をデータ座標の距離に換算する"""
+        inv = self.ax.transData.inverted()
+        x0, y0 = inv.transform((event.x, event.y))
+        x1, y1 = inv.transform((event.x + PICK_RADIUS_PX, event.y))
+        return np.hypot(x1 - x0, y1 - y0)
+
     def on_release(self, event):
+        self._flush_motion()
+        if self._settle_job is not None:
+            self.after_cancel(self._settle_job)
+            self._settle_job = None
+
         if self.drag_mode == 'selection' and self.selection_rect:
+            # 軸外で離された場合にも対応するため、矩形自体の範囲を使う
             x0, y0 = self.rect_start_pos
-            x1, y1 = event.xdata, event.ydata
-            
-            min_x, max_x = min(x0, x1), max(x0, x1)
-            min_y, max_y = min(y0, y1), max(y0, y1)
-
-            for i, row in enumerate(self.data):
-                if min_x <= row['x'] <= max_x and min_y <= row['y'] <= max_y:
-                    self.selected_indices.add(i)
+            x1 = x0 + self.selection_rect.get_width()
+            y1 = y0 + self.selection_rect.get_height()
+            self.selected_indices.update(self.point_index.query_rect(x0, y0, x1, y1).tolist())
 
             self.selection_rect.remove()
             self.selection_rect = None
             self.plot_data()
 
+        elif self.drag_mode == 'lasso' and self.lasso_line:
+            self.selected_indices.update(self.point_index.query_polygon(self.lasso_vertices).tolist())
+            self.lasso_line.remove()
+            self.lasso_line = None
+            self.lasso_vertices = []
+            self.plot_data()
+
         elif self.drag_mode == 'move':
-            if self.selected_indices:
-                 self._last_edited_index = list(self.selected_indices)[0]
+            if self.selected_indices and self.original_data_on_drag is not None:
+                indices = sorted(self.selected_indices)
+                moved = self.data.xy[indices]
+                if not np.array_equal(moved, self.original_data_on_drag):
+                    # ドラッグ中は局所的に更新していたスプラインを全体で当てはめ直す
+                    self._on_data_changed(indices)
+                    self._push_edit(self._with_auto_speed_profile(PointEdit(indices, self.original_data_on_drag, moved)))
+                    self.plot_data()
+                self._last_edited_index = indices[0]
 
         self.drag_mode = None
+        self.pan_start = None
         self.original_data_on_drag = None
         self.drag_start_pos = None
 
     def on_motion(self, event):
+        """マウス移動は最新の1件だけを保持し、再描画は FRAME_BUDGET_MS ごとにまとめて行う"""
+        if self.drag_mode is None:
+            return
+        self._pending_motion = event
+        if self._motion_job is None:
+            elapsed_ms = (time.perf_counter() - self._last_frame_time) * 1000
+            self._motion_job = self.after(max(0, int(FRAME_BUDGET_MS - elapsed_ms)), self._process_motion)
+
+    def _flush_motion(self):
+        """処理待ちのマウス移動があれば即座に反映する"""
+        if self._motion_job is not None:
+            self.after_cancel(self._motion_job)
+            self._process_motion()
+
+    def _process_motion(self):
+        self._motion_job = None
+        event, self._pending_motion = self._pending_motion, None
+        if event is None:
+            return
+        self._last_frame_time = time.perf_counter()
+        self._apply_motion(event)
+        if self.drag_mode == 'move':
+            # ポインタが止まったら重い処理を行うよう、タイマーを掛け直す
+            if self._settle_job is not None:
+                self.after_cancel(self._settle_job)
+            self._settle_job = self.after(DRAG_SETTLE_MS, self._on_drag_settled)
+
+    def _on_drag_settled(self):
+        self._settle_job = None
+        if self.drag_mode == 'move':
+            self.plot_data()
+
+    def _apply_motion(self, event):
+        if self.drag_mode == 'pan' and self.pan_start:
+            x0, y0, xlim, ylim = self.pan_start
+            pixel_size = (xlim[1] - xlim[0]) / max(self.ax.bbox.width, 1.0)
+            shift_x = (event.x - x0) * pixel_size
+            shift_y = (event.y - y0) * pixel_size
+            self.ax.set_xlim(xlim[0] - shift_x, xlim[1] - shift_x)
+            self.ax.set_ylim(ylim[0] - shift_y, ylim[1] - shift_y)
+            self._refresh_view()
+            return
+
         if event.inaxes != self.ax:
             return
 
@@ -436,18 +1367,22 @@ class CsvCurveEditor(tk.Tk):
             height = event.ydata - y0
             self.selection_rect.set_width(width)
             self.selection_rect.set_height(height)
-            self.canvas.draw_idle()
+            self._blit()
 
-        elif self.drag_mode == 'move' and self.selected_indices and self.original_data_on_drag:
+        elif self.drag_mode == 'lasso' and self.lasso_line:
+            self.lasso_vertices.append((event.xdata, event.ydata))
+            self.lasso_line.set_data(*zip(*self.lasso_vertices, self.lasso_vertices[0]))
+            self._blit()
+
+        elif self.drag_mode == 'move' and self.selected_indices and self.original_data_on_drag is not None:
             dx = event.xdata - self.drag_start_pos[0]
             dy = event.ydata - self.drag_start_pos[1]
             
-            for index in self.selected_indices:
-                original_row = self.original_data_on_drag[index]
-                self.data[index]['x'] = original_row['x'] + dx
-                self.data[index]['y'] = original_row['y'] + dy
+            indices = sorted(self.selected_indices)
+            self.data.xy[indices] = self.original_data_on_drag + (dx, dy)
+            self._on_data_changed(indices)
             
-            self.plot_data()
+            self.plot_data(changed_indices=self.selected_indices)
 
     def resample_range(self):
         if self._last_edited_index is None:
@@ -457,35 +1392,17 @@ class CsvCurveEditor(tk.Tk):
         if len(self.data) < 4:
             return
 
-        self.save_history_state()
-        
-        range_size = RESAMPLE_RANGE_SIZE
-        num_points = len(self.data)
-
-        start_index = (self._last_edited_index - range_size + num_points) % num_points
-        end_index = (self._last_edited_index + range_size + 1 + num_points) % num_points
-
-        indices = []
-        if start_index < end_index:
-            indices = list(range(start_index, end_index))
-        else:
-            indices = list(range(start_index, num_points)) + list(range(0, end_index))
-
-        if len(indices) < 4:
-            messagebox.showwarning("警告", "リサンプリングするには範囲内の点が少なすぎます。")
+        try:
+            indices, new_points = curve_engine.resample_window(self.data, self._last_edited_index, RESAMPLE_RANGE_SIZE)
+        except ValueError as e:
+            messagebox.showwarning("警告", str(e))
             return
 
-        range_points_orig = [self.data[i] for i in indices]
-        range_points = np.array([[p['x'] for p in range_points_orig], [p['y'] for p in range_points_orig]])
-
         try:
-            tck, u = splprep(range_points, s=0, per=False) # スムージングなし(s=0)に固定
-            u_new = np.linspace(u.min(), u.max(), len(indices))
-            new_points = splev(u_new, tck, der=0)
-            
-            for i, idx in enumerate(indices):
-                self.data[idx]['x'] = new_points[0][i]
-                self.data[idx]['y'] = new_points[1][i]
+            record = PointEdit(indices, self.data.xy[indices], new_points)
+            self.data.xy[indices] = new_points
+            self._on_data_changed(indices)
+            self._push_edit(self._with_auto_speed_profile(record))
 
             self.plot_data()
             messagebox.showinfo("成功", "選択範囲のリサンプリングが完了しました。")
@@ -499,56 +1416,128 @@ class CsvCurveEditor(tk.Tk):
             if len(self.data) < 4:
                 return
 
-            self.save_history_state()
+            self._run_replace_job("全体リサンプリング", "リサンプリング", "全体の再サンプリングが完了しました。",
+                                  curve_engine.resample_all, self.data, ORIENTATION_FROM_TANGENT)
+
+    def _speed_profile_edit(self):
+        """現在の形状から speed 列を計算し直して反映し、その変更の履歴レコードを返す"""
+        # プレビューと同じ当てはめ結果を使い、スプラインを二重に計算しない
+        fit = self.spline_preview.fit(self.data.xy, self.data_version)
+        speeds = speed_profile.compute_speeds(self.data.xy, fit, max_speed=SPEED_MAX,
+                                              max_lateral_accel=SPEED_MAX_LATERAL_ACCEL,
+                                              max_accel=SPEED_MAX_ACCEL, max_decel=SPEED_MAX_DECEL)
+        record = ColumnEdit(speed_profile.SPEED_COLUMN, self.data.column(speed_profile.SPEED_COLUMN), speeds)
+        record.redo(self.data)
+        return record
+
+    def _with_auto_speed_profile(self, record):
+        """AUTO_SPEED_PROFILE が有効なら speed 列を計算し直し、record とまとめた履歴レコードを返す"""
+        if not AUTO_SPEED_PROFILE or len(self.data) < curve_engine.MIN_SPLINE_POINTS:
+            return record
+        try:
+            return CompoundEdit([record, self._speed_profile_edit()])
+        except Exception as e:
+            print(f"速度プロファイル計算エラー: {e}")
+            return record
 
-            points = np.array([[row['x'] for row in self.data], [row['y'] for row in self.data]])
-            try:
-                tck, u = splprep(points, s=0, per=True) # スムージングなし(s=0)に固定
-                u_new = np.linspace(u.min(), u.max(), len(self.data))
-                new_points = splev(u_new, tck, der=0)
-
-                from scipy.spatial import KDTree
-                original_points = np.array([[row['x'], row['y']] for row in self.data])
-                tree = KDTree(original_points)
-
-                new_data_list = []
-                for i in range(len(self.data)):
-                    new_x, new_y = new_points[0][i], new_points[1][i]
-                    _, nearest_idx = tree.query([new_x, new_y])
-                    new_row = self.data[nearest_idx].copy()
-                    new_row['x'] = new_x
-                    new_row['y'] = new_y
-                    new_data_list.append(new_row)
-                
-                self.data = new_data_list
-
-                self.plot_data()
-                messagebox.showinfo("成功", "全体の再サンプリングが完了しました。")
-
-            except Exception as e:
-                print(f"リサンプリングエラー: {e}")
-                messagebox.showerror("エラー", f"リサンプリング中にエラーが発生しました: {e}")
+    def generate_speed_profile(self):
+        if len(self.data) < curve_engine.MIN_SPLINE_POINTS:
+            messagebox.showwarning("警告", "速度プロファイルを計算するには点が少なすぎます。")
+            return
 
-    def save_csv(self):
         try:
-            with open(self.output_file, mode='w', newline='', encoding='utf-8') as outfile:
-                writer = csv.DictWriter(outfile, fieldnames=self.fieldnames)
-                writer.writeheader()
-                data_to_write = []
-                for row in self.data:
-                    new_row = row.copy()
-                    for key, value in new_row.items():
-                        # 浮動小数点数を適切な精度で文字列に変換
-                        if isinstance(value, float):
-                            new_row[key] = f"{value:.8f}" # 小数点以下8桁の例
-                        else:
-                            new_row[key] = str(value)
-                    data_to_write.append(new_row)
-                writer.writerows(data_to_write)
-            messagebox.showinfo("成功", f"データが {self.output_file} に保存されました")
+            record = self._speed_profile_edit()
         except Exception as e:
-            messagebox.showerror("エラー", f"CSV保存中にエラーが発生しました: {e}")
+            print(f"速度プロファイル計算エラー: {e}")
+            messagebox.showerror("エラー", f"速度プロファイルの計算中にエラーが発生しました: {e}")
+            return
+
+        self._push_edit(record)
+        self._on_data_changed(record.changed_indices)
+        self.plot_data()
+        messagebox.showinfo("成功", f"速度プロファイルを計算しました。(最低 {record.after.min():.2f} m/s / "
+                                    f"最高 {record.after.max():.2f} m/s)")
+
+    def save_csv(self):
+        # 保存中も編集を続けられるよう、現在の内容のコピーをワーカースレッドで書き出す。
+        # 終了時にキャンセルされて保存しそこねないよう、進捗の報告 (キャンセルの確認) はしない
+        snapshot = self.data.copy()
+        output_file = self.output_file
+
+        def on_done(result):
+            if self.journal is not None and os.path.abspath(output_file) == os.path.abspath(self.source_file):
+                # 入力ファイルを上書きした場合は、現在の状態をチェックポイントとして記録し直す
+                try:
+                    self.journal.reset(self.data, journal.source_stamp(self.source_file))
+                except OSError as e:
+                    print(f"ジャーナル書き込みエラー: {e}")
+            messagebox.showinfo("成功", f"データが {output_file} に保存されました")
+
+        self.worker.submit(
+            "保存", lambda report: snapshot.to_csv(output_file), on_done=on_done,
+            on_error=lambda e: messagebox.showerror("エラー", f"CSV保存中にエラーが発生しました: {e}"))
+
+    def autosave(self):
+        """前回の自動保存から編集されていれば、自動保存ファイルへバックグラウンドで書き出す"""
+        self._autosave_job = self.after(int(AUTOSAVE_INTERVAL_SEC * 1000), self.autosave)
+        version = self.data_version
+        # ドラッグ中は点が動いている途中なので、次の機会に保存する
+        if version == self._autosaved_version or self.worker.busy or self.original_data_on_drag is not None:
+            return
+        snapshot = self.data.copy()
+        autosave_file = self.autosave_file
+
+        def on_done(result):
+            self._autosaved_version = version
+
+        self.worker.submit(
+            "自動保存", lambda report: snapshot.to_csv(autosave_file, progress=report),
+            on_done=on_done, on_error=lambda e: print(f"自動保存エラー: {e}"))
+
+    def on_close(self):
+        if self._autosave_job is not None:
+            self.after_cancel(self._autosave_job)
+            self._autosave_job = None
+        self.stop_pose_feed()
+        self.worker.shutdown()
+        # 編集しなかった軌跡のジャーナルは残さない
+        if self.journal is not None:
+            self.journal.close(remove_if_empty=True)
+        if self.session is not None:
+            for slot in self.session.slots:
+                if slot.state is not None and slot.state["journal"] is not None:
+                    slot.state["journal"].close(remove_if_empty=True)
+        if PROFILER is not None and PROFILE_TRACE_FILE:
+            __cd__ = os.path.dirname(os.path.abspath(__file__))
+            trace_path = os.path.join(__cd__, PROFILE_TRACE_FILE)
+            PROFILER.write_chrome_trace(trace_path)
+            print(f"計測結果を {trace_path} に書き出しました")
+        self.destroy()
+
+
+# 計測を有効にしたときだけメソッドを計測用の関数で包む (無効時は元のメソッドのまま)
+PROFILER = None
+if PROFILE:
+    PROFILER = profiling.Profiler()
+    PROFILER.instrument(CsvCurveEditor, {
+        'load_csv': 'io', 'load_project': 'io', 'save_project': 'io', 'load_lane_boundaries': 'io',
+        'load_background_data': 'io', 'save_csv': 'io', '_read_files': 'io', '_read_slot': 'io',
+        'switch_trajectory': 'session', '_show_active_slot': 'session', '_update_inactive_line': 'plot',
+        'on_press': 'event', 'on_release': 'event', 'on_scroll': 'event', '_process_motion': 'event',
+        'plot_data': 'plot', '_refresh_view': 'plot', '_update_index_labels': 'plot', '_update_curve_line': 'plot',
+        '_blit': 'draw', '_on_draw': 'draw', '_refresh_pose': 'draw',
+        '_on_data_changed': 'index', '_update_clearance': 'lane', '_update_curve_violations': 'lane',
+        '_update_violations': 'lane', 'undo': 'history', 'redo': 'history',
+        '_update_deviation': 'deviation', '_update_curve_deviation': 'deviation', '_build_indexes': 'deviation',
+        'resample_range': 'resample', '_speed_profile_edit': 'speed', '_append_journal': 'io',
+    })
+    PROFILER.instrument(curve_engine.SplinePreview, {'fit': 'spline', '_update_full': 'spline', '_update_local': 'spline'})
+    PROFILER.instrument(PointGridIndex, {'rebuild': 'index', 'update': 'index', 'query_rect': 'index',
+                                        'query_polygon': 'index', 'nearest': 'index'})
+    PROFILER.instrument(EditHistory, {'push': 'history'})
+    PROFILER.instrument(Trajectory, {'to_csv': 'io'})
+    PROFILER.instrument_jobs(BackgroundRunner)
 
 if __name__ == "__main__":
-    app = CsvCurveEditor(INPUT_FILE, OUTPUT_FILE, BACKGROUND_FILE)
+    app = CsvCurveEditor(INPUT_FILE, OUTPUT_FILE, BACKGROUND_FILE, PROJECT_FILE)
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""CSVの高速読み込みとバイナリキャッシュ
+
+レーン境界や背景軌跡など編集しない座標列は、初回読み込み時に
+``__csvcache__/`` へ .npy として保存し、次回以降はメモリマップで開く。
+キャッシュは元CSVのサイズと更新時刻をファイル名に含めるため、CSVが
+更新されると自動的に作り直される。
+"""
+import csv
+import functools
+import glob
+import os
+
+import numpy as np
+
+CACHE_DIR_NAME = "__csvcache__"
+
+
+@functools.lru_cache(maxsize=None)
+def _pandas():
+    """pandas を返す (なければ None)。読み込みに時間がかかるため、初めてCSVを解析するときに読み込む"""
+    try:
+        import pandas
+    except ImportError:
+        return None
+    return pandas
+
+
+def to_float_column(values):
+    """文字列の配列を float64 に変換する。変換できない要素は NaN にする"""
+    try:
+        return np.asarray(values, dtype=float)
+    except (ValueError, TypeError):
+        pass
+    pd = _pandas()
+    if pd is not None:
+        return pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float)
+    out = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        try:
+            out[i] = float(value)
+        except (ValueError, TypeError):
+            pass
+    return out
+
+
+def read_csv_columns(file_path, usecols=None):
+    """CSVを読み込み、(ヘッダー, 列名→文字列配列の辞書) を返す
+
+    pandas があれば C 実装のパーサーを使い、なければ csv モジュールで読む。
+    ヘッダーがなければ ValueError を送出する。
+    """
+    pd = _pandas()
+    if pd is not None:
+        try:
+            frame = pd.read_csv(file_path, dtype=str, keep_default_na=False, encoding='utf-8',
+                                usecols=lambda name: usecols is None or name in usecols)
+        except pd.errors.EmptyDataError:
+            raise ValueError("CSVファイルにヘッダーがありません。")
+        except pd.errors.ParserError:
+            # 列数が揃っていない行があれば csv モジュールで寛容に読み直す
+            frame = None
+        if frame is not None:
+            fieldnames = list(frame.columns)
+            return fieldnames, {name: frame[name].to_numpy(dtype=str) for name in fieldnames}
+
+    with open(file_path, mode='r', newline='', encoding='utf-8') as infile:
+        reader = csv.reader(infile)
+        header = next(reader, None)
+        if not header:
+            raise ValueError("CSVファイルにヘッダーがありません。")
+        width = len(header)
+        rows = [row[:width] + [''] * (width - len(row)) for row in reader if row]
+
+    table = np.array(rows, dtype=str).reshape(-1, width)
+    fieldnames = [name for name in header if usecols is None or name in usecols]
+    return fieldnames, {name: table[:, header.index(name)] for name in fieldnames}
+
+
+def _cache_path(file_path):
+    """キャッシュのパスを返す。ファイル名に元CSVのサイズと更新時刻を含める"""
+    stat = os.stat(file_path)
+    directory, name = os.path.split(os.path.abspath(file_path))
+    return os.path.join(directory, CACHE_DIR_NAME, f"{name}.{stat.st_size}-{stat.st_mtime_ns}.xy.npy")
+
+
+def _write_cache(file_path, cache_path, xy):
+    directory = os.path.dirname(cache_path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # 同じCSVの古いキャッシュを削除してから書き込む
+        stale = os.path.join(directory, glob.escape(os.path.basename(file_path)) + ".*.xy.npy")
+        for old in glob.glob(stale):
+            os.remove(old)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, 'wb') as outfile:
+            np.save(outfile, xy)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # 書き込めない場所ではキャッシュなしで動作する
+        pass
+
+
+def load_xy(file_path, use_cache=True):
+    """CSVの x, y 列を (N, 2) の配列として読み込む
+
+    数値に変換できない行は除外する。キャッシュがあれば読み取り専用の
+    メモリマップ配列を返す。x, y 列がなければ ValueError を送出する。
+    """
+    cache_path = _cache_path(file_path) if use_cache else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            return np.load(cache_path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+
+    fieldnames, raw = read_csv_columns(file_path, usecols=('x', 'y'))
+    if 'x' not in fieldnames or 'y' not in fieldnames:
+        raise ValueError(f"CSVファイル {os.path.basename(file_path)} には 'x' と 'y' の列が必要です。")
+    xy = np.column_stack((to_float_column(raw['x']), to_float_column(raw['y'])))
+    xy = np.ascontiguousarray(xy[np.isfinite(xy).all(axis=1)])
+
+    if cache_path:
+        _write_cache(file_path, cache_path, xy)
+    return xy
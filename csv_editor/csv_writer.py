@@ -0,0 +1,162 @@
+"""CSVの高速書き出し
+
+数値列は桁ごとに NumPy でまとめて文字コードに変換し、行単位の Python ループや
+f-string を使わずに書き出す。各列を「右詰めの固定幅バイト列 (余白は 0 バイト)」として
+横に並べ、最後に 0 バイトを取り除くと区切り文字付きの行が得られる。
+
+書き込みは一時ファイルに対して少しずつ行い、書き終えてから元のファイルへ置き換える。
+途中で失敗・キャンセルしても既存のファイルは壊れない。
+"""
+import csv
+import io
+import os
+import threading
+
+import numpy as np
+
+FLOAT_PRECISION = 8 # 小数点以下の桁数 (%.8f 相当)
+CHUNK_ROWS = 16384 # 一度に文字列化して書き込む行数
+LINE_TERMINATOR = "\r\n" # csv.writer の既定に合わせる
+# 整数部を 64bit 整数で正確に扱える絶対値の上限。超える値を含む列は np.char.mod で書く
+MAX_FAST_VALUE = 2.0 ** 53
+
+# 0000〜9999 の4文字を1つの uint32 として引く表
+_FOUR_DIGITS = np.array([f"{i:04d}".encode('ascii') for i in range(10000)]).view(np.uint32)
+_DOT = np.frombuffer(b'.', dtype=np.uint8)
+
+
+def _text_block(strings):
+    """文字列の配列を (行数, 最大バイト数) の uint8 配列にする。足りない分は 0 バイトで埋める"""
+    encoded = np.array([s.encode('utf-8') for s in strings], dtype=bytes)
+    if encoded.dtype.itemsize == 0:
+        return np.zeros((len(strings), 0), dtype=np.uint8)
+    return encoded.view(np.uint8).reshape(len(strings), encoded.dtype.itemsize)
+
+
+def _quote(value):
+    """csv.writer (QUOTE_MINIMAL) と同じ規則で必要な場合だけ引用符で囲む"""
+    if any(c in value for c in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _digit_block(values, num_digits):
+    """符号なし整数の配列を、先頭を 0 で埋めた num_digits 桁の文字コード (uint8) の配列にする
+
+    4桁ずつ区切り、0000〜9999 の文字列の表を引いて埋める。
+    """
+    groups = -(-num_digits // 4)
+    words = np.empty((len(values), groups), dtype=np.uint32)
+    rest = values
+    for g in range(groups - 1, -1, -1):
+        rest, group = np.divmod(rest, values.dtype.type(10000))
+        words[:, g] = np.take(_FOUR_DIGITS, group)
+    return words.view(np.uint8)[:, groups * 4 - num_digits:]
+
+
+def format_float_pieces(values, precision=FLOAT_PRECISION):
+    """float 配列を '%.{precision}f' で書いた文字列を、横に並べる uint8 配列のリストで返す
+
+    各配列は (行数, 幅) で、右詰めの余白は 0 バイト。整数部と小数部を別々に整数へ直して
+    文字コードに変換する。小数部は 10**precision 倍して偶数丸めするため、ちょうど中間に
+    近い値では最後の桁が printf と 1 異なることがある。
+    """
+    values = np.asarray(values, dtype=float)
+    magnitude = np.abs(values)
+    if len(values) == 0 or not np.isfinite(values).all() or magnitude.max() >= MAX_FAST_VALUE:
+        # NaN・無限大・極端に大きい値を含む列は printf 形式にそのまま任せる
+        return [_text_block(np.char.mod(f"%.{precision}f", values))]
+
+    scale = 10 ** precision
+    integer = np.floor(magnitude)
+    fraction = np.rint((magnitude - integer) * scale)
+    carry = fraction >= scale # 丸めで小数部が繰り上がった値
+    integer += carry
+    fraction -= carry * scale
+    largest = int(integer.max())
+    # 32bit で収まる場合は除算の速い uint32 で桁を求める
+    dtype = np.uint32 if max(largest, scale) < 2 ** 32 else np.uint64
+    integer = integer.astype(dtype)
+
+    sign = np.signbit(values).view(np.uint8) * np.uint8(ord('-'))
+    int_digits = len(str(largest))
+    int_block = _digit_block(integer, int_digits)
+    # 整数部の先頭の 0 は出力しない (1の位は常に出力する)
+    for k in range(int_digits - 1):
+        int_block[:, k] *= integer >= 10 ** (int_digits - 1 - k)
+    pieces = [sign[:, None], int_block]
+    if precision:
+        # '%.0f' と同じく、小数部がなければ小数点も書かない
+        pieces.append(np.broadcast_to(_DOT, (len(values), 1)))
+        pieces.append(_digit_block(fraction.astype(dtype), precision))
+    return pieces
+
+
+def _raw_block(raw):
+    """元の文字列の配列を _text_block() と同じ形の uint8 配列にする。バイト列ならコピーせずに並べ替えるだけ"""
+    if raw.dtype.kind != 'S':
+        return _text_block(raw)
+    if raw.dtype.itemsize == 0:
+        return np.zeros((len(raw), 0), dtype=np.uint8)
+    return np.ascontiguousarray(raw).view(np.uint8).reshape(len(raw), raw.dtype.itemsize)
+
+
+def _column_pieces(values, precision, original=None):
+    if values.dtype.kind == 'f':
+        if original is not None:
+            # 読み込んだときと値が同じ行は元の文字列をそのまま書き、変わった行だけ書式を揃える
+            parsed = original.astype(float)
+            unchanged = (parsed == values) | (np.isnan(parsed) & np.isnan(values))
+            if unchanged.all():
+                return [_raw_block(original)]
+            if unchanged.any():
+                formatted = np.char.mod(f"%.{precision}f", values)
+                if original.dtype.kind == 'S':
+                    formatted = np.char.encode(formatted, 'ascii')
+                return [_raw_block(np.where(unchanged, original, formatted))]
+        return format_float_pieces(values, precision)
+    return [_text_block([_quote(str(value)) for value in values])]
+
+
+def write_csv(file_path, fieldnames, columns, precision=FLOAT_PRECISION, progress=None, originals=None):
+    """列の配列のリストを CSV に書き出し、書き終えてから file_path へ置き換える
+
+    originals は columns と同じ並びの、読み込んだときの文字列の配列 (なければ None) のリスト。
+    数値列のうち値が元の文字列と同じ行は、書式を揃えずに元の文字列をそのまま書く。
+    progress を渡すと CHUNK_ROWS 行ごとに progress(書き込んだ割合, メッセージ) を呼ぶ。
+    progress が例外を送出すると書き込みを中止し、既存のファイルはそのまま残る。
+    """
+    num_rows = len(columns[0]) if columns else 0
+    originals = originals or [None] * len(columns)
+    header = io.StringIO()
+    csv.writer(header, lineterminator=LINE_TERMINATOR).writerow(fieldnames)
+
+    separators = [np.frombuffer(b',', dtype=np.uint8)] * (len(columns) - 1)
+    separators.append(np.frombuffer(LINE_TERMINATOR.encode('ascii'), dtype=np.uint8))
+
+    # 同じファイルへの保存が重なっても一時ファイルが衝突しないよう、スレッドごとに名前を変える
+    tmp_path = f"{file_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as outfile:
+            outfile.write(header.getvalue().encode('utf-8'))
+            for start in range(0, num_rows, CHUNK_ROWS):
+                stop = min(start + CHUNK_ROWS, num_rows)
+                pieces = []
+                for values, original, separator in zip(columns, originals, separators):
+                    if original is not None:
+                        original = original[start:stop]
+                    pieces.extend(_column_pieces(values[start:stop], precision, original))
+                    pieces.append(np.broadcast_to(separator, (stop - start, len(separator))))
+                rows = np.concatenate(pieces, axis=1).ravel()
+                outfile.write(rows[rows != 0])
+                if progress:
+                    progress(stop / num_rows, f"{stop}/{num_rows} 行")
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,324 @@
+"""スプライン補間とリサンプリングの処理 (GUI に依存しない)
+
+csv_editor.py の各ボタンと batch_resample.py のコマンドラインの両方から使う。
+tkinter や matplotlib を import しないため、ディスプレイのない環境でも動作する。
+scipy.interpolate は読み込みに時間がかかるため、エディタの起動を遅くしないよう
+スプラインを初めて計算するときに読み込む (preload() で先に読み込んでおける)。
+"""
+import numpy as np
+
+from trajectory import Trajectory
+
+MIN_SPLINE_POINTS = 4
+QUATERNION_COLUMNS = ('x_quat', 'y_quat', 'z_quat', 'w_quat')
+
+# --- プレビュー曲線の設定 ---
+PREVIEW_PIXELS_PER_SAMPLE = 3.0 # プレビュー曲線のサンプル間隔の目安(画面上のピクセル)
+PREVIEW_MAX_ANGLE_STEP = np.radians(4.0) # 1サンプルあたりの向きの変化の上限
+PREVIEW_MAX_SAMPLES_PER_SEGMENT = 32 # 隣り合う2点の間に置くサンプル数の上限
+LOCAL_FIT_MARGIN = 10 # 局所再計算で変更点の前後に含める点数
+LOCAL_FIT_SPLICE = 5 # 局所再計算の結果で置き換える、変更点の前後の区間数
+SAMPLE_CHUNK = 65536 # 全体のサンプリングで、進捗を報告する間隔 (一度に評価する点数)
+
+
+def preload(progress=None):
+    """スプラインの計算に使う scipy のモジュールを読み込んでおく (progress は使わない)"""
+    import scipy.interpolate  # noqa: F401
+
+
+def closed_points(xy):
+    """閉曲線として扱う点列を返す。末尾が先頭と異なれば先頭の点を末尾に追加する"""
+    xy = np.asarray(xy, dtype=float)
+    if np.array_equal(xy[0], xy[-1]):
+        return xy.copy()
+    return np.vstack((xy, xy[:1]))
+
+
+def fit_closed_spline(xy):
+    """閉曲線として補間スプラインを当てはめ、(tck, u) を返す
+
+    u は closed_points(xy) の各点 (先頭に戻る点を含む) に対応するパラメータ。
+    """
+    from scipy.interpolate import splprep
+    # splprep(per=True) は末尾の点を先頭の点で上書きするため、閉じた点列のコピーを渡す
+    return splprep(closed_points(xy).T, s=0, per=True) # スムージングなし(s=0)に固定
+
+
+def slerp(q0, q1, t):
+    """クォータニオン配列 q0, q1 (N, 4) を比率 t (N,) で球面線形補間する"""
+    q1 = q1.copy()
+    dot = np.einsum('ij,ij->i', q0, q1)
+    # 最短経路で補間するため、内積が負なら片側の符号を反転する
+    q1[dot < 0] *= -1
+    dot = np.abs(dot)
+    theta = np.arccos(np.clip(dot, -1.0, 1.0))
+    sin_theta = np.sin(theta)
+    nearly_parallel = sin_theta < 1e-6
+    safe_sin = np.where(nearly_parallel, 1.0, sin_theta)
+    w0 = np.where(nearly_parallel, 1.0 - t, np.sin((1.0 - t) * theta) / safe_sin)
+    w1 = np.where(nearly_parallel, t, np.sin(t * theta) / safe_sin)
+    q = w0[:, None] * q0 + w1[:, None] * q1
+    return q / np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+
+
+def heading_quaternions(dx, dy):
+    """接線ベクトル (dx, dy) の向きを z 軸回りの回転としたクォータニオン (N, 4) を返す"""
+    yaw = np.arctan2(dy, dx)
+    q = np.zeros((len(yaw), 4))
+    q[:, 2] = np.sin(yaw / 2.0)
+    q[:, 3] = np.cos(yaw / 2.0)
+    return q
+
+
+def transfer_attributes(data, u, u_new, new_points, tangents=None):
+    """パラメータ u の元の点から u_new の新しい点へ、座標以外の列をまとめて補間する
+
+    数値列は u に沿って線形補間し、文字列列は近い方の点から引き継ぐ。
+    クォータニオン列は tangents (dx, dy) が与えられればその向きから再計算し、
+    なければ前後の点の間で球面線形補間する。u は fit_closed_spline が返す
+    パラメータで、元の点数を超える分は先頭の行に戻るものとする。
+    """
+    n = len(data)
+    rows = np.arange(len(u)) % n
+    seg = np.clip(np.searchsorted(u, u_new, side='right') - 1, 0, len(u) - 2)
+    length = u[seg + 1] - u[seg]
+    t = np.divide(u_new - u[seg], length, out=np.zeros_like(u_new), where=length > 0)
+    t = np.clip(t, 0.0, 1.0)
+    lo, hi = rows[seg], rows[seg + 1]
+
+    columns = {}
+    for name, values in data.columns.items():
+        if name in QUATERNION_COLUMNS and all(q in data.columns for q in QUATERNION_COLUMNS):
+            continue
+        if values.dtype.kind == 'f':
+            columns[name] = values[lo] + (values[hi] - values[lo]) * t
+        else:
+            columns[name] = np.where(t < 0.5, values[lo], values[hi])
+
+    if all(q in data.columns for q in QUATERNION_COLUMNS):
+        if tangents is not None:
+            quats = heading_quaternions(*tangents)
+        else:
+            old = np.column_stack([data.columns[q].astype(float) for q in QUATERNION_COLUMNS])
+            quats = slerp(old[lo], old[hi], t)
+        for i, name in enumerate(QUATERNION_COLUMNS):
+            columns[name] = quats[:, i]
+
+    return Trajectory(data.fieldnames, new_points, columns)
+
+
+def sample_closed_curve(data, num_points, orientation_from_tangent=True, progress=None):
+    """閉曲線上を num_points 点で等パラメータ間隔にサンプリングした Trajectory を返す
+
+    速度・z などの列は曲線パラメータに沿って補間する。orientation_from_tangent が
+    True ならクォータニオンはスプラインの接線方向から再計算し、False なら球面線形補間する。
+    progress を渡すと、段階ごとと SAMPLE_CHUNK 点ごとに progress(割合, メッセージ) を呼ぶ。
+    """
+    if len(data) < MIN_SPLINE_POINTS:
+        raise ValueError("サンプリングするには点が少なすぎます。")
+    if num_points < 1:
+        raise ValueError("サンプリング点数は1以上にしてください。")
+    progress = progress or (lambda fraction, message="": None)
+    from scipy.interpolate import splev
+    progress(0.0, "スプラインの当てはめ")
+    tck, u = fit_closed_spline(data.xy)
+    # u の最後は先頭に戻る点なので含めない (含めると先頭の点が末尾に重複する)
+    u_new = np.linspace(u.min(), u.max(), num_points, endpoint=False)
+    new_points = np.empty((num_points, 2))
+    tangents = np.empty((2, num_points)) if orientation_from_tangent else None
+    for start in range(0, num_points, SAMPLE_CHUNK):
+        progress(0.5 + 0.4 * start / num_points, f"サンプリング {start}/{num_points} 点")
+        chunk = slice(start, start + SAMPLE_CHUNK)
+        new_points[chunk] = np.column_stack(splev(u_new[chunk], tck, der=0))
+        if tangents is not None:
+            tangents[:, chunk] = splev(u_new[chunk], tck, der=1)
+    progress(0.9, "列の補間")
+    return transfer_attributes(data, u, u_new, new_points, tangents)
+
+
+def resample_all(data, orientation_from_tangent=True, progress=None):
+    """点数を変えずに閉曲線全体を再配置した Trajectory を返す (progress は sample_closed_curve を参照)"""
+    if len(data) < MIN_SPLINE_POINTS:
+        raise ValueError("リサンプリングするには点が少なすぎます。")
+    return sample_closed_curve(data, len(data), orientation_from_tangent, progress)
+
+
+def window_indices(num_points, center_index, range_size):
+    """center_index の前後 range_size 点のインデックスを周回を考慮して返す"""
+    start_index = (center_index - range_size + num_points) % num_points
+    end_index = (center_index + range_size + 1 + num_points) % num_points
+    if start_index < end_index:
+        return np.arange(start_index, end_index)
+    return np.concatenate((np.arange(start_index, num_points), np.arange(0, end_index)))
+
+
+def resample_window(data, center_index, range_size):
+    """center_index 周辺の点を開曲線として再配置し、(インデックス, 新しい座標) を返す"""
+    if len(data) < MIN_SPLINE_POINTS:
+        raise ValueError("リサンプリングするには点が少なすぎます。")
+    indices = window_indices(len(data), center_index, range_size)
+    if len(indices) < MIN_SPLINE_POINTS:
+        raise ValueError("リサンプリングするには範囲内の点が少なすぎます。")
+
+    from scipy.interpolate import splprep, splev
+    tck, u = splprep(data.xy[indices].T, s=0, per=False) # スムージングなし(s=0)に固定
+    u_new = np.linspace(u.min(), u.max(), len(indices))
+    return indices, np.column_stack(splev(u_new, tck, der=0))
+
+
+def _polyline(xy):
+    return np.append(xy[:, 0], xy[0, 0]), np.append(xy[:, 1], xy[0, 1])
+
+
+def _segment_sample_counts(pts, view):
+    """閉じた点列 pts の各区間に置くサンプル数を、長さ・曲がり具合・表示範囲から決める"""
+    xlim, ylim, pixel_size = view
+    chords = np.diff(pts, axis=0)
+    lengths = np.hypot(chords[:, 0], chords[:, 1])
+    heading = np.arctan2(chords[:, 1], chords[:, 0])
+    turn = np.abs(np.angle(np.exp(1j * np.diff(heading, append=heading[:1]))))
+    # 区間の両端での向きの変化のうち大きい方を使う
+    turn = np.maximum(turn, np.roll(turn, 1))
+
+    counts = np.maximum(lengths / (pixel_size * PREVIEW_PIXELS_PER_SAMPLE), turn / PREVIEW_MAX_ANGLE_STEP)
+    counts = np.clip(np.ceil(counts), 1, PREVIEW_MAX_SAMPLES_PER_SEGMENT).astype(np.intp)
+
+    # 表示範囲外の区間は1サンプルで十分
+    margin = 0.1 * (xlim[1] - xlim[0])
+    inside = ((pts[:, 0] >= xlim[0] - margin) & (pts[:, 0] <= xlim[1] + margin) &
+              (pts[:, 1] >= ylim[0] - margin) & (pts[:, 1] <= ylim[1] + margin))
+    counts[~(inside[:-1] | inside[1:])] = 1
+    return counts
+
+
+def _sample_segments(tck, u, counts):
+    """区間 j (u[j]〜u[j+1]) ごとに counts[j] 個のサンプルを評価する。区間の終端は含まない"""
+    from scipy.interpolate import splev
+    seg = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    t = (np.arange(len(seg)) - starts[seg]) / counts[seg]
+    u_s = u[seg] + (u[seg + 1] - u[seg]) * t
+    return np.column_stack(splev(u_s, tck, der=0))
+
+
+def _circular_span(indices, n):
+    """円環上のインデックス集合を覆う最短の連続区間 (開始, 長さ) を返す"""
+    idx = np.unique(np.asarray(list(indices), dtype=np.intp) % n)
+    if len(idx) == 1:
+        return int(idx[0]), 1
+    gaps = np.diff(np.append(idx, idx[0] + n))
+    g = int(gaps.argmax())
+    start = int(idx[(g + 1) % len(idx)])
+    return start, n - int(gaps[g]) + 1
+
+
+class SplinePreview:
+    """プレビュー用スプラインのキャッシュ
+
+    データのバージョンと表示範囲が変わらなければ前回の評価結果を返す。
+    連続した一部の点だけが動いた場合は、その周辺だけを開曲線として当てはめ直し、
+    評価結果の該当区間だけを差し替える。サンプル密度は各区間の画面上の長さと
+    曲がり具合から決める。
+    """
+
+    def __init__(self):
+        self.invalidate()
+
+    def invalidate(self):
+        self._version = None
+        self._view = None
+        self._fit = None # (tck, u, データのバージョン) 全体を当てはめたときの結果
+        self._counts = None
+        self._samples = None
+        self._n = 0
+
+    def evaluate(self, xy, version, view, changed_indices=None, local_only=False):
+        """描画用の (x, y) を返す
+
+        view は (xlim, ylim, 1ピクセルあたりのデータ長)。changed_indices を指定すると、
+        前回からその点だけが動いたものとして局所的に更新する。local_only が True で
+        局所更新ができない場合は、全体の再計算を行わず前回の結果をそのまま返す。
+        """
+        n = len(xy)
+        if n < MIN_SPLINE_POINTS:
+            self.invalidate()
+            return _polyline(xy)
+        if version == self._version and view == self._view and self._samples is not None:
+            return self._output()
+
+        try:
+            if (changed_indices is not None and self._samples is not None
+                    and n == self._n and view == self._view and self._update_local(xy, changed_indices)):
+                pass
+            elif local_only and self._samples is not None:
+                return self._output()
+            else:
+                self._update_full(xy, version, view)
+        except Exception:
+            self.invalidate()
+            return _polyline(xy)
+
+        self._version = version
+        self._view = view
+        return self._output()
+
+    def fit(self, xy, version):
+        """軌跡全体を当てはめたスプライン (tck, u) を返す。同じバージョンなら前回の結果を使う"""
+        if self._fit is None or self._fit[2] != version:
+            tck, u = fit_closed_spline(xy)
+            self._fit = (tck, u, version)
+        return self._fit[:2]
+
+    def _output(self):
+        out = np.vstack((self._samples, self._samples[:1]))
+        return out[:, 0], out[:, 1]
+
+    def _update_full(self, xy, version, view):
+        tck, u = self.fit(xy, version)
+        pts = closed_points(xy)
+        self._counts = _segment_sample_counts(pts, view)
+        self._samples = _sample_segments(tck, u, self._counts)
+        self._n = len(xy)
+
+    def _update_local(self, xy, changed_indices):
+        """変更点の周辺だけを当てはめ直す。局所更新できない場合は False を返す"""
+        pts = closed_points(xy)
+        num_segments = len(pts) - 1
+        if num_segments != len(self._counts):
+            return False
+        start, length = _circular_span(changed_indices, num_segments)
+        window = length + 2 * LOCAL_FIT_MARGIN
+        if num_segments < 4 * window:
+            return False
+
+        # 変更点の前後 LOCAL_FIT_MARGIN 点を含めて開曲線として当てはめる
+        first = start - LOCAL_FIT_MARGIN
+        window_idx = np.arange(first, first + window + 1) % num_segments
+        local = pts[window_idx]
+        from scipy.interpolate import splprep
+        tck, u = splprep(local.T, s=0, per=False) # スムージングなし(s=0)に固定
+
+        # 端の影響を避け、内側の区間だけを差し替える
+        seg_from = LOCAL_FIT_MARGIN - LOCAL_FIT_SPLICE
+        seg_to = LOCAL_FIT_MARGIN + length - 1 + LOCAL_FIT_SPLICE
+        local_counts = _segment_sample_counts(local, self._view)[seg_from:seg_to + 1]
+        local_samples = _sample_segments(tck, u[seg_from:seg_to + 2], local_counts)
+
+        segments = (first + np.arange(seg_from, seg_to + 1)) % num_segments
+        self._splice(segments, local_counts, local_samples)
+        self._fit = None
+        return True
+
+    def _splice(self, segments, counts, samples):
+        """連続した区間 segments (周回をまたいでもよい) のサンプルを差し替える"""
+        # 周回をまたぐ場合は2つの連続区間に分けて処理する
+        wrap = np.flatnonzero(np.diff(segments) < 0)
+        parts = np.split(np.arange(len(segments)), wrap + 1)
+        sample_offsets = np.concatenate(([0], np.cumsum(counts)))
+        for part in parts:
+            seg_a, seg_b = segments[part[0]], segments[part[-1]]
+            offsets = np.concatenate(([0], np.cumsum(self._counts)))
+            new = samples[sample_offsets[part[0]]:sample_offsets[part[-1] + 1]]
+            self._samples = np.concatenate((self._samples[:offsets[seg_a]], new,
+                                            self._samples[offsets[seg_b + 1]:]))
+            self._counts[seg_a:seg_b + 1] = counts[part]
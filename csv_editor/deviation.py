@@ -0,0 +1,139 @@
+"""参照線 (背景の軌跡) からのずれの計算
+
+参照線は数十万点になることがあるため、2段階で最も近い線分を探す。
+
+1. 一定間隔で間引いた頂点を k-d 木に入れておき (線分インデックス)、間引いた折れ線の
+   どの位置に最も近いかを求める。
+2. その位置に対応する元の線分の前後 REFINE_WINDOW 本への射影をまとめて計算し、
+   最も近い線分が探索範囲の端にあれば、そこを中心に探し直す。
+
+どちらの段階も全点をまとめた配列演算で行い、1点あたりの計算量は参照線の点数に依存しない。
+横方向のオフセットは、参照線の進行方向に対して左側を正とする符号付きの距離。
+"""
+import numpy as np
+
+DISTANCE_COLUMN = 'ref_distance' # 参照線までの最短距離を書き出す列
+OFFSET_COLUMN = 'ref_offset' # 参照線からの符号付き横方向オフセット (左が正) を書き出す列
+COARSE_VERTICES = 4096 # 最初の探索に使う、間引いた参照線の頂点数の目安
+REFINE_WINDOW = 8 # 元の参照線で、見つけた位置の前後に調べる線分の数
+MAX_REFINE_STEPS = 32 # 探索範囲を移しながら探し直す回数の上限
+QUERY_CHUNK = 65536 # 一度に射影を計算する点数 (候補の配列が大きくなりすぎないようにする)
+CLOSED_GAP_RATIO = 0.05 # 始点と終点の距離が全体の大きさのこの割合以下なら閉じた参照線とみなす
+
+
+def _project(points, segments, starts, vectors, lengths2):
+    """各点から候補の線分 segments (点数, 候補数) への射影を計算する
+
+    (距離の2乗, 射影した点から各点へのベクトルの x, y, 線分上の位置 0〜1) を返す。
+    starts と vectors は (x の配列, y の配列) で、(N, 2) の配列で軸方向に和を取るより速い。
+    """
+    sx, sy = starts[0][segments], starts[1][segments]
+    vx, vy = vectors[0][segments], vectors[1][segments]
+    dx = points[:, 0, None] - sx
+    dy = points[:, 1, None] - sy
+    t = np.clip((dx * vx + dy * vy) / lengths2[segments], 0.0, 1.0)
+    dx -= vx * t
+    dy -= vy * t
+    return dx * dx + dy * dy, dx, dy, t
+
+
+class ReferenceLine:
+    """参照線への最近傍点を求めるための線分インデックス"""
+
+    def __init__(self, xy):
+        pts = np.asarray(xy, dtype=float).reshape(-1, 2)
+        pts = pts[np.isfinite(pts).all(axis=1)]
+        self.closed = False
+        if len(pts) > 2:
+            gap = np.hypot(*(pts[-1] - pts[0]))
+            if 0 < gap <= CLOSED_GAP_RATIO * np.hypot(*np.ptp(pts, axis=0)):
+                pts = np.vstack((pts, pts[:1]))
+                self.closed = True
+        self.points = pts
+        if len(pts) < 2:
+            return
+
+        from scipy.spatial import cKDTree # 起動を遅くしないよう、インデックスを作るときに読み込む
+        self._num_segments = len(pts) - 1
+        self._starts, self._vectors, self._lengths2 = self._segments(pts)
+        lengths = np.sqrt(self._lengths2)
+        self._stations = np.concatenate(([0.0], np.cumsum(lengths))) # 始点から各頂点までの道のり
+
+        # 間引いた折れ線の頂点 (元の頂点の番号)。終点は必ず含める
+        step = max(1, self._num_segments // COARSE_VERTICES)
+        self._coarse = np.append(np.arange(0, self._num_segments, step), self._num_segments)
+        coarse_pts = pts[self._coarse]
+        self._coarse_starts, self._coarse_vectors, self._coarse_lengths2 = self._segments(coarse_pts)
+        self._tree = cKDTree(coarse_pts)
+
+    @staticmethod
+    def _segments(pts):
+        """折れ線の各線分の (始点の x, y), (向きの x, y), 長さの2乗 を返す"""
+        vectors = np.diff(pts, axis=0)
+        lengths2 = np.maximum((vectors * vectors).sum(axis=1), 1e-18)
+        starts = (np.ascontiguousarray(pts[:-1, 0]), np.ascontiguousarray(pts[:-1, 1]))
+        return starts, (np.ascontiguousarray(vectors[:, 0]), np.ascontiguousarray(vectors[:, 1])), lengths2
+
+    def __bool__(self):
+        return len(self.points) >= 2
+
+    def _neighbor_segments(self, segments, count):
+        """線分の番号に前後の番号を足した配列を、閉じた参照線なら周回させ、開いていれば端で止めて返す"""
+        if self.closed:
+            return segments % count
+        return np.clip(segments, 0, count - 1)
+
+    def _locate(self, points):
+        """間引いた折れ線で最も近い位置を求め、対応する元の線分の番号を返す"""
+        num_coarse = len(self._coarse) - 1
+        k = min(2, self._tree.n)
+        _, nearest = self._tree.query(points, k=k)
+        nearest = nearest.reshape(len(points), k)
+        # 最も近い頂点の両側の線分を候補にする
+        segments = self._neighbor_segments(np.concatenate((nearest, nearest - 1), axis=1), num_coarse)
+        dist2, _, _, t = _project(points, segments, self._coarse_starts, self._coarse_vectors, self._coarse_lengths2)
+        best = dist2.argmin(axis=1)
+        rows = np.arange(len(points))
+        segment, t = segments[rows, best], t[rows, best]
+        start, end = self._stations[self._coarse[segment]], self._stations[self._coarse[segment + 1]]
+        station = start + (end - start) * t
+        fine = np.searchsorted(self._stations, station, side='right') - 1
+        return np.clip(fine, 0, self._num_segments - 1)
+
+    def _nearest_segments(self, points):
+        """各点に最も近い元の線分の番号を返す"""
+        num_segments = self._num_segments
+        window = np.arange(-REFINE_WINDOW, REFINE_WINDOW + 1)
+        center = self._locate(points)
+        pending = np.arange(len(points))
+        for _ in range(MAX_REFINE_STEPS):
+            segments = self._neighbor_segments(center[pending, None] + window, num_segments)
+            dist2, _, _, _ = _project(points[pending], segments, self._starts, self._vectors, self._lengths2)
+            best = dist2.argmin(axis=1)
+            found = segments[np.arange(len(pending)), best]
+            # 探索範囲の端で見つかった点は、まだ先に近い線分があるかもしれないので探し直す
+            again = (np.abs(best - REFINE_WINDOW) == REFINE_WINDOW) & (found != center[pending])
+            center[pending] = found
+            pending = pending[again]
+            if len(pending) == 0:
+                break
+        return center
+
+    def project(self, points):
+        """各点の参照線までの最短距離と符号付き横方向オフセットを (distance, offset) で返す"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        distance = np.full(len(points), np.nan)
+        offset = np.full(len(points), np.nan)
+        if not self:
+            return distance, offset
+        valid = np.flatnonzero(np.isfinite(points).all(axis=1))
+        for start in range(0, len(valid), QUERY_CHUNK):
+            rows = valid[start:start + QUERY_CHUNK]
+            p = points[rows]
+            segments = self._nearest_segments(p)
+            dist2, dx, dy, _ = _project(p, segments[:, None], self._starts, self._vectors, self._lengths2)
+            distance[rows] = np.sqrt(dist2[:, 0])
+            # 線分の向きに対して左側 (外積が正) を正とする
+            cross = self._vectors[0][segments] * dy[:, 0] - self._vectors[1][segments] * dx[:, 0]
+            offset[rows] = np.where(cross < 0, -distance[rows], distance[rows])
+        return distance, offset
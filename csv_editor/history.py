@@ -0,0 +1,176 @@
+from collections import deque
+
+import numpy as np
+
+
+class PointEdit:
+    """一部の点の座標変更。変更したインデックスと変更前後の座標だけを保持する"""
+
+    def __init__(self, indices, before, after):
+        self.indices = np.asarray(indices, dtype=np.intp)
+        self.before = np.array(before, dtype=float).reshape(-1, 2)
+        self.after = np.array(after, dtype=float).reshape(-1, 2)
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes + self.before.nbytes + self.after.nbytes
+
+    @property
+    def changed_indices(self):
+        return self.indices
+
+    def undo(self, data):
+        data.xy[self.indices] = self.before
+        return data
+
+    def redo(self, data):
+        data.xy[self.indices] = self.after
+        return data
+
+
+class ColumnEdit:
+    """座標以外の1列の値の変更。変更前後の列を保持する (before が None なら列の追加)"""
+
+    def __init__(self, name, before, after):
+        self.name = name
+        self.before = before
+        self.after = after
+
+    @property
+    def nbytes(self):
+        return (self.before.nbytes if self.before is not None else 0) + self.after.nbytes
+
+    @property
+    def changed_indices(self):
+        # 座標は変わらない
+        return np.empty(0, dtype=np.intp)
+
+    def undo(self, data):
+        if self.before is None:
+            del data.columns[self.name]
+            data.fieldnames.remove(self.name)
+        else:
+            data.columns[self.name] = self.before
+        return data
+
+    def redo(self, data):
+        if self.name not in data.fieldnames:
+            data.fieldnames.append(self.name)
+        data.columns[self.name] = self.after
+        return data
+
+
+class CompoundEdit:
+    """1回の操作で行った複数の変更。まとめて元に戻す/やり直す"""
+
+    def __init__(self, records):
+        self.records = list(records)
+
+    @property
+    def nbytes(self):
+        return sum(record.nbytes for record in self.records)
+
+    @property
+    def changed_indices(self):
+        indices = [record.changed_indices for record in self.records]
+        if any(changed is None for changed in indices):
+            return None
+        return np.unique(np.concatenate(indices))
+
+    def undo(self, data):
+        for record in reversed(self.records):
+            data = record.undo(data)
+        return data
+
+    def redo(self, data):
+        for record in self.records:
+            data = record.redo(data)
+        return data
+
+
+class ReplaceEdit:
+    """全体リサンプリングなど軌跡全体を置き換える操作
+
+    元に戻すときに現在の軌跡と入れ替えるため、常に片側の状態だけを保持する。
+    """
+
+    def __init__(self, data, label=""):
+        self.data = data
+        self.label = label
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    @property
+    def changed_indices(self):
+        # 全体が置き換わるため None(全点が変化)を返す
+        return None
+
+    def undo(self, data):
+        self.data, data = data, self.data
+        return data
+
+    def redo(self, data):
+        return self.undo(data)
+
+
+class EditHistory:
+    """差分ベースの元に戻す/やり直し履歴
+
+    履歴の上限は手順数ではなく、保持している差分の合計バイト数で決める。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self._undo_bytes = 0
+
+    def __len__(self):
+        return len(self.undo_stack)
+
+    @property
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    @property
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    @property
+    def nbytes(self):
+        return self._undo_bytes + sum(record.nbytes for record in self.redo_stack)
+
+    def push(self, record):
+        self.redo_stack.clear()
+        self.undo_stack.append(record)
+        self._undo_bytes += record.nbytes
+        # 直前の1手は上限を超えていても必ず残す
+        while self._undo_bytes > self.max_bytes and len(self.undo_stack) > 1:
+            self._undo_bytes -= self.undo_stack.popleft().nbytes
+
+    def undo(self, data):
+        """1手戻した軌跡と変化した点のインデックス(全点なら None)を返す"""
+        if not self.undo_stack:
+            return data, None
+        record = self.undo_stack.pop()
+        self._undo_bytes -= record.nbytes
+        data = record.undo(data)
+        self.redo_stack.append(record)
+        return data, record.changed_indices
+
+    def redo(self, data):
+        """1手やり直した軌跡と変化した点のインデックス(全点なら None)を返す"""
+        if not self.redo_stack:
+            return data, None
+        record = self.redo_stack.pop()
+        data = record.redo(data)
+        self.undo_stack.append(record)
+        self._undo_bytes += record.nbytes
+        return data, record.changed_indices
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self._undo_bytes = 0
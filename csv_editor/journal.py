@@ -0,0 +1,397 @@
+"""編集操作の追記型ジャーナル (異常終了からの復元と作業の再開用)
+
+編集・元に戻す・やり直しのたびに、変わった点のインデックスと座標など差分だけを
+バイナリで追記する。起動時に入力CSV (またはチェックポイント) の上で先頭から再生すると、
+終了時の状態と元に戻す/やり直し履歴が復元される。
+
+各フレームは (種類, ペイロード長, CRC32) のヘッダーとペイロードからなる。
+書き込みの途中で異常終了した末尾のフレームは、読み込み時に切り捨てる。
+元に戻す/やり直しのフレームは、再生したときに履歴にある操作なら空のペイロードにして
+履歴の1手を戻す/やり直すだけにする。チェックポイントより前の操作のように再生時の履歴に
+ないものだけ、差分そのものを記録する。
+
+書き込みと fsync はバックグラウンドのスレッドで行い、続けて届いたフレームは1回の
+fsync にまとめる。編集の操作はフレームを書き込み待ちに加えるだけで、ディスクを待たない。
+"""
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import weakref
+import zlib
+
+import numpy as np
+
+from history import ColumnEdit, CompoundEdit, PointEdit, ReplaceEdit
+from trajectory import Trajectory
+
+FRAME_HEADER = struct.Struct('<BII') # 種類, ペイロード長, CRC32
+HEADER, SNAPSHOT, EDIT, UNDO, REDO = range(5)
+SYNC_DELAY = 0.05 # 最初のフレームが届いてから、続くフレームをまとめて fsync するまで待つ時間(秒)
+_POINT, _COLUMN, _COMPOUND, _REPLACE = b'PCMR'
+
+
+class JournalError(ValueError):
+    """ジャーナルが壊れているか、現在の入力と対応しない"""
+
+
+def source_stamp(file_path):
+    """ジャーナルの元になる入力ファイルを識別する情報 (パス・サイズ・更新時刻)"""
+    stat = os.stat(file_path)
+    return {"path": os.path.abspath(file_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+# ---------- 書き込み ----------
+
+def _pack_str(out, text):
+    encoded = text.encode('utf-8')
+    out += struct.pack('<I', len(encoded))
+    out += encoded
+
+
+def _pack_array(out, values):
+    values = np.asarray(values)
+    is_object = values.dtype.kind == 'O'
+    if is_object:
+        # 文字列の列は固定長の Unicode 配列にして書き、読むときに object に戻す
+        values = values.astype(str)
+    values = np.ascontiguousarray(values)
+    _pack_str(out, values.dtype.str)
+    out += struct.pack('<?B', is_object, values.ndim)
+    out += struct.pack(f'<{values.ndim}q', *values.shape)
+    out += values.tobytes()
+
+
+def _pack_trajectory(out, data):
+    out += struct.pack('<I', len(data.fieldnames))
+    for name in data.fieldnames:
+        _pack_str(out, name)
+    _pack_array(out, data.xy)
+    out += struct.pack('<I', len(data.columns))
+    for name, values in data.columns.items():
+        _pack_str(out, name)
+        _pack_array(out, values)
+    out += struct.pack('<I', len(data.text))
+    for name, raw in data.text.items():
+        _pack_str(out, name)
+        _pack_array(out, raw)
+
+
+def _pack_record(out, record, data):
+    """履歴レコードを書く。ReplaceEdit は data (None ならレコードが保持する軌跡) を書く"""
+    if isinstance(record, PointEdit):
+        out.append(_POINT)
+        for values in (record.indices, record.before, record.after):
+            _pack_array(out, values)
+    elif isinstance(record, ColumnEdit):
+        out.append(_COLUMN)
+        _pack_str(out, record.name)
+        out += struct.pack('<?', record.before is not None)
+        if record.before is not None:
+            _pack_array(out, record.before)
+        _pack_array(out, record.after)
+    elif isinstance(record, CompoundEdit):
+        out.append(_COMPOUND)
+        out += struct.pack('<I', len(record.records))
+        for child in record.records:
+            _pack_record(out, child, data)
+    elif isinstance(record, ReplaceEdit):
+        out.append(_REPLACE)
+        _pack_str(out, record.label)
+        _pack_trajectory(out, record.data if data is None else data)
+    else:
+        raise TypeError(f"ジャーナルに記録できない変更です: {type(record).__name__}")
+
+
+def _contains_replace(record):
+    if isinstance(record, CompoundEdit):
+        return any(_contains_replace(child) for child in record.records)
+    return isinstance(record, ReplaceEdit)
+
+
+def _frame(kind, payload):
+    return FRAME_HEADER.pack(kind, len(payload), zlib.crc32(payload)) + payload
+
+
+def encode_record(kind, record, data=None):
+    """履歴レコードを1フレームのバイト列にする (data は _pack_record を参照)"""
+    payload = bytearray()
+    _pack_record(payload, record, data)
+    return _frame(kind, bytes(payload))
+
+
+# ---------- 読み込み ----------
+
+class _Reader:
+    def __init__(self, payload):
+        self.buffer = memoryview(payload)
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.buffer, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def bytes(self, size):
+        if self.offset + size > len(self.buffer):
+            raise JournalError("ジャーナルのフレームが途中で終わっています。")
+        chunk = self.buffer[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def str(self):
+        size, = self.unpack('<I')
+        return bytes(self.bytes(size)).decode('utf-8')
+
+    def array(self):
+        dtype = np.dtype(self.str())
+        is_object, ndim = self.unpack('<?B')
+        shape = self.unpack(f'<{ndim}q')
+        count = int(np.prod(shape, dtype=np.int64))
+        values = np.frombuffer(self.bytes(count * dtype.itemsize), dtype=dtype).reshape(shape).copy()
+        return values.astype(object) if is_object else values
+
+    def trajectory(self):
+        count, = self.unpack('<I')
+        fieldnames = [self.str() for _ in range(count)]
+        xy = self.array()
+        count, = self.unpack('<I')
+        columns = {}
+        for _ in range(count):
+            name = self.str()
+            columns[name] = self.array()
+        count, = self.unpack('<I')
+        text = {}
+        for _ in range(count):
+            name = self.str()
+            text[name] = self.array()
+        return Trajectory(fieldnames, xy, columns, text)
+
+    def record(self):
+        tag = self.bytes(1)[0]
+        if tag == _POINT:
+            return PointEdit(self.array(), self.array(), self.array())
+        if tag == _COLUMN:
+            name = self.str()
+            has_before, = self.unpack('<?')
+            before = self.array() if has_before else None
+            return ColumnEdit(name, before, self.array())
+        if tag == _COMPOUND:
+            count, = self.unpack('<I')
+            return CompoundEdit([self.record() for _ in range(count)])
+        if tag == _REPLACE:
+            label = self.str()
+            # 適用後の軌跡を持つレコードとして作る (undo/redo のどちらでも入れ替えでこの軌跡になる)
+            return ReplaceEdit(self.trajectory(), label)
+        raise JournalError(f"不明な変更の種類です: {tag}")
+
+
+def decode_record(payload):
+    """encode_record() で書いたフレームのペイロードから履歴レコードを作る"""
+    try:
+        return _Reader(payload).record()
+    except (struct.error, ValueError) as e:
+        raise JournalError(f"履歴を読み込めませんでした: {e}") from e
+
+
+def read_frames(path):
+    """ファイルのフレームを読む。split_frames を参照"""
+    with open(path, 'rb') as infile:
+        return split_frames(infile.read())
+
+
+def split_frames(content):
+    """(フレームのリスト [(種類, ペイロード)], 正しく読めた末尾の位置) を返す
+
+    CRC が一致しないか途中で切れたフレーム以降は読まない。
+    """
+    frames = []
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(content):
+        kind, size, crc = FRAME_HEADER.unpack_from(content, offset)
+        start = offset + FRAME_HEADER.size
+        payload = content[start:start + size]
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            break
+        frames.append((kind, payload))
+        offset = start + size
+    return frames, offset
+
+
+class EditJournal:
+    """1つの出力ファイルに対応するジャーナル
+
+    source は source_stamp() の値で、ジャーナルを再生できる入力ファイルを表す。
+    ファイルを開いている間は、書き込み用のスレッドがファイルへの書き込みを受け持つ。
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self._file = None
+        self._frames = None
+        self._valid_length = 0
+        self._queue = None
+        self._writer = None
+        self._error = None
+        self._written = 0
+        self._header_length = None # ヘッダーだけのジャーナルの長さ (チェックポイントがあれば None)
+        # 再生したときに履歴に積まれる操作。元に戻す/やり直しは空のフレームで記録できる
+        self._replayable = weakref.WeakSet()
+
+    @property
+    def nbytes(self):
+        return self._written if self._file is not None else 0
+
+    def pending_edits(self):
+        """前回のジャーナルに残っている、再生できる操作 (チェックポイントを含む) の数を返す (なければ 0)"""
+        try:
+            frames, self._valid_length = read_frames(self.path)
+        except OSError:
+            return 0
+        if not frames or frames[0][0] != HEADER:
+            return 0
+        try:
+            source = json.loads(bytes(frames[0][1]).decode('utf-8'))
+        except ValueError:
+            return 0
+        if source != self.source:
+            return 0
+        self._frames = frames[1:]
+        return sum(1 for kind, _ in self._frames if kind in (SNAPSHOT, EDIT, UNDO, REDO))
+
+    def replay(self, data, history):
+        """pending_edits() で読んだ操作を data に再生して history に積み、再生後の軌跡を返す
+
+        再生後は続きから追記できるようにジャーナルを開く。再生に失敗した場合は
+        JournalError を送出する (data は変更せず、history は空にする)。
+        """
+        data = data.copy()
+        try:
+            for kind, payload in self._frames:
+                reader = _Reader(payload)
+                if kind == SNAPSHOT:
+                    data = reader.trajectory()
+                    history.clear()
+                elif kind == EDIT:
+                    record = reader.record()
+                    data = record.redo(data)
+                    history.push(record)
+                elif kind in (UNDO, REDO) and not payload:
+                    if not (history.can_undo if kind == UNDO else history.can_redo):
+                        raise JournalError("元に戻す/やり直す操作が履歴にありません。")
+                    data = (history.undo if kind == UNDO else history.redo)(data)[0]
+                elif kind == UNDO:
+                    # チェックポイントより前の操作は履歴にないため、記録した差分を直接戻す
+                    data = reader.record().undo(data)
+                elif kind == REDO:
+                    data = reader.record().redo(data)
+        except (struct.error, IndexError, ValueError, KeyError) as e:
+            history.clear()
+            raise JournalError(f"ジャーナルを再生できませんでした: {e}") from e
+
+        self._frames = None
+        outfile = open(self.path, 'r+b')
+        outfile.truncate(self._valid_length) # 異常終了で途中まで書かれたフレームを捨てる
+        outfile.seek(self._valid_length)
+        self._start(outfile, self._valid_length)
+        self._replayable.update(history.undo_stack)
+        self._replayable.update(history.redo_stack)
+        return data
+
+    def reset(self, data=None, source=None):
+        """ジャーナルを作り直す。data を渡すとその軌跡をチェックポイントとして先頭に書く
+
+        書き込み待ちのフレームを書き終えてから、その場で書き直す。
+        """
+        if source is not None:
+            self.source = source
+        self.close()
+        content = _frame(HEADER, json.dumps(self.source).encode('utf-8'))
+        if data is not None:
+            payload = bytearray()
+            _pack_trajectory(payload, data)
+            content += _frame(SNAPSHOT, bytes(payload))
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as outfile:
+            outfile.write(content)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_path, self.path)
+        self._start(open(self.path, 'ab'), len(content))
+        self._header_length = len(content) if data is None else None
+
+    def append(self, kind, record, data):
+        """適用済みの操作 (EDIT/UNDO/REDO) を書き込み待ちに加える。data は適用後の軌跡
+
+        エンコード・書き込み・fsync は書き込み用のスレッドが行う。それまでの書き込みで
+        失敗していれば、その OSError をここで送出する。
+        """
+        if self._error is not None:
+            raise self._error
+        if kind == EDIT:
+            self._replayable.add(record)
+        elif record in self._replayable:
+            # 再生時は履歴の1手を戻す/やり直すだけなので、差分は書かない
+            self._queue.put((kind, None, None))
+            return
+        # 軌跡全体を置き換えた操作は適用後の軌跡を書く。このあとの編集はその場で書き換えるためコピーを渡す
+        self._queue.put((kind, record, data.copy() if _contains_replace(record) else None))
+
+    def close(self, remove_if_empty=False):
+        """書き込み待ちのフレームを書き終えてからファイルを閉じる
+
+        remove_if_empty なら、ヘッダーのほかに何も記録していないジャーナルは削除する
+        (再生しても入力ファイルと同じ状態にしかならないため)。
+        """
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if remove_if_empty and self._error is None and self._written == self._header_length:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+
+    def _start(self, outfile, written):
+        """outfile への追記を受け持つ書き込み用のスレッドを始める"""
+        self._file = outfile
+        self._written = written
+        self._header_length = None
+        self._error = None
+        self._replayable = weakref.WeakSet()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_frames, name="journal", daemon=True)
+        self._writer.start()
+
+    def _write_frames(self):
+        closing = False
+        while not closing:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + SYNC_DELAY
+            while batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            closing = batch[-1] is None
+            if closing:
+                batch.pop()
+            if not batch or self._error is not None:
+                continue
+            try:
+                for kind, record, data in batch:
+                    frame = _frame(kind, b'') if record is None else encode_record(kind, record, data)
+                    self._file.write(frame)
+                    self._written += len(frame)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                # 以降のフレームは書かず、次の append() で編集側に知らせる
+                self._error = e
@@ -0,0 +1,145 @@
+"""レーン境界までの距離(クリアランス)の計算
+
+読み込み時にレーン境界の周辺を一様格子で区切り、各境界線までの符号付き距離を
+格子点ごとに一度だけ求めておく (距離場)。問い合わせは周囲4格子点の双線形補間だけで
+済むため、全区間のレーンでもドラッグ中の毎フレームに多数の点をまとめて判定できる。
+
+符号は、内側と外側の両方の境界に接する領域 (走行可能領域) を正、それ以外を負とする。
+レーンのCSVは区画線の輪郭をなぞった点列のことがあり、線の向きから内外を決められない
+ため、境界を格子に描き込んで塗り分けた領域で判定する。精度は格子の間隔程度。
+"""
+import numpy as np
+
+GRID_RESOLUTION = 0.1 # 距離場の格子間隔(m)
+MAX_GRID_SIZE = 2048 # 距離場の一辺の格子数の上限。コースが大きい場合は格子間隔を広げる
+GRID_MARGIN = 5.0 # レーン境界の外側に確保する距離場の余白(m)
+CLOSED_GAP_RATIO = 0.05 # 始点と終点の距離が全体の大きさのこの割合以下なら閉じた境界とみなす
+
+
+def _boundary_polyline(xy):
+    """有限な点だけを残し、ほぼ閉じている境界は始点に戻して閉じる"""
+    pts = np.asarray(xy, dtype=float).reshape(-1, 2)
+    pts = pts[np.isfinite(pts).all(axis=1)]
+    if len(pts) > 2:
+        gap = np.hypot(*(pts[-1] - pts[0]))
+        if 0 < gap <= CLOSED_GAP_RATIO * np.hypot(*np.ptp(pts, axis=0)):
+            pts = np.vstack((pts, pts[:1]))
+    return pts
+
+
+class LaneDistanceField:
+    """レーン境界ごとの符号付き距離場
+
+    境界が2本以上あり、すべての境界に接する領域が見つかった場合だけ符号を付ける
+    (signed が True)。それ以外は境界からの距離だけを返す。
+    """
+
+    def __init__(self, boundaries, resolution=GRID_RESOLUTION):
+        self.boundaries = [pts for pts in map(_boundary_polyline, boundaries) if len(pts) >= 2]
+        self.resolution = resolution
+        self.signed = False
+        if not self.boundaries:
+            return
+
+        from scipy import ndimage # 起動を遅くしないよう、距離場を作るときに読み込む
+        all_points = np.vstack(self.boundaries)
+        lower = all_points.min(axis=0) - GRID_MARGIN
+        extent = all_points.max(axis=0) + GRID_MARGIN - lower
+        self._cell = max(resolution, extent.max() / (MAX_GRID_SIZE - 1))
+        self._origin = lower
+        self._shape = tuple((np.ceil(extent / self._cell)).astype(np.intp)[::-1] + 1) # (行, 列) = (y, x)
+
+        walls = [self._rasterize(pts) for pts in self.boundaries]
+        any_wall = np.logical_or.reduce(walls)
+        self._drivable = None
+        if len(walls) >= 2:
+            # 境界で区切られた領域のうち、すべての境界に接するものを走行可能領域とする
+            labels, _ = ndimage.label(~any_wall)
+            touching = None
+            for wall in walls:
+                adjacent = set(np.unique(labels[ndimage.binary_dilation(wall) & ~any_wall]).tolist()) - {0}
+                touching = adjacent if touching is None else touching & adjacent
+            if touching:
+                self._drivable = np.isin(labels, sorted(touching)) | any_wall
+                self.signed = True
+
+        # 距離は符号なしで保持する。符号は別の境界を挟んで反転するため、補間せずに最寄りの格子点で決める
+        self._fields = np.stack([ndimage.distance_transform_edt(~wall, sampling=self._cell).astype(np.float32)
+                                 for wall in walls])
+
+    def __bool__(self):
+        return bool(self.boundaries)
+
+    def to_arrays(self):
+        """保存用に距離場を配列の辞書で返す。from_arrays() で作り直さずに復元できる"""
+        if not self.boundaries:
+            return {}
+        arrays = {"fields": self._fields,
+                  "grid": np.array([self._origin[0], self._origin[1], self._cell, self.resolution])}
+        if self._drivable is not None:
+            arrays["drivable"] = self._drivable
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, boundaries, arrays, resolution=GRID_RESOLUTION):
+        """to_arrays() の配列から復元する。格子間隔などが合わなければ作り直す"""
+        grid = arrays.get("grid")
+        fields = arrays.get("fields")
+        boundaries = [pts for pts in map(_boundary_polyline, boundaries) if len(pts) >= 2]
+        if grid is None or fields is None or grid[3] != resolution or len(fields) != len(boundaries):
+            return cls(boundaries, resolution)
+        field = cls.__new__(cls)
+        field.boundaries = boundaries
+        field.resolution = resolution
+        field._origin = np.array(grid[:2])
+        field._cell = float(grid[2])
+        field._shape = fields.shape[1:]
+        field._fields = fields
+        field._drivable = arrays.get("drivable")
+        field.signed = field._drivable is not None
+        return field
+
+    def _rasterize(self, pts):
+        """折れ線が通る格子点を True にした配列を返す"""
+        chords = np.diff(pts, axis=0)
+        steps = np.maximum(np.ceil(np.hypot(chords[:, 0], chords[:, 1]) / (0.5 * self._cell)), 1).astype(np.intp)
+        seg = np.repeat(np.arange(len(chords)), steps)
+        starts = np.cumsum(steps) - steps
+        t = (np.arange(len(seg)) - starts[seg]) / steps[seg]
+        samples = np.vstack((pts[seg] + chords[seg] * t[:, None], pts[-1:]))
+        cells = np.rint((samples - self._origin) / self._cell).astype(np.intp)
+        wall = np.zeros(self._shape, dtype=bool)
+        wall[cells[:, 1], cells[:, 0]] = True
+        return wall
+
+    def margins(self, points):
+        """(点数, 境界数) の配列で、各点の各境界までのクリアランスを返す"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if not self.boundaries:
+            return np.empty((len(points), 0))
+        rows, cols = self._shape
+        f = (points - self._origin) / self._cell
+        fx = np.clip(f[:, 0], 0, cols - 1)
+        fy = np.clip(f[:, 1], 0, rows - 1)
+        x0 = np.minimum(fx.astype(np.intp), cols - 2)
+        y0 = np.minimum(fy.astype(np.intp), rows - 2)
+        tx = (fx - x0)[:, None]
+        ty = (fy - y0)[:, None]
+
+        fields = self._fields
+        values = ((fields[:, y0, x0].T * (1 - tx) + fields[:, y0, x0 + 1].T * tx) * (1 - ty) +
+                  (fields[:, y0 + 1, x0].T * (1 - tx) + fields[:, y0 + 1, x0 + 1].T * tx) * ty)
+
+        # 距離場の外にある点は、はみ出した分だけ境界から遠ざける
+        values = values + np.hypot(f[:, 0] - fx, f[:, 1] - fy)[:, None] * self._cell
+        if self._drivable is not None:
+            inside = self._drivable[np.rint(fy).astype(np.intp), np.rint(fx).astype(np.intp)]
+            values = np.where(inside[:, None], values, -values)
+        return values
+
+    def clearance(self, points):
+        """各点の最小クリアランスを返す。符号付きの場合、負の値はコース外を表す"""
+        margins = self.margins(points)
+        if margins.shape[1] == 0:
+            return np.full(len(margins), np.inf)
+        return margins.min(axis=1)
@@ -0,0 +1,75 @@
+"""表示範囲と画面解像度に合わせた間引き (LOD) 処理
+
+描画コストをデータ量ではなく画面サイズに比例させるため、表示範囲外の点を除き、
+1ピクセルに収まる連続した点をまとめて描画点数を減らす。
+"""
+import numpy as np
+
+
+def view_mask(xy, xlim, ylim, margin=0.0):
+    """表示範囲 (の外側 margin まで) に含まれる点を True とするマスクを返す"""
+    return ((xy[:, 0] >= xlim[0] - margin) & (xy[:, 0] <= xlim[1] + margin) &
+            (xy[:, 1] >= ylim[0] - margin) & (xy[:, 1] <= ylim[1] + margin))
+
+
+def decimate_polyline(xy, xlim, ylim, pixel_size):
+    """表示範囲内の折れ線を1ピクセル単位に間引き、(x, y) を返す
+
+    表示範囲をまたぐ線分は端点を残して描画し、範囲外で途切れる部分には
+    NaN を挟んで線を分割する。
+    """
+    if len(xy) == 0 or pixel_size <= 0:
+        return xy[:, 0], xy[:, 1]
+    inside = view_mask(xy, xlim, ylim, pixel_size)
+    # 表示範囲の外にある隣接点も残し、境界をまたぐ線分が欠けないようにする
+    keep = inside.copy()
+    keep[1:] |= inside[:-1]
+    keep[:-1] |= inside[1:]
+
+    cells = np.floor(xy / pixel_size).astype(np.int64)
+    changed = np.ones(len(xy), dtype=bool)
+    changed[1:] = (cells[1:] != cells[:-1]).any(axis=1)
+    # 区間の端点は必ず残す
+    boundary = np.zeros(len(xy), dtype=bool)
+    boundary[1:] |= keep[1:] != keep[:-1]
+    boundary[:-1] |= keep[:-1] != keep[1:]
+    indices = np.flatnonzero(keep & (changed | boundary))
+    if len(indices) == 0:
+        return np.empty(0), np.empty(0)
+
+    out = xy[indices]
+    gaps = np.flatnonzero(np.diff(indices) > 1)
+    if len(gaps) and not keep.all():
+        # 元の折れ線で連続していない箇所に NaN を挟む
+        breaks = ~keep[indices[gaps] + 1]
+        out = np.insert(out, gaps[breaks] + 1, np.nan, axis=0)
+    return out[:, 0], out[:, 1]
+
+
+def decimate_points(xy, xlim, ylim, pixel_size):
+    """表示範囲内の点を1ピクセルに1点まで間引いた (N, 2) 配列を返す"""
+    if len(xy) == 0 or pixel_size <= 0:
+        return xy
+    visible = xy[view_mask(xy, xlim, ylim, pixel_size)]
+    cells = np.floor(visible / pixel_size).astype(np.int64)
+    _, first = np.unique(cells, axis=0, return_index=True)
+    return visible[np.sort(first)]
+
+
+def visible_label_indices(xy, xlim, ylim, pixel_size, min_spacing_px, max_labels):
+    """表示範囲内で、互いに min_spacing_px 以上離れた点のインデックスを返す
+
+    格子状に区切った各マスから番号の小さい点を1つずつ選び、最大 max_labels 個に抑える。
+    """
+    if len(xy) == 0:
+        return np.empty(0, dtype=np.intp)
+    candidates = np.flatnonzero(view_mask(xy, xlim, ylim, 0.0))
+    if len(candidates) == 0:
+        return candidates
+    spacing = max(pixel_size * min_spacing_px, 1e-12)
+    cells = np.floor(xy[candidates] / spacing).astype(np.int64)
+    _, first = np.unique(cells, axis=0, return_index=True)
+    chosen = candidates[np.sort(first)]
+    if len(chosen) > max_labels:
+        chosen = chosen[np.linspace(0, len(chosen) - 1, max_labels).astype(np.intp)]
+    return chosen
@@ -0,0 +1,209 @@
+"""走行中の車両の姿勢をローカルの UDP で受け取る
+
+シミュレーターなどの送信側は、1つのデータグラムに1つ以上の姿勢 (時刻, x, y, 方位角) を
+POSE_FORMAT で詰めて送る。受信はバックグラウンドのスレッドで行い、固定長のリングバッファ
+PoseRingBuffer に書き込む。古い姿勢から上書きされるため、100Hz 以上で受け取り続けても
+使用メモリは増えない。描画側はリングバッファの内容を自分の間隔で読み出すだけで、受信とは
+同期しない。
+
+コマンドラインから実行すると、CSVの軌跡をたどる姿勢を一定の頻度で送り続ける試験用の送信側になる。
+
+使用例:
+    python pose_feed.py input.csv --rate 200
+    python pose_feed.py input.csv --rate 1000 --batch 10 --count 60000
+
+終了コード: 0 = 成功 (Ctrl+C での終了を含む), 1 = 読み込み・送信に失敗, 2 = 引数エラー
+"""
+import argparse
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 47800
+POSE_DTYPE = np.dtype('<f8') # 1つの姿勢は (時刻[s], x[m], y[m], 方位角[rad]) の4つのリトルエンディアン倍精度浮動小数点数
+POSE_FIELDS = 4
+POSE_SIZE = POSE_DTYPE.itemsize * POSE_FIELDS
+MAX_DATAGRAM = 65507 # UDP のペイロードの上限
+RECEIVE_TIMEOUT = 0.2 # 停止の要求を確認する間隔(秒)
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+
+def encode_poses(poses):
+    """(N, 4) の姿勢の配列をデータグラムのバイト列にする"""
+    return np.ascontiguousarray(poses, dtype=POSE_DTYPE).reshape(-1, POSE_FIELDS).tobytes()
+
+
+def decode_poses(packet):
+    """データグラムから (N, 4) の姿勢の配列を作る。大きさが合わなければ ValueError を送出する"""
+    if len(packet) == 0 or len(packet) % POSE_SIZE:
+        raise ValueError(f"姿勢のデータグラムの大きさが不正です: {len(packet)} バイト")
+    return np.frombuffer(packet, dtype=POSE_DTYPE).reshape(-1, POSE_FIELDS)
+
+
+class PoseRingBuffer:
+    """直近 capacity 個の姿勢を保持する固定長のリングバッファ
+
+    受信スレッドが extend() で書き込み、メインスレッドが latest() で読み出す。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._poses = np.full((capacity, POSE_FIELDS), np.nan)
+        self._lock = threading.Lock()
+        self._next = 0 # 次に書き込む位置
+        self._stored = 0
+        self.received = 0 # これまでに受け取った姿勢の数。描画側は変化したかどうかの判定に使う
+
+    def extend(self, poses):
+        with self._lock:
+            self.received += len(poses)
+            poses = poses[-self.capacity:]
+            slots = (self._next + np.arange(len(poses))) % self.capacity
+            self._poses[slots] = poses
+            self._next = (self._next + len(poses)) % self.capacity
+            self._stored = min(self._stored + len(poses), self.capacity)
+
+    def latest(self):
+        """保持している姿勢を古い順に並べたコピーを返す"""
+        with self._lock:
+            start = (self._next - self._stored) % self.capacity
+            return np.roll(self._poses, -start, axis=0)[:self._stored]
+
+    def clear(self):
+        with self._lock:
+            self._next = self._stored = 0
+
+
+class UdpPoseReceiver:
+    """UDP で届いた姿勢をバックグラウンドのスレッドで PoseRingBuffer に書き込む
+
+    ソケットは作成時に開くため、ポートが使えない場合は OSError がその場で送出される。
+    """
+
+    def __init__(self, buffer, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.buffer = buffer
+        self.malformed = 0 # 大きさが合わず捨てたデータグラムの数
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._socket.bind((host, port))
+        except OSError:
+            self._socket.close()
+            raise
+        self._socket.settimeout(RECEIVE_TIMEOUT)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="pose_feed", daemon=True)
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                packet = self._socket.recv(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                break # stop() でソケットが閉じられた
+            try:
+                poses = decode_poses(packet)
+            except ValueError:
+                self.malformed += 1
+                continue
+            self.buffer.extend(poses)
+
+    def stop(self):
+        self._stop_event.set()
+        self._socket.close()
+        if self._thread.is_alive():
+            self._thread.join(timeout=RECEIVE_TIMEOUT * 2)
+
+
+def poses_along(xy):
+    """軌跡の各点の位置と接線方向から (x, y, 方位角) の配列を作る"""
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    heading = np.gradient(xy, axis=0) if len(xy) > 1 else np.zeros_like(xy)
+    return np.column_stack((xy, np.arctan2(heading[:, 1], heading[:, 0])))
+
+
+def publish(path_poses, host=DEFAULT_HOST, port=DEFAULT_PORT, rate=100.0, batch=1, step=1, count=0):
+    """path_poses (poses_along の結果) を先頭から順に rate [姿勢/秒] で送り続ける
+
+    batch 個ずつまとめて1つのデータグラムにする。count が 0 なら周回し続ける。
+    送った姿勢の数を返す。Ctrl+C (KeyboardInterrupt) で止めた場合もそれまでに送った数を返す。
+    """
+    interval = batch / rate
+    sent = 0
+    position = 0
+    next_time = time.perf_counter()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            while count <= 0 or sent < count:
+                size = batch if count <= 0 else min(batch, count - sent)
+                rows = (position + step * np.arange(size)) % len(path_poses)
+                position = (rows[-1] + step) % len(path_poses)
+                poses = np.column_stack((np.full(size, time.time()), path_poses[rows]))
+                sock.sendto(encode_poses(poses), (host, port))
+                sent += size
+                # 遅れても間隔を詰めて追いつくよう、送信時刻は前回の予定から数える
+                next_time += interval
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        except KeyboardInterrupt:
+            pass
+    return sent
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="CSVの軌跡をたどる車両の姿勢を UDP で送り続けます (試験用)。")
+    parser.add_argument("input", help="たどる軌跡のCSV (x, y 列)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"送信先のアドレス (既定: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"送信先のポート (既定: {DEFAULT_PORT})")
+    parser.add_argument("--rate", type=float, default=100.0, help="1秒あたりに送る姿勢の数 (既定: 100)")
+    parser.add_argument("--batch", type=int, default=1, help="1つのデータグラムにまとめる姿勢の数 (既定: 1)")
+    parser.add_argument("--step", type=int, default=1, help="1回に進む軌跡の点の数 (既定: 1)")
+    parser.add_argument("--count", type=int, default=0, help="送る姿勢の数。0 なら Ctrl+C まで送り続ける (既定: 0)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.rate <= 0 or args.step < 1 or not 1 <= args.batch <= MAX_DATAGRAM // POSE_SIZE:
+        parser.error(f"--rate は正の値、--step は1以上、--batch は1〜{MAX_DATAGRAM // POSE_SIZE}にしてください。")
+
+    import csv_loader
+    try:
+        path_poses = poses_along(csv_loader.load_xy(args.input))
+    except (OSError, ValueError) as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    if len(path_poses) == 0:
+        print(f"エラー: 軌跡に点がありません: {args.input}", file=sys.stderr)
+        return EXIT_FAILED
+
+    print(f"{args.host}:{args.port} へ {args.rate:g} 姿勢/秒で送信します (Ctrl+C で終了)")
+    start = time.perf_counter()
+    try:
+        sent = publish(path_poses, args.host, args.port, args.rate, args.batch, args.step, args.count)
+    except OSError as e:
+        print(f"送信エラー: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    if sent:
+        print(f"{sent} 姿勢を {time.perf_counter() - start:.1f} 秒で送信しました")
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
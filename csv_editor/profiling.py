@@ -0,0 +1,154 @@
+"""処理時間の計測 (プロファイリング)
+
+instrument() で指定したクラスのメソッドを計測用の関数で包み、呼び出しごとの
+開始時刻と所要時間を記録する。計測を有効にしない限りメソッドは包まれないため、
+無効時の実行コストはない。
+
+記録した区間は Chrome のトレース形式 (chrome://tracing や Perfetto で開ける JSON) で
+書き出せる。メインスレッドで最も外側の呼び出しを1フレームとみなし、その内訳を
+画面上の表示用にまとめる。
+
+StartupTimer は起動の各段階 (モジュールの読み込み・ウィンドウの作成・ファイルの読み込みなど)
+の所要時間を記録する。記録は常に行い、表示するかどうかは呼び出し側が決める。
+"""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+MAX_TRACE_EVENTS = 1000000 # 保持する区間の上限。超えたら古いものから捨てる
+FRAME_HISTORY = 60 # 平均フレーム時間の計算に使うフレーム数
+JOB_TRACE_TID = 0 # バックグラウンド処理の区間を表示するトレース上の行
+STARTUP_TRACE_TID = 1 # 起動の各段階を表示するトレース上の行
+
+
+class Profiler:
+    def __init__(self):
+        self.events = deque(maxlen=MAX_TRACE_EVENTS) # (名前, カテゴリ, 開始秒, 所要秒, スレッドID)
+        self.frame_times = deque(maxlen=FRAME_HISTORY)
+        self.last_frame = None # (名前, 所要秒, {名前: 合計秒}) 直近のフレームの内訳
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._main_thread = threading.main_thread().ident
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def record(self, name, category, start, duration, tid=None):
+        """start (perf_counter の秒) から duration 秒の区間を記録する"""
+        self.events.append((name, category, start, duration, threading.get_ident() if tid is None else tid))
+
+    def wrap(self, func, name, category):
+        """func を呼び出すたびに区間を記録する関数を返す"""
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            stack = self._stack()
+            # 内側の区間の所要時間を外側のフレームの内訳として集計する
+            stack.append({})
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                sections = stack.pop()
+                self.record(name, category, start, duration)
+                if stack:
+                    parent = stack[-1]
+                    parent[name] = parent.get(name, 0.0) + duration
+                    for inner, seconds in sections.items():
+                        parent[inner] = parent.get(inner, 0.0) + seconds
+                elif threading.get_ident() == self._main_thread:
+                    self.frame_times.append(duration)
+                    self.last_frame = (name, duration, sections)
+        return timed
+
+    def instrument(self, cls, methods):
+        """cls のメソッドを計測用に包む。methods は {メソッド名: カテゴリ}"""
+        for method, category in methods.items():
+            setattr(cls, method, self.wrap(getattr(cls, method), f"{cls.__name__}.{method}", category))
+
+    def instrument_jobs(self, runner_cls):
+        """バックグラウンド処理を、投入から結果を受け取るまでの区間として記録する
+
+        別プロセスで動く処理の中身は計測できないため、待ち時間を含めた全体を記録する。
+        """
+        handle_finished = runner_cls._handle_finished
+
+        @functools.wraps(handle_finished)
+        def timed(runner, job):
+            self.record(f"job:{job.label}", "worker", job.submitted_at,
+                        time.perf_counter() - job.submitted_at, tid=JOB_TRACE_TID)
+            return handle_finished(runner, job)
+        runner_cls._handle_finished = timed
+
+    def summary_lines(self, max_sections=6):
+        """直近のフレームの所要時間と内訳を表示用の文字列のリストで返す
+
+        matplotlib の既定のフォントで表示できるよう英数字だけを使う。
+        """
+        if self.last_frame is None:
+            return ["frame: -"]
+        name, duration, sections = self.last_frame
+        average = sum(self.frame_times) / len(self.frame_times)
+        lines = [f"frame {duration * 1000:.1f} ms (avg {average * 1000:.1f} ms) {name.split('.')[-1]}"]
+        for inner, seconds in sorted(sections.items(), key=lambda item: -item[1])[:max_sections]:
+            lines.append(f"  {inner.split('.')[-1]}: {seconds * 1000:.1f} ms")
+        return lines
+
+    def write_chrome_trace(self, path):
+        """記録した区間を Chrome のトレース形式で書き出す"""
+        pid = os.getpid()
+        trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": JOB_TRACE_TID,
+                  "args": {"name": "background jobs"}},
+                 {"name": "thread_name", "ph": "M", "pid": pid, "tid": STARTUP_TRACE_TID,
+                  "args": {"name": "startup"}}]
+        trace.extend({"name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+                      "ts": (start - self._origin) * 1e6, "dur": duration * 1e6}
+                     for name, category, start, duration, tid in list(self.events))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, mode='w', encoding='utf-8') as outfile:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, outfile)
+        os.replace(tmp_path, path)
+
+
+class StartupTimer:
+    """起動の各段階の所要時間を記録する
+
+    origin は起動の開始時刻 (perf_counter の秒)。段階はメインスレッドとワーカースレッドの
+    どちらからでも記録でき、終わった順に並べて表示する。profiler を渡すとトレースにも記録する。
+    """
+
+    def __init__(self, origin, profiler=None):
+        self.origin = origin
+        self.profiler = profiler
+        self.stages = [] # (名前, 開始秒, 終了秒, スレッド名)
+
+    def record(self, name, start, end=None):
+        """start から end (省略時は現在) までを1つの段階として記録する"""
+        end = time.perf_counter() if end is None else end
+        self.stages.append((name, start, end, threading.current_thread().name))
+        if self.profiler is not None:
+            self.profiler.record(f"startup:{name}", "startup", start, end - start, tid=STARTUP_TRACE_TID)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """with ブロックの実行を1つの段階として記録する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def report_lines(self):
+        """段階ごとの「起動からの経過時間・所要時間・段階名」を終わった順に返す"""
+        lines = ["   経過(ms)   所要(ms)  段階"]
+        for name, start, end, thread in sorted(self.stages, key=lambda stage: stage[2]):
+            where = "" if thread == threading.main_thread().name else f" [{thread}]"
+            lines.append(f"{(end - self.origin) * 1000:10.1f} {(end - start) * 1000:10.1f}  {name}{where}")
+        return lines
@@ -0,0 +1,254 @@
+"""プロジェクトファイル (.npz) の保存と読み込み
+
+軌跡の各列・レーン境界 (と距離場)・背景軌跡・表示範囲・元に戻す/やり直し履歴を、無圧縮の
+.npz (ZIP_STORED) 1つにまとめる。無圧縮なので各配列はファイル内の位置を調べて
+そのままメモリマップでき、開くときにテキストの解析も配列のコピーも発生しない。
+np.load() でも普通の .npz として読める。
+
+コマンドラインからは既存のCSV構成 (軌跡・背景・レーン境界) へ書き出せる。
+
+使用例:
+    python project.py project.npz --output-dir export/
+
+終了コード: 0 = 成功, 1 = 読み込み・書き出しに失敗, 2 = 引数エラー
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import zipfile
+
+import numpy as np
+
+import journal
+from history import ColumnEdit, CompoundEdit, ReplaceEdit
+from lane_clearance import LaneDistanceField
+from trajectory import Trajectory
+
+PROJECT_FORMAT_VERSION = 1
+# 書き出すCSVの構成 (エディタが読み込む場所と同じ)
+EXPORT_TRAJECTORY_FILE = "output.csv"
+EXPORT_BACKGROUND_FILE = "background.csv"
+EXPORT_LANE_FILES = ("lane/inner_lane_bound.csv", "lane/out_lane_bound.csv")
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+_LOCAL_HEADER = struct.Struct('<4s5H3I2H') # ZIP のローカルファイルヘッダー (30バイト)
+
+
+def is_mapped(values):
+    """配列 (またはそのビューの元の配列) がファイルのメモリマップかどうか"""
+    while isinstance(values, np.ndarray):
+        values = values.base
+    return isinstance(values, mmap.mmap)
+
+
+def in_memory(values):
+    """メモリマップの配列ならメモリ上にコピーして返す。そうでなければそのまま返す"""
+    return np.array(values) if is_mapped(values) else values
+
+
+def trajectory_in_memory(data):
+    """Trajectory の座標と列のうちメモリマップのものを、その場でメモリ上のコピーに置き換える"""
+    data.xy = in_memory(data.xy)
+    data.columns = {name: in_memory(values) for name, values in data.columns.items()}
+    data.text = {name: in_memory(raw) for name, raw in data.text.items()}
+
+
+def history_in_memory(history):
+    """履歴の変更記録が参照しているメモリマップの配列を、その場でメモリ上のコピーに置き換える"""
+    records = list(history.undo_stack) + list(history.redo_stack)
+    while records:
+        record = records.pop()
+        if isinstance(record, CompoundEdit):
+            records.extend(record.records)
+        elif isinstance(record, ColumnEdit):
+            record.before = in_memory(record.before)
+            record.after = in_memory(record.after)
+        elif isinstance(record, ReplaceEdit):
+            trajectory_in_memory(record.data)
+        # PointEdit は作成時に変更前後の座標をコピーしている
+
+
+def save_project(path, data, lanes=(), background=None, view=None, history=None, lane_field=None):
+    """プロジェクトを書き出す。書き終えてから path へ置き換える
+
+    view は {"xlim": [...], "ylim": [...]}、history は EditHistory。lane_field (LaneDistanceField) を
+    渡すと距離場も保存し、開くときに作り直さずに済む。
+    path の Project から開いた配列 (メモリマップ) が残っていると、Windows では置き換えられず、
+    POSIX でも古いファイルが開いたままになる。同じファイルへ保存するときは、先に
+    trajectory_in_memory() などで配列をメモリ上にコピーしておくこと。
+    """
+    arrays = {"xy": data.xy}
+    columns = []
+    for i, name in enumerate(data.columns):
+        values = data.columns[name]
+        # 文字列の列は固定長の Unicode 配列にして書き、読むときに object に戻す
+        text = values.dtype.kind == 'O'
+        arrays[f"column{i}"] = values.astype(str) if text else values
+        columns.append({"name": name, "text": text})
+        raw = data.text.get(name)
+        if raw is not None and len(raw) == len(data):
+            # 読み込んだときの文字列も保存し、CSVへ書き出すときに元の表記を保つ
+            arrays[f"raw{i}"] = raw
+            columns[-1]["raw"] = True
+    for i, lane in enumerate(lanes):
+        arrays[f"lane{i}"] = np.asarray(lane, dtype=float).reshape(-1, 2)
+    if lane_field is not None:
+        for name, values in lane_field.to_arrays().items():
+            arrays[f"lane_field_{name}"] = values
+    if background is not None and len(background):
+        arrays["background"] = np.asarray(background, dtype=float).reshape(-1, 2)
+    if history is not None:
+        # 元に戻す履歴は古い順に EDIT、やり直し履歴はスタックの順に REDO フレームとして並べる
+        frames = [journal.encode_record(journal.EDIT, record) for record in history.undo_stack]
+        frames += [journal.encode_record(journal.REDO, record) for record in history.redo_stack]
+        arrays["history"] = np.frombuffer(b''.join(frames), dtype=np.uint8)
+
+    meta = {"version": PROJECT_FORMAT_VERSION, "fieldnames": data.fieldnames, "columns": columns,
+            "lanes": len(lanes), "view": view}
+    arrays["meta"] = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+
+    tmp_path = path + ".tmp"
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, values in arrays.items():
+                with archive.open(name + ".npy", 'w', force_zip64=True) as member:
+                    np.lib.format.write_array(member, np.ascontiguousarray(values), allow_pickle=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class Project:
+    """プロジェクトファイルを開き、配列を必要になったときにメモリマップで返す
+
+    開いた時点で読むのは ZIP の目次とメタデータだけ。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path) as archive:
+            self._members = {info.filename[:-len(".npy")]: info for info in archive.infolist()
+                             if info.filename.endswith(".npy")}
+        if "meta" not in self._members:
+            raise ValueError(f"プロジェクトファイルではありません: {os.path.basename(path)}")
+        self.meta = json.loads(bytes(self.array("meta")).decode('utf-8'))
+        if self.meta.get("version", 0) > PROJECT_FORMAT_VERSION:
+            raise ValueError("このプロジェクトファイルは新しい形式のため開けません。")
+
+    def __contains__(self, name):
+        return name in self._members
+
+    @property
+    def view(self):
+        return self.meta.get("view")
+
+    def array(self, name, writable=False):
+        """配列をメモリマップで返す。writable なら書き換えてもファイルに反映されない (コピーオンライト)"""
+        info = self._members[name]
+        if info.compress_type != zipfile.ZIP_STORED:
+            # 圧縮されたメンバーはメモリマップできないため、展開して読む
+            with np.load(self.path) as archive:
+                return archive[name]
+        with open(self.path, 'rb') as infile:
+            infile.seek(info.header_offset)
+            header = _LOCAL_HEADER.unpack(infile.read(_LOCAL_HEADER.size))
+            name_length, extra_length = header[-2:]
+            infile.seek(info.header_offset + _LOCAL_HEADER.size + name_length + extra_length)
+            version = np.lib.format.read_magic(infile)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(infile)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(infile)
+            offset = infile.tell()
+        if dtype.hasobject:
+            raise ValueError(f"オブジェクト配列は読み込めません: {name}")
+        if 0 in shape:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode='c' if writable else 'r', offset=offset, shape=shape,
+                         order='F' if fortran_order else 'C')
+
+    def trajectory(self):
+        """編集できる Trajectory を返す。列はコピーオンライトのメモリマップ (文字列の列だけはコピー)"""
+        columns = {}
+        text = {}
+        for i, column in enumerate(self.meta["columns"]):
+            values = self.array(f"column{i}", writable=True)
+            columns[column["name"]] = values.astype(object) if column["text"] else values
+            if column.get("raw"):
+                text[column["name"]] = self.array(f"raw{i}")
+        return Trajectory(self.meta["fieldnames"], self.array("xy", writable=True), columns, text)
+
+    def lanes(self):
+        return [self.array(f"lane{i}") for i in range(self.meta.get("lanes", 0))]
+
+    def lane_field(self, lanes):
+        """保存された距離場があればメモリマップで復元し、なければ lanes から作る"""
+        arrays = {name: self.array(f"lane_field_{name}") for name in ("fields", "grid", "drivable")
+                  if f"lane_field_{name}" in self}
+        return LaneDistanceField.from_arrays(lanes, arrays)
+
+    def background(self):
+        return self.array("background") if "background" in self else np.empty((0, 2))
+
+    def restore_history(self, history):
+        """保存された元に戻す/やり直し履歴を history に積む"""
+        history.clear()
+        if "history" not in self:
+            return
+        content = bytes(self.array("history"))
+        frames, end = journal.split_frames(content)
+        if end != len(content):
+            raise ValueError("プロジェクトの履歴が壊れています。")
+        for kind, payload in frames:
+            record = journal.decode_record(payload)
+            if kind == journal.EDIT:
+                history.push(record)
+            else:
+                history.redo_stack.append(record)
+
+    def export_csv(self, directory):
+        """既存のCSV構成 (軌跡・背景・レーン境界) で directory に書き出し、書いたファイルの一覧を返す"""
+        outputs = [(os.path.join(directory, EXPORT_TRAJECTORY_FILE), self.trajectory())]
+        background = self.background()
+        if len(background):
+            outputs.append((os.path.join(directory, EXPORT_BACKGROUND_FILE), Trajectory(['x', 'y'], background)))
+        for file_name, lane in zip(EXPORT_LANE_FILES, self.lanes()):
+            if len(lane):
+                outputs.append((os.path.join(directory, file_name), Trajectory(['x', 'y'], lane)))
+        for path, data in outputs:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            data.to_csv(path)
+        return [path for path, _ in outputs]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="プロジェクトファイルを既存のCSV構成に書き出します。")
+    parser.add_argument("project", help="プロジェクトファイル (.npz)")
+    parser.add_argument("--output-dir", default=".", help="書き出し先ディレクトリ (既定: カレントディレクトリ)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        written = Project(args.project).export_csv(args.output_dir)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        print(f"エラー: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    for path in written:
+        print(f"書き出し: {path}")
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
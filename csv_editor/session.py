@@ -0,0 +1,120 @@
+"""複数の軌跡を1つのウィンドウで切り替えて編集するためのセッション
+
+レーン境界・背景とその距離場・参照線はエディタが一度だけ読み込んで全ての軌跡で共有し、
+ここでは軌跡ごとの状態 (データ・履歴・ジャーナル・表示用のキャッシュ) だけを管理する。
+軌跡は初めて表示するときに読み込み、読み込んだ軌跡の合計がメモリの上限を超えると、
+最も長く表示していないものから解放する。編集した軌跡はジャーナルに記録されているため、
+解放しても次に表示するときに入力ファイルからジャーナルを再生して同じ状態に戻せる。
+"""
+import glob
+import itertools
+import os
+
+from trajectory import Trajectory
+
+
+def expand_inputs(patterns, base_dir):
+    """ファイルのパスまたは glob パターン (相対パスは base_dir から) を、存在するファイルの一覧にする"""
+    files = []
+    for pattern in patterns:
+        pattern = os.path.join(base_dir, pattern)
+        files.extend(sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern])
+    return [path for path in dict.fromkeys(os.path.abspath(f) for f in files) if os.path.isfile(path)]
+
+
+def output_path_for(input_path, suffix):
+    """入力と同じ場所に、ファイル名の末尾へ suffix を付けた出力先を返す"""
+    stem, ext = os.path.splitext(input_path)
+    return f"{stem}{suffix}{ext}"
+
+
+def state_nbytes(state):
+    """軌跡ごとの状態が保持している主な配列の大きさ (バイト)"""
+    total = 0
+    for value in state.values():
+        if isinstance(value, Trajectory):
+            total += value.nbytes
+        elif hasattr(value, 'nbytes'): # 配列・EditHistory
+            total += value.nbytes
+    return total
+
+
+class TrajectorySlot:
+    """セッションの1つの軌跡ファイル
+
+    state は読み込み済みで表示していない軌跡の状態 (エディタの属性名→値)。表示中の軌跡の
+    状態はエディタの属性そのものなので、表示中と未読み込みのときは None になる。
+    """
+
+    def __init__(self, input_file, output_file):
+        self.input_file = input_file
+        self.output_file = output_file
+        self.name = os.path.basename(input_file)
+        self.state = None
+        self.loaded = False
+        self.nbytes = 0 # 最後に表示をやめたときの state_nbytes()
+        self.last_shown = 0
+        self.resume_journal = False # 編集を残して解放した。次に読み込むときは確認せずにジャーナルを再生する
+
+
+class TrajectorySession:
+    """開いている軌跡の一覧と、表示中の軌跡・メモリの上限を管理する"""
+
+    def __init__(self, memory_limit):
+        self.memory_limit = memory_limit
+        self.slots = []
+        self.active = None
+        self._clock = itertools.count(1)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def index(self, slot):
+        return self.slots.index(slot)
+
+    def add(self, input_file, output_file):
+        """軌跡を一覧に加える (読み込みは表示するときに行う)。すでにあればそれを返す"""
+        for slot in self.slots:
+            if os.path.abspath(slot.input_file) == os.path.abspath(input_file):
+                return slot
+        slot = TrajectorySlot(input_file, output_file)
+        self.slots.append(slot)
+        return slot
+
+    def activate(self, slot):
+        slot.loaded = True
+        slot.last_shown = next(self._clock)
+        self.active = slot
+
+    def store(self, slot, state):
+        """表示をやめた軌跡の状態を預かる"""
+        slot.state = state
+        slot.nbytes = state_nbytes(state)
+
+    def take(self, slot):
+        """預かっていた状態を取り出す (表示し直すとき)"""
+        state, slot.state = slot.state, None
+        return state
+
+    def unload(self, slot):
+        """預かっていた状態を手放し、未読み込みに戻す。手放した状態を返す"""
+        state = self.take(slot)
+        slot.loaded = False
+        slot.nbytes = 0
+        return state
+
+    def slots_to_unload(self, active_nbytes, can_unload):
+        """メモリの上限に収まるまで解放する軌跡を、表示してから時間の経ったものから返す
+
+        active_nbytes は表示中の軌跡の大きさ。can_unload(slot) が False の軌跡は解放しない。
+        """
+        total = active_nbytes + sum(slot.nbytes for slot in self.slots if slot.state is not None)
+        candidates = sorted((slot for slot in self.slots if slot.state is not None and can_unload(slot)),
+                            key=lambda slot: slot.last_shown)
+        unload = []
+        for slot in candidates:
+            if total <= self.memory_limit:
+                break
+            unload.append(slot)
+            total -= slot.nbytes
+        return unload
@@ -0,0 +1,117 @@
+import numpy as np
+from matplotlib.path import Path
+
+# 移動済み(格子に未反映)の点がこの割合を超えたら格子を作り直す
+REBUILD_DIRTY_RATIO = 0.05
+REBUILD_DIRTY_MIN = 256
+
+
+class PointGridIndex:
+    """点の当たり判定・矩形選択・投げ縄選択用の一様格子インデックス
+
+    点はセル番号順に並べた配列として保持し、問い合わせはセル行ごとの
+    二分探索で候補を集める。ドラッグで動いた点は「未反映」として別に管理し、
+    問い合わせ時に総当たりで判定するため、移動のたびに格子を作り直す必要はない。
+    未反映の点が一定数を超えた時点でまとめて作り直す。
+    """
+
+    def __init__(self, xy, cell_size=None):
+        self.rebuild(xy, cell_size)
+
+    def rebuild(self, xy, cell_size=None):
+        # xy は編集中の軌跡の配列をそのまま参照する(コピーしない)
+        self.xy = xy
+        n = len(xy)
+        self._dirty_mask = np.zeros(n, dtype=bool)
+        self._dirty = np.empty(0, dtype=np.intp)
+        if n == 0:
+            self._origin = np.zeros(2)
+            self._cell = 1.0
+            self._shape = (1, 1)
+            self._order = np.empty(0, dtype=np.intp)
+            self._sorted_keys = np.empty(0, dtype=np.int64)
+            return
+
+        self._origin = xy.min(axis=0)
+        extent = np.ptp(xy, axis=0)
+        if cell_size is None:
+            # 1セルあたり数点になる大きさにする
+            area = max(extent[0], 1e-9) * max(extent[1], 1e-9)
+            cell_size = max(np.sqrt(4.0 * area / n), extent.max() / 65536, 1e-9)
+        self._cell = float(cell_size)
+        self._shape = tuple((extent // self._cell).astype(np.int64) + 1)
+
+        keys = self._cell_keys(xy)
+        self._order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._order]
+
+    def __len__(self):
+        return len(self.xy)
+
+    def _cell_coords(self, xy):
+        cells = np.floor((np.asarray(xy, dtype=float) - self._origin) / self._cell).astype(np.int64)
+        return np.clip(cells, 0, np.array(self._shape) - 1)
+
+    def _cell_keys(self, xy):
+        cells = self._cell_coords(xy)
+        return cells[:, 1] * self._shape[0] + cells[:, 0]
+
+    def update(self, indices):
+        """指定した点の座標が変わったことを通知する"""
+        indices = np.unique(np.asarray(indices, dtype=np.intp))
+        new = indices[~self._dirty_mask[indices]]
+        if len(new) == 0:
+            return
+        self._dirty_mask[new] = True
+        self._dirty = np.concatenate((self._dirty, new))
+        if len(self._dirty) > max(REBUILD_DIRTY_MIN, REBUILD_DIRTY_RATIO * len(self.xy)):
+            self.rebuild(self.xy, self._cell)
+
+    def _grid_candidates(self, xmin, ymin, xmax, ymax):
+        (cx0, cy0), (cx1, cy1) = self._cell_coords([[xmin, ymin], [xmax, ymax]])
+        rows = np.arange(cy0, cy1 + 1) * self._shape[0]
+        lo = np.searchsorted(self._sorted_keys, rows + cx0, side='left')
+        hi = np.searchsorted(self._sorted_keys, rows + cx1, side='right')
+        if len(lo) == 1:
+            candidates = self._order[lo[0]:hi[0]]
+        else:
+            candidates = np.concatenate([self._order[a:b] for a, b in zip(lo, hi) if b > a] or [np.empty(0, dtype=np.intp)])
+        if len(self._dirty):
+            candidates = candidates[~self._dirty_mask[candidates]]
+            candidates = np.concatenate((candidates, self._dirty))
+        return candidates
+
+    def query_rect(self, xmin, ymin, xmax, ymax):
+        """矩形内の点のインデックスを昇順で返す"""
+        if len(self.xy) == 0:
+            return np.empty(0, dtype=np.intp)
+        xmin, xmax = min(xmin, xmax), max(xmin, xmax)
+        ymin, ymax = min(ymin, ymax), max(ymin, ymax)
+        candidates = self._grid_candidates(xmin, ymin, xmax, ymax)
+        pts = self.xy[candidates]
+        inside = ((pts[:, 0] >= xmin) & (pts[:, 0] <= xmax) &
+                  (pts[:, 1] >= ymin) & (pts[:, 1] <= ymax))
+        return np.sort(candidates[inside])
+
+    def query_polygon(self, vertices):
+        """多角形(投げ縄)内の点のインデックスを昇順で返す"""
+        vertices = np.asarray(vertices, dtype=float)
+        if len(vertices) < 3:
+            return np.empty(0, dtype=np.intp)
+        (xmin, ymin), (xmax, ymax) = vertices.min(axis=0), vertices.max(axis=0)
+        candidates = self.query_rect(xmin, ymin, xmax, ymax)
+        if len(candidates) == 0:
+            return candidates
+        inside = Path(vertices).contains_points(self.xy[candidates])
+        return candidates[inside]
+
+    def nearest(self, x, y, radius):
+        """半径 radius 以内で最も近い点のインデックスを返す。なければ None"""
+        candidates = self.query_rect(x - radius, y - radius, x + radius, y + radius)
+        if len(candidates) == 0:
+            return None
+        d = np.hypot(self.xy[candidates, 0] - x, self.xy[candidates, 1] - y)
+        best = d.argmin()
+        if d[best] > radius:
+            return None
+        return int(candidates[best])
@@ -0,0 +1,69 @@
+"""曲率から速度プロファイルを計算する処理 (GUI に依存しない)
+
+各点の曲率から横加速度の上限で決まる速度を求め、閉じた周回に沿って
+加速 (前向き) と減速 (後ろ向き) の上限をかけて speed 列を作り直す。
+v^2 についての漸化式 w[i+1] = min(上限[i+1], w[i] + 2*a*ds[i]) は
+累積最小値で書き直せるため、点数が多くても Python のループなしで計算できる。
+"""
+import numpy as np
+
+from curve_engine import MIN_SPLINE_POINTS, fit_closed_spline
+
+DEFAULT_MAX_SPEED = 30.0 / 3.6 # 最高速度(m/s)
+DEFAULT_MAX_LATERAL_ACCEL = 3.0 # 横加速度の上限(m/s^2)
+DEFAULT_MAX_ACCEL = 2.0 # 加速度の上限(m/s^2)
+DEFAULT_MAX_DECEL = 3.0 # 減速度の上限(m/s^2)
+SPEED_COLUMN = 'speed'
+
+
+def point_curvature(xy, fit=None):
+    """閉曲線スプラインから各点の符号付き曲率 (左曲がりが正) を返す
+
+    fit に fit_closed_spline(xy) の結果 (tck, u) を渡すと当てはめを省略する。
+    """
+    from scipy.interpolate import splev # 起動を遅くしないよう、使うときに読み込む (curve_engine と同じ)
+    tck, u = fit if fit is not None else fit_closed_spline(xy)
+    u = u[:len(xy)]
+    dx, dy = splev(u, tck, der=1)
+    ddx, ddy = splev(u, tck, der=2)
+    speed2 = np.maximum(dx * dx + dy * dy, 1e-18)
+    return (dx * ddy - dy * ddx) / speed2 ** 1.5
+
+
+def limit_speeds(curvature, ds, max_speed=DEFAULT_MAX_SPEED, max_lateral_accel=DEFAULT_MAX_LATERAL_ACCEL,
+                 max_accel=DEFAULT_MAX_ACCEL, max_decel=DEFAULT_MAX_DECEL):
+    """閉じた周回上の各点の速度を返す
+
+    ds[i] は点 i から点 i+1 (最後の点は先頭の点) までの距離。
+    """
+    curvature = np.abs(np.asarray(curvature, dtype=float))
+    ds = np.asarray(ds, dtype=float)
+    n = len(curvature)
+    lateral = np.divide(max_lateral_accel, curvature, out=np.full(n, np.inf), where=curvature > 0)
+    limit = np.minimum(lateral, max_speed ** 2) # 各点で許される v^2
+
+    # 周回をまたぐ加減速を反映するため、2周分をつなげて累積最小値をとる
+    s = np.concatenate(([0.0], np.cumsum(np.tile(ds, 2))[:-1]))
+    limit2 = np.tile(limit, 2)
+    forward = 2 * max_accel * s + np.minimum.accumulate(limit2 - 2 * max_accel * s)
+    backward = -2 * max_decel * s + np.minimum.accumulate((limit2 + 2 * max_decel * s)[::-1])[::-1]
+    v2 = np.minimum(limit, np.minimum(forward[n:], backward[:n]))
+    return np.sqrt(np.maximum(v2, 0.0))
+
+
+def compute_speeds(xy, fit=None, **limits):
+    """閉じた点列 xy の各点の速度を返す。limits には limit_speeds のキーワード引数を渡せる"""
+    if len(xy) < MIN_SPLINE_POINTS:
+        raise ValueError("速度プロファイルを計算するには点が少なすぎます。")
+    ds = np.hypot(*(np.roll(xy, -1, axis=0) - xy).T)
+    return limit_speeds(point_curvature(xy, fit), ds, **limits)
+
+
+def apply_speed_profile(data, fit=None, **limits):
+    """speed 列を曲率から計算し直した速度で置き換えた Trajectory を返す。speed 列がなければ追加する"""
+    speeds = compute_speeds(data.xy, fit, **limits)
+    new = data.copy()
+    if SPEED_COLUMN not in new.fieldnames:
+        new.fieldnames.append(SPEED_COLUMN)
+    new.columns[SPEED_COLUMN] = speeds
+    return new
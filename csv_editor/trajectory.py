@@ -0,0 +1,131 @@
+import numpy as np
+
+from csv_loader import read_csv_columns, to_float_column
+from csv_writer import FLOAT_PRECISION, write_csv
+
+# 数値として必ず読み込む列。変換できない行は読み込み時に除外する
+REQUIRED_NUMERIC_COLUMNS = ('x', 'y', 'speed')
+
+
+def _ascii_bytes(values):
+    """Unicode の文字列配列がすべて ASCII なら、同じ内容のバイト列の配列を返す (でなければ None)"""
+    codes = np.ascontiguousarray(values, dtype=str)
+    width = codes.dtype.itemsize // 4
+    codes = codes.view(np.uint32)
+    if width == 0 or (codes >= 128).any():
+        return None
+    return codes.astype(np.uint8).view(f'S{width}')
+
+
+class Trajectory:
+    """軌跡データを列ごとの NumPy 配列で保持するクラス
+
+    x, y は (N, 2) の連続配列 ``xy`` にまとめて保持し、matplotlib や scipy へ
+    コピーなしで渡せるようにする。その他の列は ``columns`` に列名ごとの配列として
+    保持し、数値に変換できない列は文字列のまま出力まで引き継ぐ。
+
+    CSVから数値に変換した x, y, speed 以外の列は、読み込んだときの文字列を ``text`` に
+    列名ごとに保持する。書き出すときは値が変わっていない行だけ元の文字列をそのまま書くため、
+    編集していない列の桁数や整数の表記は変わらない。``text`` の配列はその場で書き換えない。
+    """
+
+    def __init__(self, fieldnames, xy, columns=None, text=None):
+        self.fieldnames = list(fieldnames)
+        self.xy = np.ascontiguousarray(xy, dtype=float).reshape(-1, 2)
+        self.columns = dict(columns) if columns else {}
+        self.text = dict(text) if text else {}
+
+    def __len__(self):
+        return self.xy.shape[0]
+
+    def __contains__(self, name):
+        return name in self.fieldnames
+
+    def __getitem__(self, name):
+        if name == 'x':
+            return self.xy[:, 0]
+        if name == 'y':
+            return self.xy[:, 1]
+        return self.columns[name]
+
+    @property
+    def x(self):
+        return self.xy[:, 0]
+
+    @property
+    def y(self):
+        return self.xy[:, 1]
+
+    def column(self, name, default=None):
+        if name in ('x', 'y'):
+            return self[name]
+        return self.columns.get(name, default)
+
+    def numeric_column(self, name):
+        """数値列ならその配列を、存在しないか文字列列なら None を返す"""
+        values = self.column(name)
+        if values is None or values.dtype.kind != 'f':
+            return None
+        return values
+
+    @property
+    def nbytes(self):
+        return (self.xy.nbytes + sum(values.nbytes for values in self.columns.values())
+                + sum(raw.nbytes for raw in self.text.values()))
+
+    def copy(self):
+        return Trajectory(self.fieldnames, self.xy.copy(),
+                          {name: values.copy() for name, values in self.columns.items()}, self.text)
+
+    def take(self, indices):
+        """指定したインデックスの行を並べた新しい Trajectory を返す"""
+        indices = np.asarray(indices, dtype=np.intp)
+        return Trajectory(self.fieldnames, self.xy[indices],
+                          {name: values[indices] for name, values in self.columns.items()},
+                          {name: raw[indices] for name, raw in self.text.items()})
+
+    @classmethod
+    def from_csv(cls, file_path):
+        fieldnames, raw = read_csv_columns(file_path)
+        if 'x' not in fieldnames or 'y' not in fieldnames:
+            raise ValueError("CSVには 'x' と 'y' の列が必要です。")
+
+        valid = np.ones(len(raw['x']), dtype=bool)
+        parsed = {}
+        for name in REQUIRED_NUMERIC_COLUMNS:
+            if name in raw:
+                parsed[name] = to_float_column(raw[name])
+                valid &= np.isfinite(parsed[name])
+
+        columns = {}
+        text = {}
+        for name in fieldnames:
+            if name in ('x', 'y'):
+                continue
+            if name in parsed:
+                columns[name] = parsed[name][valid]
+                continue
+            values = raw[name][valid]
+            # 数値の文字列はほぼ ASCII なので、元の文字列は1文字1バイトのバイト列で持つ
+            raw_text = _ascii_bytes(values)
+            try:
+                columns[name] = (values if raw_text is None else raw_text).astype(float)
+            except ValueError:
+                columns[name] = values.astype(object)
+                continue
+            text[name] = values if raw_text is None else raw_text
+
+        xy = np.column_stack((parsed['x'][valid], parsed['y'][valid]))
+        return cls(fieldnames, xy, columns, text)
+
+    def to_csv(self, file_path, precision=FLOAT_PRECISION, progress=None):
+        """CSVに書き出す。書き終えてから置き換えるため、失敗しても既存のファイルは壊れない"""
+        write_csv(file_path, self.fieldnames, [self[name] for name in self.fieldnames], precision, progress,
+                  [self._original_text(name) for name in self.fieldnames])
+
+    def _original_text(self, name):
+        """読み込んだときの文字列 (行数が変わるなどして対応しなくなっていれば None)"""
+        raw = self.text.get(name)
+        if raw is None or len(raw) != len(self):
+            return None
+        return raw
@@ -0,0 +1,282 @@
+"""重い処理をバックグラウンドで実行し、結果を Tk のメインスレッドへ返す仕組み
+
+スプラインの当てはめなど GIL を保持したまま長く動く処理はワーカープロセスで、
+ファイル書き込みのような処理はスレッドプールで実行する。ワーカーからの進捗と
+結果はスレッドセーフなキューに積まれ、Tk の after で定期的に取り出して
+メインスレッド上でコールバックを呼ぶ。
+
+ワーカープロセスは使い回し、ジョブごとにスレッドプールのスレッドが1つ付いて
+パイプで受け渡しをする。子プロセスからの進捗もそのパイプで届く。scipy の関数の中など
+処理が進捗の報告に戻ってこない間も止められるよう、プロセスのジョブのキャンセルは
+そのワーカープロセスを終了させて行う (次のジョブでは新しいプロセスを起動する)。
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+POLL_INTERVAL_MS = 50
+PROCESS_CANCEL_CHECK_SEC = 0.05 # プロセスのジョブの結果を待つ間にキャンセルを確認する間隔(秒)
+
+
+class JobCancelled(Exception):
+    """ジョブがキャンセルされたことをワーカー側に伝える例外"""
+
+
+class Job:
+    def __init__(self, label, cancellable=True):
+        self.label = label
+        self.cancellable = cancellable # False なら cancel_all() の対象にしない
+        self.future = None
+        self.submitted_at = time.perf_counter()
+        self.progress = None # 0.0〜1.0。進捗が分からない場合は None
+        self.message = ""
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+
+class ProgressReporter:
+    """スレッドで動く処理に渡す進捗報告用の関数オブジェクト
+
+    呼び出すたびにキャンセルを確認し、キャンセル済みなら JobCancelled を送出する。
+    """
+
+    def __init__(self, job, events):
+        self._job = job
+        self._events = events
+
+    def __call__(self, fraction, message=""):
+        if self._job.cancelled:
+            raise JobCancelled()
+        self._events.put(('progress', self._job, fraction, message))
+
+
+def _process_main(conn):
+    """ワーカープロセスの本体。(fn, args) を受け取って実行し、進捗と結果をパイプで返す"""
+    def progress(fraction, message=""):
+        conn.send(('progress', fraction, message))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        fn, args = task
+        try:
+            result = fn(*args, progress=progress)
+        except Exception as e:
+            try:
+                conn.send(('error', e))
+            except Exception:
+                # 送れない (pickle できない) 例外は文字列にして返す
+                conn.send(('error', RuntimeError(f"{type(e).__name__}: {e}")))
+            continue
+        conn.send(('done', result))
+
+
+class _WorkerProcess:
+    """ジョブを1つずつ実行する spawn 起動のワーカープロセス"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_process_main, args=(child_conn,), name="csv_editor_process",
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.alive = True
+
+    def run(self, job, reporter, fn, args):
+        """fn(*args) を実行して結果を返す
+
+        キャンセルされたらプロセスを終了させて JobCancelled を送出する。終了したプロセスは
+        alive が False になり、使い回せない。
+        """
+        try:
+            self.conn.send((fn, args))
+            while True:
+                if job.cancelled:
+                    raise JobCancelled()
+                if not self.conn.poll(PROCESS_CANCEL_CHECK_SEC):
+                    continue
+                try:
+                    kind, *payload = self.conn.recv()
+                except (EOFError, OSError):
+                    raise RuntimeError("ワーカープロセスが異常終了しました。") from None
+                if kind == 'progress':
+                    reporter(*payload) # キャンセル済みなら JobCancelled を送出する
+                else:
+                    break
+        except BaseException:
+            self.terminate()
+            raise
+        if kind == 'done':
+            return payload[0]
+        raise payload[0] # fn が送出した例外 (プロセスはそのまま使える)
+
+    def terminate(self):
+        self.alive = False
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+
+
+class BackgroundRunner:
+    def __init__(self, root, max_threads=2, max_processes=None):
+        self.root = root
+        self.jobs = []
+        self._events = queue.SimpleQueue()
+        self._callbacks = {}
+        self._threads = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="csv_editor_worker")
+        self._max_processes = max_processes or os.cpu_count() or 1
+        self._process_threads = None
+        self._idle_processes = [] # 待機中のワーカープロセス
+        self._process_lock = threading.Lock()
+        self._closed = False
+        self._poll_job = None
+        # ジョブの開始・進捗・終了のたびにメインスレッドで呼ばれる (状態表示の更新用)
+        self.on_status = None
+
+    @property
+    def busy(self):
+        return bool(self.jobs)
+
+    def submit(self, label, fn, *args, use_process=False, on_done=None, on_error=None, on_progress=None,
+               on_cancel=None, cancellable=True):
+        """fn(*args) をバックグラウンドで実行する
+
+        use_process が False の場合、fn の最初の引数には ProgressReporter が渡される。
+        use_process が True の場合は fn(*args, progress=...) をワーカープロセスで実行する。
+        fn と引数・結果は pickle できなければならない。progress(fraction, message) で報告した
+        進捗はメインスレッドに届くが、キャンセルの確認はしない (プロセスごと終了させる)。
+        キャンセルされたジョブは on_done / on_error の代わりに on_cancel を呼ぶ。
+        cancellable が False のジョブは cancel_all() (キャンセルボタン) では止めない。
+        コールバックはすべてメインスレッドで呼ばれる。
+        """
+        job = Job(label, cancellable)
+        if use_process:
+            if self._process_threads is None:
+                self._process_threads = ThreadPoolExecutor(max_workers=self._max_processes,
+                                                           thread_name_prefix="csv_editor_process")
+            job.future = self._process_threads.submit(self._run_in_process, job, ProgressReporter(job, self._events),
+                                                      fn, args)
+        else:
+            job.future = self._threads.submit(fn, ProgressReporter(job, self._events), *args)
+        self._callbacks[job] = (on_done, on_error, on_progress, on_cancel)
+        self.jobs.append(job)
+        job.future.add_done_callback(lambda future: self._events.put(('finished', job)))
+        self._events.put(('progress', job, None, "実行中..."))
+        self._schedule_poll()
+        return job
+
+    @property
+    def cancellable(self):
+        """キャンセルできるジョブが実行中かどうか"""
+        return any(job.cancellable for job in self.jobs)
+
+    def cancel_all(self):
+        for job in self.jobs:
+            if job.cancellable:
+                job.cancel()
+
+    def shutdown(self):
+        for job in self.jobs:
+            job.cancel()
+        if self._poll_job is not None:
+            self.root.after_cancel(self._poll_job)
+            self._poll_job = None
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._process_threads is not None:
+            # 実行中のジョブはキャンセルでプロセスごと終了する
+            self._process_threads.shutdown(wait=False, cancel_futures=True)
+        with self._process_lock:
+            self._closed = True
+            idle, self._idle_processes = self._idle_processes, []
+        for worker in idle:
+            worker.stop()
+
+    def _run_in_process(self, job, reporter, fn, args):
+        """プロセスのジョブに付くスレッドで、待機中のワーカープロセス (なければ新しく起動) に実行させる"""
+        with self._process_lock:
+            worker = self._idle_processes.pop() if self._idle_processes else None
+        if worker is None:
+            # Tk のスレッドを抱えたままの fork を避けるため spawn で起動する
+            worker = _WorkerProcess(multiprocessing.get_context('spawn'))
+        try:
+            return worker.run(job, reporter, fn, args)
+        finally:
+            if worker.alive:
+                with self._process_lock:
+                    if not self._closed:
+                        self._idle_processes.append(worker)
+                        worker = None
+                if worker is not None:
+                    worker.stop()
+
+    def _schedule_poll(self):
+        if self._poll_job is None:
+            self._poll_job = self.root.after(POLL_INTERVAL_MS, self._poll)
+
+    def _poll(self):
+        self._poll_job = None
+        handled = False
+        while True:
+            try:
+                event = self._events.get_nowait()
+            except queue.Empty:
+                break
+            handled = True
+            if event[0] == 'progress':
+                self._handle_progress(*event[1:])
+            else:
+                self._handle_finished(event[1])
+        if handled and self.on_status:
+            self.on_status(self)
+        if self.jobs:
+            self._schedule_poll()
+
+    def _handle_progress(self, job, fraction, message):
+        if job not in self._callbacks:
+            return
+        job.progress = fraction
+        job.message = message
+        on_progress = self._callbacks[job][2]
+        if on_progress:
+            on_progress(job)
+
+    def _handle_finished(self, job):
+        on_done, on_error, _, on_cancel = self._callbacks.pop(job)
+        self.jobs.remove(job)
+        try:
+            if job.cancelled:
+                # 実行中にキャンセルされた処理の結果は反映しない
+                raise JobCancelled()
+            result = job.future.result()
+        except (CancelledError, JobCancelled):
+            if on_cancel:
+                on_cancel()
+            return
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            return
+        if on_done:
+            on_done(result)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# エディタのモジュールは csv_editor/ 内で互いを直接 import するため、そのディレクトリをパスに加える
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "csv_editor"))
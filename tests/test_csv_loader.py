@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+
+import csv_loader
+
+
+def write_lane(path, rows):
+    path.write_text("x,y,note\n" + "".join(f"{x},{y},p\n" for x, y in rows))
+    return str(path)
+
+
+def cache_files(tmp_path):
+    return sorted(os.listdir(tmp_path / csv_loader.CACHE_DIR_NAME))
+
+
+def test_cache_is_written_then_memory_mapped(tmp_path):
+    path = write_lane(tmp_path / "lane.csv", [(0, 0), (1, 2), ("abc", 3), (4, 5)])
+    first = csv_loader.load_xy(path)
+    # 数値に変換できない行は除く
+    np.testing.assert_array_equal(first, [[0, 0], [1, 2], [4, 5]])
+    assert not isinstance(first, np.memmap)
+    assert cache_files(tmp_path) == [os.path.basename(csv_loader._cache_path(path))]
+
+    second = csv_loader.load_xy(path)
+    assert isinstance(second, np.memmap) and not second.flags.writeable
+    np.testing.assert_array_equal(second, first)
+
+
+def test_updated_csv_replaces_stale_cache(tmp_path):
+    path = write_lane(tmp_path / "lane.csv", [(0, 0), (1, 1)])
+    csv_loader.load_xy(path)
+    old_cache = csv_loader._cache_path(path)
+    write_lane(tmp_path / "lane.csv", [(0, 0), (1, 1), (2, 2)])
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(old_cache).st_mtime_ns + 10**9))
+    np.testing.assert_array_equal(csv_loader.load_xy(path), [[0, 0], [1, 1], [2, 2]])
+    assert cache_files(tmp_path) == [os.path.basename(csv_loader._cache_path(path))]
+    np.testing.assert_array_equal(csv_loader.load_xy(path), [[0, 0], [1, 1], [2, 2]])
+
+
+def test_broken_cache_falls_back_to_csv(tmp_path):
+    path = write_lane(tmp_path / "lane.csv", [(0, 0), (1, 1)])
+    csv_loader.load_xy(path)
+    with open(csv_loader._cache_path(path), 'wb') as outfile:
+        outfile.write(b"broken")
+    np.testing.assert_array_equal(csv_loader.load_xy(path), [[0, 0], [1, 1]])
+
+
+def test_without_cache_nothing_is_written(tmp_path):
+    path = write_lane(tmp_path / "lane.csv", [(0, 0), (1, 1)])
+    csv_loader.load_xy(path, use_cache=False)
+    assert not (tmp_path / csv_loader.CACHE_DIR_NAME).exists()
@@ -0,0 +1,92 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+
+import csv_writer
+from csv_writer import format_float_pieces, write_csv
+from trajectory import Trajectory
+
+
+def formatted(values, precision=csv_writer.FLOAT_PRECISION):
+    rows = np.concatenate(format_float_pieces(values, precision), axis=1)
+    return [bytes(row[row != 0]).decode('ascii') for row in rows]
+
+
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as infile:
+        return list(csv.reader(infile))
+
+
+@pytest.mark.parametrize("precision", [0, 3, 8])
+def test_format_matches_printf(precision):
+    values = np.array([0.0, -0.0, 1.0, -1.0, 0.5, 9.999999999, -123.456789012345, 1e-9, 42.0, 99999.125,
+                       2.0 ** 40 + 0.25, -(2.0 ** 52)])
+    assert formatted(values, precision) == [f"{v:.{precision}f}" for v in values]
+
+
+def test_format_random_values_match_printf():
+    # ちょうど中間に近い値では最後の桁が異なりうるため、その付近の値は除いて比べる
+    rng = np.random.default_rng(0)
+    values = rng.uniform(-1e6, 1e6, 20000) * rng.choice([1e-6, 1e-3, 1.0], 20000)
+    scaled = np.abs(values) * 1e8
+    values = values[np.abs(scaled - np.floor(scaled) - 0.5) > 1e-3]
+    assert formatted(values) == [f"{v:.8f}" for v in values]
+
+
+def test_non_finite_and_huge_values_fall_back_to_printf():
+    values = np.array([1.5, np.nan, np.inf, -np.inf, 1e300])
+    assert formatted(values) == [f"{v:.8f}" for v in values]
+
+
+def test_write_csv_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(csv_writer, "CHUNK_ROWS", 7) # 複数のチャンクに分けて書く
+    n = 20
+    x = np.linspace(-1.0, 1.0, n)
+    names = np.array([f'p{i}' if i % 3 else 'a,"b"\nc' for i in range(n)], dtype=object)
+    path = tmp_path / "out.csv"
+    progress = []
+    write_csv(str(path), ['x', 'name', 'y'], [x, names, x * 2], progress=lambda f, m: progress.append(f))
+
+    rows = read_rows(path)
+    assert rows[0] == ['x', 'name', 'y']
+    assert [row[0] for row in rows[1:]] == [f"{v:.8f}" for v in x]
+    assert [row[1] for row in rows[1:]] == list(names)
+    assert [row[2] for row in rows[1:]] == [f"{v:.8f}" for v in x * 2]
+    assert progress[-1] == 1.0 and len(progress) == 3
+    assert open(path, "rb").read().count(b"\r\n") == n + 1 # 行末は csv.writer と同じ CRLF
+
+
+def test_failed_write_keeps_existing_file(tmp_path):
+    path = tmp_path / "out.csv"
+    path.write_text("old\n")
+
+    def cancel(fraction, message):
+        raise RuntimeError("cancelled")
+
+    with pytest.raises(RuntimeError):
+        write_csv(str(path), ['x'], [np.arange(3.0)], progress=cancel)
+    assert path.read_text() == "old\n"
+    assert os.listdir(tmp_path) == ["out.csv"]
+
+
+def test_unedited_extra_columns_keep_their_text(tmp_path):
+    source = tmp_path / "in.csv"
+    source.write_text("x,y,speed,qw,flag,note\n"
+                      "1.5,2,3,-0.8641775047575619,1,a\n"
+                      "2.5,3,4,0.5000,0,b\n"
+                      "3.5,4,5,1e-3,2,c\n")
+    data = Trajectory.from_csv(str(source))
+    path = tmp_path / "out.csv"
+    data.to_csv(str(path))
+    assert read_rows(path)[1:] == [["1.50000000", "2.00000000", "3.00000000", "-0.8641775047575619", "1", "a"],
+                                   ["2.50000000", "3.00000000", "4.00000000", "0.5000", "0", "b"],
+                                   ["3.50000000", "4.00000000", "5.00000000", "1e-3", "2", "c"]]
+
+    # 値を変えた行だけ書式を揃えて書く
+    data.columns['flag'] = np.array([1.0, 5.0, 2.0])
+    data.take([2, 0]).to_csv(str(path))
+    assert [row[3:5] for row in read_rows(path)[1:]] == [["1e-3", "2"], ["-0.8641775047575619", "1"]]
+    data.to_csv(str(path))
+    assert [row[4] for row in read_rows(path)[1:]] == ["1", "5.00000000", "2"]
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import batch_resample
+import curve_engine
+from trajectory import Trajectory
+
+
+def circle(n, radius=10.0, phase=0.0):
+    t = np.linspace(0.0, 2 * np.pi, n, endpoint=False) + phase
+    xy = radius * np.column_stack((np.cos(t), np.sin(t)))
+    yaw = t + np.pi / 2
+    columns = {'speed': np.linspace(1.0, 2.0, n), 'x_quat': np.zeros(n), 'y_quat': np.zeros(n),
+               'z_quat': np.sin(yaw / 2), 'w_quat': np.cos(yaw / 2)}
+    return Trajectory(['x', 'y'] + list(columns), xy, columns)
+
+
+def test_resample_all_keeps_point_count_without_repeating_the_start():
+    # 間隔の不揃いな点から作り直すと、ほぼ等間隔に並び、先頭の点が末尾に重ならない
+    data = circle(60)
+    data = data.take(np.sort(np.random.default_rng(0).choice(60, 40, replace=False)))
+    result = curve_engine.resample_all(data)
+    assert len(result) == len(data)
+    spacing = np.hypot(*np.diff(np.vstack((result.xy, result.xy[:1])), axis=0).T)
+    assert spacing.min() > 0.8 * spacing.mean()
+    np.testing.assert_allclose(np.hypot(*result.xy.T), 10.0, rtol=1e-3)
+
+
+def test_sample_closed_curve_transfers_attributes():
+    result = curve_engine.sample_closed_curve(circle(50), 25)
+    assert len(result) == 25
+    assert result.fieldnames == circle(1).fieldnames
+    # 速度は補間した値、クォータニオンは接線方向から計算した単位クォータニオン
+    assert 1.0 <= result['speed'].min() and result['speed'].max() <= 2.0
+    quats = np.column_stack([result[name] for name in curve_engine.QUATERNION_COLUMNS])
+    np.testing.assert_allclose(np.linalg.norm(quats, axis=1), 1.0)
+    heading = 2 * np.arctan2(quats[:, 2], quats[:, 3])
+    tangent = np.column_stack((-result.xy[:, 1], result.xy[:, 0]))
+    np.testing.assert_allclose(np.cos(heading), tangent[:, 0] / np.hypot(*tangent.T), atol=1e-2)
+
+
+def test_too_few_points_raise_value_error():
+    with pytest.raises(ValueError):
+        curve_engine.resample_all(circle(2))
+    with pytest.raises(ValueError):
+        curve_engine.sample_closed_curve(circle(20), 0)
+
+
+def test_batch_resample_writes_outputs(tmp_path):
+    for i in range(2):
+        circle(30, phase=i).to_csv(str(tmp_path / f"line{i}.csv"))
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    status = batch_resample.main([str(tmp_path), "--mode", "sample", "--points", "12",
+                                  "--output-dir", str(output_dir), "--jobs", "1"])
+    assert status == batch_resample.EXIT_OK
+    for i in range(2):
+        assert len(Trajectory.from_csv(str(output_dir / f"line{i}_resampled.csv"))) == 12
+    assert batch_resample.main([str(tmp_path / "missing*.csv")]) == batch_resample.EXIT_USAGE
+
+
+def test_batch_resample_skips_previous_outputs_in_directory(tmp_path):
+    circle(30).to_csv(str(tmp_path / "line.csv"))
+    args = [str(tmp_path), "--mode", "sample", "--points", "12", "--jobs", "1"]
+    assert batch_resample.main(args) == batch_resample.EXIT_OK
+    # 2回目も line.csv だけを処理し、line_resampled_resampled.csv は作らない
+    assert batch_resample.main(args) == batch_resample.EXIT_OK
+    assert sorted(p.name for p in tmp_path.glob("*.csv")) == ["line.csv", "line_resampled.csv"]
+    # 直接指定したファイルは接尾辞が付いていても処理する
+    assert batch_resample.collect_inputs([str(tmp_path / "line_resampled.csv")], skip_suffix="_resampled") == \
+        [str(tmp_path / "line_resampled.csv")]
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import deviation
+from deviation import ReferenceLine
+
+
+def brute_distance(points, polyline):
+    distance = np.empty(len(points))
+    a, ab = polyline[:-1], np.diff(polyline, axis=0)
+    for i, p in enumerate(points):
+        ap = p - a
+        t = np.clip((ap * ab).sum(axis=1) / (ab * ab).sum(axis=1), 0.0, 1.0)
+        distance[i] = np.hypot(*(ap - t[:, None] * ab).T).min()
+    return distance
+
+
+def wavy_ring(n, radius=100.0):
+    # 反時計回りに進む、半径の揺れた閉じた参照線 (始点は末尾に繰り返さない)
+    t = np.linspace(0.0, 2 * np.pi, n, endpoint=False)
+    r = radius + 5.0 * np.sin(7 * t)
+    return r[:, None] * np.column_stack((np.cos(t), np.sin(t)))
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(42)
+
+
+def test_closed_line_matches_brute_force(rng):
+    line_xy = wavy_ring(50000) # 間引いた線分インデックスと探し直しの両方を通る点数
+    line = ReferenceLine(line_xy)
+    assert line.closed
+    angle = rng.uniform(0.0, 2 * np.pi, 400)
+    radius = 100.0 + rng.uniform(-15.0, 15.0, 400)
+    points = radius[:, None] * np.column_stack((np.cos(angle), np.sin(angle)))
+    points[0] = (line_xy[-1] + line_xy[0]) / 2 + [0.3, 0.0] # 閉じる区間のすぐ近く
+    distance, offset = line.project(points)
+    np.testing.assert_allclose(distance, brute_distance(points, np.vstack((line_xy, line_xy[:1]))), atol=1e-9)
+    np.testing.assert_array_equal(np.abs(offset), distance)
+    # 反時計回りなので、左側 (正) は内側
+    far = distance > 1.0
+    expected_inside = np.hypot(*points.T) < 100.0 + 5.0 * np.sin(7 * angle)
+    np.testing.assert_array_equal((offset > 0)[far], expected_inside[far])
+
+
+def test_open_line_and_invalid_points(rng, monkeypatch):
+    monkeypatch.setattr(deviation, "COARSE_VERTICES", 16)
+    x = np.linspace(0.0, 100.0, 1001)
+    line_xy = np.column_stack((x, np.sin(x / 5.0)))
+    line = ReferenceLine(line_xy)
+    assert not line.closed
+    points = np.column_stack((rng.uniform(-10.0, 110.0, 300), rng.uniform(-5.0, 5.0, 300)))
+    points[:2] = [[np.nan, 0.0], [np.inf, 1.0]]
+    distance, offset = line.project(points)
+    assert np.isnan(distance[:2]).all() and np.isnan(offset[:2]).all()
+    np.testing.assert_allclose(distance[2:], brute_distance(points[2:], line_xy), atol=1e-9)
+    # 始点より手前の点は始点までの距離になる
+    np.testing.assert_allclose(line.project([[-3.0, 4.0]])[0], 5.0)
+
+
+def test_too_short_line_returns_nan():
+    line = ReferenceLine([[0.0, 0.0]])
+    assert not line
+    distance, offset = line.project([[1.0, 1.0]])
+    assert np.isnan(distance).all() and np.isnan(offset).all()
@@ -0,0 +1,107 @@
+import numpy as np
+
+from history import ColumnEdit, CompoundEdit, EditHistory, PointEdit, ReplaceEdit
+from trajectory import Trajectory
+
+
+def make_trajectory(n=10):
+    xy = np.column_stack((np.arange(n, dtype=float), np.arange(n, dtype=float) * 2))
+    return Trajectory(['x', 'y', 'speed'], xy, {'speed': np.full(n, 3.0)})
+
+
+def move(data, indices, offset):
+    before = data.xy[indices]
+    record = PointEdit(indices, before, before + offset)
+    return record.redo(data), record
+
+
+def test_point_edit_undo_redo_round_trip():
+    history = EditHistory(1 << 20)
+    data = make_trajectory()
+    original = data.xy.copy()
+    data, record = move(data, [1, 4], (0.5, -1.0))
+    edited = data.xy.copy()
+    history.push(record)
+
+    data, changed = history.undo(data)
+    np.testing.assert_array_equal(data.xy, original)
+    np.testing.assert_array_equal(changed, [1, 4])
+    assert history.can_redo and not history.can_undo
+
+    data, changed = history.redo(data)
+    np.testing.assert_array_equal(data.xy, edited)
+    assert history.can_undo and not history.can_redo
+
+
+def test_column_edit_adds_and_removes_column():
+    history = EditHistory(1 << 20)
+    data = make_trajectory()
+    record = ColumnEdit('z', None, np.ones(len(data)))
+    data = record.redo(data)
+    history.push(record)
+    assert 'z' in data
+
+    data, changed = history.undo(data)
+    assert 'z' not in data and 'z' not in data.columns
+    assert len(changed) == 0
+    data, _ = history.redo(data)
+    np.testing.assert_array_equal(data['z'], np.ones(len(data)))
+
+
+def test_compound_and_replace_edits_round_trip():
+    history = EditHistory(1 << 20)
+    data = make_trajectory()
+    original = data.copy()
+
+    speeds = np.linspace(1.0, 2.0, len(data))
+    data, point = move(data, [0], (1.0, 1.0))
+    column = ColumnEdit('speed', data.column('speed'), speeds)
+    data = column.redo(data)
+    history.push(CompoundEdit([point, column]))
+
+    replaced = make_trajectory(4)
+    history.push(ReplaceEdit(data, "リサンプリング"))
+    data = replaced
+
+    data, changed = history.undo(data)
+    assert changed is None
+    assert len(data) == len(original)
+    np.testing.assert_array_equal(data['speed'], speeds)
+
+    data, _ = history.undo(data)
+    np.testing.assert_array_equal(data.xy, original.xy)
+    np.testing.assert_array_equal(data['speed'], original['speed'])
+
+    data, _ = history.redo(data)
+    data, _ = history.redo(data)
+    assert data is replaced
+
+
+def test_push_clears_redo_stack():
+    history = EditHistory(1 << 20)
+    data = make_trajectory()
+    data, record = move(data, [2], (1.0, 0.0))
+    history.push(record)
+    data, _ = history.undo(data)
+    data, record = move(data, [3], (1.0, 0.0))
+    history.push(record)
+    assert not history.can_redo
+    assert len(history) == 1
+
+
+def test_memory_limit_drops_oldest_but_keeps_latest():
+    data = make_trajectory()
+    _, record = move(data.copy(), [0], (1.0, 0.0))
+    history = EditHistory(record.nbytes * 2)
+    records = []
+    for i in range(5):
+        data, record = move(data, [i], (1.0, 0.0))
+        history.push(record)
+        records.append(record)
+    assert list(history.undo_stack) == records[-2:]
+    assert history.nbytes <= history.max_bytes
+
+    # 上限より大きい1手でも直前の1手は残す
+    big = ReplaceEdit(make_trajectory(1000))
+    history.push(big)
+    assert list(history.undo_stack) == [big]
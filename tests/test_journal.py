@@ -0,0 +1,207 @@
+import numpy as np
+import pytest
+
+import journal
+from history import ColumnEdit, CompoundEdit, EditHistory, PointEdit, ReplaceEdit
+from trajectory import Trajectory
+
+SOURCE = {"path": "input.csv", "size": 1, "mtime_ns": 1}
+
+
+def make_trajectory(n=12):
+    xy = np.column_stack((np.arange(n, dtype=float), np.zeros(n)))
+    return Trajectory(['x', 'y', 'speed'], xy, {'speed': np.full(n, 2.0)})
+
+
+class Session:
+    """エディタと同じ順序で履歴とジャーナルを更新する"""
+
+    def __init__(self, path, data):
+        self.data = data
+        self.history = EditHistory(1 << 30)
+        self.journal = journal.EditJournal(str(path), SOURCE)
+        self.journal.reset()
+
+    def edit(self, record, data=None):
+        self.data = record.redo(self.data) if data is None else data
+        self.history.push(record)
+        self.journal.append(journal.EDIT, record, self.data)
+
+    def move(self, index, dx):
+        before = self.data.xy[[index]]
+        self.edit(PointEdit([index], before, before + (dx, 0.0)))
+
+    def undo(self):
+        self.data, _ = self.history.undo(self.data)
+        self.journal.append(journal.UNDO, self.history.redo_stack[-1], self.data)
+
+    def redo(self):
+        self.data, _ = self.history.redo(self.data)
+        self.journal.append(journal.REDO, self.history.undo_stack[-1], self.data)
+
+
+def replay(path, source=SOURCE):
+    restored = journal.EditJournal(str(path), source)
+    pending = restored.pending_edits()
+    history = EditHistory(1 << 30)
+    data = restored.replay(make_trajectory(), history) if pending else None
+    restored.close()
+    return pending, data, history
+
+
+def assert_same(a, b):
+    np.testing.assert_array_equal(a.xy, b.xy)
+    assert a.fieldnames == b.fieldnames
+    for name in a.columns:
+        np.testing.assert_array_equal(a.columns[name], b.columns[name])
+
+
+def test_replay_restores_data_and_history(tmp_path):
+    path = tmp_path / "out.journal"
+    session = Session(path, make_trajectory())
+    session.move(1, 0.5)
+    session.edit(CompoundEdit([ColumnEdit('speed', session.data['speed'], np.arange(12.0)),
+                               ColumnEdit('z', None, np.ones(12))]))
+    replaced = Trajectory(session.data.fieldnames, session.data.xy[::2] * 3,
+                          {name: values[::2] for name, values in session.data.columns.items()})
+    session.edit(ReplaceEdit(session.data, "リサンプリング"), replaced)
+    session.move(0, 1.0)
+    session.undo()
+    session.undo()
+    session.redo()
+    session.journal.close()
+
+    pending, data, history = replay(path)
+    assert pending == 7
+    assert_same(data, session.data)
+    assert len(history) == len(session.history)
+    assert len(history.redo_stack) == len(session.history.redo_stack)
+    while history.can_undo:
+        data, _ = history.undo(data)
+    assert_same(data, make_trajectory())
+
+
+def test_undo_redo_of_replayable_edits_are_empty_frames(tmp_path):
+    path = tmp_path / "out.journal"
+    session = Session(path, make_trajectory())
+    session.edit(ReplaceEdit(session.data), make_trajectory(30))
+    session.undo()
+    session.redo()
+    session.journal.close()
+
+    frames, _ = journal.read_frames(str(path))
+    assert [kind for kind, _ in frames] == [journal.HEADER, journal.EDIT, journal.UNDO, journal.REDO]
+    assert [len(payload) for _, payload in frames[2:]] == [0, 0]
+    assert len(replay(path)[1]) == 30
+
+
+def test_undo_before_checkpoint_is_replayed_from_its_diff(tmp_path):
+    path = tmp_path / "out.journal"
+    session = Session(path, make_trajectory())
+    session.move(1, 5.0)
+    session.journal.reset(session.data) # チェックポイント。これより前の編集は再生時の履歴にない
+    session.move(2, 7.0)
+    session.undo()
+    session.undo()
+    session.redo()
+    session.journal.close()
+
+    pending, data, history = replay(path)
+    assert_same(data, session.data)
+    np.testing.assert_array_equal(data.xy[1:3, 0], [6.0, 2.0])
+    # チェックポイント後の編集はやり直せる
+    assert len(history) == 0 and len(history.redo_stack) == 1
+    data, _ = history.redo(data)
+    assert data.xy[2, 0] == 9.0
+
+
+def test_truncated_last_frame_is_dropped(tmp_path):
+    path = tmp_path / "out.journal"
+    session = Session(path, make_trajectory())
+    session.move(1, 1.0)
+    session.move(2, 1.0)
+    session.journal.close()
+    content = path.read_bytes()
+    expected_after_first = make_trajectory()
+    expected_after_first.xy[1, 0] += 1.0
+
+    path.write_bytes(content[:-5]) # 最後のフレームの途中で異常終了した
+    pending, data, history = replay(path)
+    assert pending == 1
+    assert_same(data, expected_after_first)
+    # 再生後に続きを書くと、途中で切れたフレームは捨てられている
+    restored = journal.EditJournal(str(path), SOURCE)
+    restored.pending_edits()
+    restored.replay(make_trajectory(), EditHistory(1 << 30))
+    restored.close()
+    assert journal.split_frames(path.read_bytes())[1] == path.stat().st_size
+
+
+def test_frame_with_bad_crc_stops_reading(tmp_path):
+    path = tmp_path / "out.journal"
+    session = Session(path, make_trajectory())
+    session.move(1, 1.0)
+    session.move(2, 1.0)
+    session.move(3, 1.0)
+    session.journal.close()
+    content = bytearray(path.read_bytes())
+    frames, end = journal.split_frames(bytes(content))
+    assert end == len(content) and len(frames) == 4
+
+    # 2つ目の編集のペイロードを1バイト壊す
+    offset = sum(journal.FRAME_HEADER.size + len(payload) for _, payload in frames[:2])
+    content[offset + journal.FRAME_HEADER.size] ^= 0xFF
+    path.write_bytes(bytes(content))
+    frames, end = journal.split_frames(bytes(content))
+    assert len(frames) == 2 and end == offset
+
+    pending, data, _ = replay(path)
+    assert pending == 1
+    np.testing.assert_array_equal(data.xy[1:4, 0], [2.0, 2.0, 3.0])
+
+
+def test_journal_for_another_source_is_ignored(tmp_path):
+    path = tmp_path / "out.journal"
+    session = Session(path, make_trajectory())
+    session.move(1, 1.0)
+    session.journal.close()
+    assert replay(path, dict(SOURCE, size=2))[0] == 0
+    assert replay(tmp_path / "missing.journal")[0] == 0
+
+
+def test_undo_marker_without_history_is_an_error(tmp_path):
+    path = tmp_path / "out.journal"
+    content = journal._frame(journal.HEADER, b'{"path": "input.csv", "size": 1, "mtime_ns": 1}')
+    path.write_bytes(content + journal._frame(journal.UNDO, b''))
+    restored = journal.EditJournal(str(path), SOURCE)
+    assert restored.pending_edits() == 1
+    history = EditHistory(1 << 30)
+    with pytest.raises(journal.JournalError):
+        restored.replay(make_trajectory(), history)
+    assert not history.can_undo
+
+
+def test_record_encoding_round_trip():
+    record = CompoundEdit([PointEdit([3, 1], [[0.0, 1.0], [2.0, 3.0]], [[4.0, 5.0], [6.0, 7.0]]),
+                           ColumnEdit('name', np.array(['a', 'b'], dtype=object), np.array(['c', 'd'], dtype=object))])
+    kind, size, _ = journal.FRAME_HEADER.unpack_from(journal.encode_record(journal.EDIT, record))
+    frames, _ = journal.split_frames(journal.encode_record(journal.EDIT, record))
+    decoded = journal.decode_record(frames[0][1])
+    assert kind == journal.EDIT and size == len(frames[0][1])
+    np.testing.assert_array_equal(decoded.records[0].indices, [3, 1])
+    np.testing.assert_array_equal(decoded.records[0].after, [[4.0, 5.0], [6.0, 7.0]])
+    assert list(decoded.records[1].after) == ['c', 'd']
+    with pytest.raises(journal.JournalError):
+        journal.decode_record(frames[0][1][:-3])
+
+
+def test_close_removes_journal_without_edits(tmp_path):
+    path = tmp_path / "out.journal"
+    session = Session(path, make_trajectory())
+    session.journal.close(remove_if_empty=True)
+    assert not path.exists()
+
+    session = Session(path, make_trajectory())
+    session.move(1, 1.0)
+    session.journal.close(remove_if_empty=True)
+    assert replay(path)[0] == 1
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from lane_clearance import LaneDistanceField
+
+RESOLUTION = 0.1
+
+
+def brute_distance(points, polyline):
+    """各点から折れ線 (閉じていなければ閉じない) までの最短距離"""
+    a = polyline[:-1][None]
+    ab = np.diff(polyline, axis=0)[None]
+    ap = points[:, None] - a
+    t = np.clip((ap * ab).sum(axis=2) / (ab * ab).sum(axis=2), 0.0, 1.0)
+    return np.hypot(*(ap - t[..., None] * ab).transpose(2, 0, 1)).min(axis=1)
+
+
+def ring(radius, n=100):
+    # 始点を末尾に繰り返さない (閉じる区間は LaneDistanceField が補う)
+    t = np.linspace(0.0, 2 * np.pi, n, endpoint=False)
+    return radius * np.column_stack((np.cos(t), np.sin(t)))
+
+
+def closed(xy):
+    return np.vstack((xy, xy[:1]))
+
+
+@pytest.fixture(scope="module")
+def course():
+    inner, outer = ring(8.0), ring(12.0)
+    return inner, outer, LaneDistanceField([inner, outer], RESOLUTION)
+
+
+def test_distance_and_sign_match_brute_force(course):
+    inner, outer, field = course
+    rng = np.random.default_rng(7)
+    radius = rng.uniform(0.0, 16.0, 3000)
+    angle = rng.uniform(0.0, 2 * np.pi, 3000)
+    points = radius[:, None] * np.column_stack((np.cos(angle), np.sin(angle)))
+    distances = np.column_stack((brute_distance(points, closed(inner)), brute_distance(points, closed(outer))))
+    # 多角形の頂点は円周上にあるため、境界から離れた点の内外は半径で決まる
+    # コース外では各境界までの距離がすべて負になるため、最小クリアランスは遠い方の境界で決まる
+    inside = (radius > 8.0) & (radius < 12.0)
+    expected = np.where(inside, distances.min(axis=1), -distances.max(axis=1))
+
+    # 境界の真上 (円弧と弦の間など) では内外が格子の精度でしか決まらないため、離れた点だけで比べる
+    away = distances.min(axis=1) > 3 * RESOLUTION
+    assert field.signed
+    clearance = field.clearance(points[away])
+    np.testing.assert_allclose(clearance, expected[away], atol=2 * RESOLUTION)
+    np.testing.assert_array_equal(clearance > 0, inside[away])
+
+
+def test_segment_closing_the_boundary_is_a_wall(course):
+    inner, outer, field = course
+    # 末尾の点と始点を結ぶ区間の中点から、法線方向に 0.5m ずつ内外へずらした点
+    for k, boundary in enumerate((inner, outer)):
+        middle = (boundary[-1] + boundary[0]) / 2
+        normal = middle / np.hypot(*middle)
+        points = middle + np.array([[-0.5], [0.5]]) * normal
+        margins = field.margins(points)[:, k]
+        np.testing.assert_allclose(np.abs(margins), brute_distance(points, closed(boundary)), atol=2 * RESOLUTION)
+        # 内側の境界は外へ、外側の境界は内へずらした点がコース上
+        on_course = [False, True] if k == 0 else [True, False]
+        np.testing.assert_array_equal(margins > 0, on_course)
+
+
+def test_single_boundary_is_unsigned_and_arrays_round_trip(course):
+    inner, outer, field = course
+    single = LaneDistanceField([outer], RESOLUTION)
+    assert not single.signed
+    points = np.array([[0.0, 0.0], [15.0, 0.0]])
+    np.testing.assert_allclose(single.clearance(points), [12.0, 3.0], atol=2 * RESOLUTION)
+
+    restored = LaneDistanceField.from_arrays([inner, outer], field.to_arrays(), RESOLUTION)
+    assert restored.signed
+    np.testing.assert_array_equal(restored.clearance(points), field.clearance(points))
@@ -0,0 +1,27 @@
+import socket
+
+import numpy as np
+
+import pose_feed
+
+
+def test_publish_returns_count_sent_before_ctrl_c(monkeypatch):
+    path_poses = pose_feed.poses_along(np.column_stack((np.arange(10.0), np.zeros(10))))
+    sleeps = []
+
+    def sleep(delay):
+        # 3回目の待ちで Ctrl+C が押されたことにする
+        sleeps.append(delay)
+        if len(sleeps) == 3:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(pose_feed.time, "sleep", sleep)
+    monkeypatch.setattr(pose_feed.time, "perf_counter", lambda: 0.0)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+        receiver.bind(("127.0.0.1", 0))
+        port = receiver.getsockname()[1]
+        sent = pose_feed.publish(path_poses, port=port, batch=2, count=0)
+        assert sent == 6
+        receiver.settimeout(1.0)
+        poses = pose_feed.decode_poses(receiver.recv(pose_feed.MAX_DATAGRAM))
+    np.testing.assert_allclose(poses[:, 1:], path_poses[:2])
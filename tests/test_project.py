@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+import project
+from history import ColumnEdit, EditHistory, PointEdit
+from lane_clearance import LaneDistanceField
+from trajectory import Trajectory
+
+CSV_TEXT = "x,y,speed,z,label\n0.0,0.0,1.5,0.10,a\n1.0,0.0,2.25,7,b\n1.0,1.0,3.0,3.000,c\n0.0,1.0,1.0,1e1,d\n"
+
+
+@pytest.fixture
+def saved(tmp_path):
+    """表記の揺れた数値と文字列の列を持つ軌跡と、元に戻す/やり直し履歴を保存したプロジェクト"""
+    csv_path = tmp_path / "input.csv"
+    csv_path.write_text(CSV_TEXT)
+    data = Trajectory.from_csv(str(csv_path))
+    history = EditHistory(1 << 20)
+    record = PointEdit([1], data.xy[[1]], data.xy[[1]] + 0.5)
+    data = record.redo(data)
+    history.push(record)
+    history.push(ColumnEdit('speed', data['speed'].copy(), data['speed'] * 2))
+    history.redo_stack.append(history.undo_stack.pop())
+    lanes = [np.array([[-1.0, -1.0], [2.0, -1.0], [2.0, 2.0], [-1.0, 2.0]]),
+             np.array([[-3.0, -3.0], [4.0, -3.0], [4.0, 4.0], [-3.0, 4.0]])]
+    field = LaneDistanceField(lanes)
+    path = str(tmp_path / "project.npz")
+    project.save_project(path, data, lanes, background=np.zeros((3, 2)), view={"xlim": [0, 1], "ylim": [0, 1]},
+                         history=history, lane_field=field)
+    return path, data, history, lanes, field
+
+
+def test_round_trip_is_memory_mapped(saved):
+    path, data, history, lanes, field = saved
+    opened = project.Project(path)
+    loaded = opened.trajectory()
+    assert loaded.fieldnames == data.fieldnames
+    np.testing.assert_array_equal(loaded.xy, data.xy)
+    np.testing.assert_array_equal(loaded['speed'], data['speed'])
+    assert list(loaded['label']) == ['a', 'b', 'c', 'd']
+    assert project.is_mapped(loaded.xy) and project.is_mapped(loaded['speed'])
+    assert opened.view == {"xlim": [0, 1], "ylim": [0, 1]}
+    for lane, expected in zip(opened.lanes(), lanes):
+        np.testing.assert_array_equal(lane, expected)
+    points = np.array([[0.5, 0.5], [3.0, 0.0], [10.0, 10.0]])
+    np.testing.assert_array_equal(opened.lane_field(opened.lanes()).clearance(points), field.clearance(points))
+
+    # 書き換えてもファイルには反映されない
+    loaded.xy[0] = 99.0
+    np.testing.assert_array_equal(project.Project(path).trajectory().xy, data.xy)
+
+
+def test_history_is_restored(saved):
+    path, data, history, lanes, field = saved
+    restored = EditHistory(1 << 20)
+    project.Project(path).restore_history(restored)
+    assert len(restored.undo_stack) == 1 and len(restored.redo_stack) == 1
+    loaded, _ = restored.undo(project.Project(path).trajectory())
+    np.testing.assert_array_equal(loaded.xy[1], [1.0, 0.0])
+    loaded, _ = restored.redo(loaded)
+    loaded, _ = restored.redo(loaded)
+    np.testing.assert_array_equal(loaded['speed'], data['speed'] * 2)
+
+
+def test_save_over_opened_project_after_copying_to_memory(saved):
+    path, data, history, lanes, field = saved
+    loaded = project.Project(path).trajectory()
+    project.trajectory_in_memory(loaded)
+    assert not project.is_mapped(loaded.xy)
+    loaded.xy[2] = [5.0, 5.0]
+    project.save_project(path, loaded)
+    np.testing.assert_array_equal(project.Project(path).trajectory().xy[2], [5.0, 5.0])
+
+
+def test_export_keeps_original_number_text(saved, tmp_path):
+    path, data, history, lanes, field = saved
+    assert project.main([path, "--output-dir", str(tmp_path / "export")]) == project.EXIT_OK
+    lines = (tmp_path / "export" / project.EXPORT_TRAJECTORY_FILE).read_text().splitlines()
+    # x, y, speed 以外の数値の列は読み込んだときの表記のまま書き出す
+    assert [line.split(',')[3] for line in lines[1:]] == ["0.10", "7", "3.000", "1e1"]
+    assert (tmp_path / "export" / project.EXPORT_LANE_FILES[1]).exists()
+
+
+def test_invalid_file_fails(tmp_path):
+    bad = tmp_path / "bad.npz"
+    bad.write_bytes(b"not a zip")
+    assert project.main([str(bad)]) == project.EXIT_FAILED
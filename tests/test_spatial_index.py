@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from matplotlib.path import Path
+
+import spatial_index
+from spatial_index import PointGridIndex
+
+
+def brute_rect(xy, xmin, ymin, xmax, ymax):
+    inside = (xy[:, 0] >= xmin) & (xy[:, 0] <= xmax) & (xy[:, 1] >= ymin) & (xy[:, 1] <= ymax)
+    return np.flatnonzero(inside)
+
+
+def brute_nearest(xy, x, y, radius):
+    d = np.hypot(xy[:, 0] - x, xy[:, 1] - y)
+    best = d.argmin()
+    return int(best) if d[best] <= radius else None
+
+
+def random_rects(rng, count, low=-10.0, high=110.0):
+    corners = rng.uniform(low, high, (count, 4))
+    return [tuple(c) for c in corners]
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(1234)
+
+
+def test_rect_queries_match_brute_force(rng):
+    xy = rng.uniform(0.0, 100.0, (5000, 2))
+    index = PointGridIndex(xy)
+    for x0, y0, x1, y1 in random_rects(rng, 200):
+        expected = brute_rect(xy, min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        # 角の順序は問わない
+        np.testing.assert_array_equal(index.query_rect(x0, y0, x1, y1), expected)
+
+
+def test_queries_follow_moved_points(rng, monkeypatch):
+    # 作り直しの閾値を超えない少数の移動と、超えて作り直す多数の移動の両方を確かめる
+    monkeypatch.setattr(spatial_index, "REBUILD_DIRTY_MIN", 50)
+    xy = rng.uniform(0.0, 100.0, (2000, 2))
+    index = PointGridIndex(xy)
+    for count in (10, 40, 300):
+        moved = rng.choice(len(xy), count, replace=False)
+        xy[moved] = rng.uniform(-50.0, 150.0, (count, 2)) # 元の範囲の外へも動かす
+        index.update(moved)
+        for x0, y0, x1, y1 in random_rects(rng, 50, -60.0, 160.0):
+            expected = brute_rect(xy, min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+            np.testing.assert_array_equal(index.query_rect(x0, y0, x1, y1), expected)
+
+
+def test_polygon_queries_match_brute_force(rng):
+    xy = rng.uniform(0.0, 100.0, (3000, 2))
+    index = PointGridIndex(xy)
+    for _ in range(50):
+        center = rng.uniform(10.0, 90.0, 2)
+        angles = np.sort(rng.uniform(0.0, 2 * np.pi, 7))
+        radii = rng.uniform(5.0, 30.0, 7)
+        vertices = center + np.column_stack((np.cos(angles), np.sin(angles))) * radii[:, None]
+        expected = np.flatnonzero(Path(vertices).contains_points(xy))
+        np.testing.assert_array_equal(index.query_polygon(vertices), expected)
+    assert len(index.query_polygon([[0, 0], [50, 50]])) == 0
+
+
+def test_nearest_matches_brute_force(rng):
+    xy = rng.uniform(0.0, 100.0, (4000, 2))
+    index = PointGridIndex(xy)
+    for x, y in rng.uniform(-5.0, 105.0, (300, 2)):
+        radius = rng.uniform(0.1, 3.0)
+        assert index.nearest(x, y, radius) == brute_nearest(xy, x, y, radius)
+
+
+def test_empty_and_degenerate_inputs():
+    empty = PointGridIndex(np.empty((0, 2)))
+    assert len(empty.query_rect(0, 0, 1, 1)) == 0
+    assert empty.nearest(0, 0, 1) is None
+
+    # 全点が一直線上 (y の幅が 0) でも格子が作れる
+    line = np.column_stack((np.linspace(0.0, 10.0, 101), np.zeros(101)))
+    index = PointGridIndex(line)
+    np.testing.assert_array_equal(index.query_rect(2.0, -1.0, 3.0, 1.0), brute_rect(line, 2.0, -1.0, 3.0, 1.0))
+    assert index.nearest(5.04, 0.01, 0.5) == 50
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import speed_profile
+from trajectory import Trajectory
+
+
+def brute_limit_speeds(curvature, ds, max_speed, max_lateral_accel, max_accel, max_decel):
+    """v^2 の漸化式を周回が変わらなくなるまで前後に繰り返して解く"""
+    n = len(curvature)
+    with np.errstate(divide='ignore'):
+        v2 = np.minimum(max_lateral_accel / np.abs(curvature), max_speed ** 2)
+    for _ in range(3):
+        for i in range(2 * n):
+            j, k = i % n, (i + 1) % n
+            v2[k] = min(v2[k], v2[j] + 2 * max_accel * ds[j])
+        for i in range(2 * n, 0, -1):
+            j, k = i % n, (i - 1) % n
+            v2[k] = min(v2[k], v2[j] + 2 * max_decel * ds[k])
+    return np.sqrt(v2)
+
+
+def test_limit_speeds_matches_iterative_solution():
+    rng = np.random.default_rng(3)
+    curvature = rng.uniform(-0.5, 0.5, 300)
+    curvature[rng.choice(300, 20, replace=False)] = 0.0 # 直線の点も含める
+    ds = rng.uniform(0.1, 2.0, 300)
+    limits = dict(max_speed=15.0, max_lateral_accel=3.0, max_accel=1.5, max_decel=4.0)
+    np.testing.assert_allclose(speed_profile.limit_speeds(curvature, ds, **limits),
+                               brute_limit_speeds(curvature, ds, **limits), rtol=1e-9)
+
+
+def test_circle_runs_at_lateral_limit():
+    t = np.linspace(0.0, 2 * np.pi, 200, endpoint=False)
+    xy = 20.0 * np.column_stack((np.cos(t), np.sin(t)))
+    np.testing.assert_allclose(speed_profile.point_curvature(xy), 1 / 20.0, rtol=1e-3)
+    speeds = speed_profile.compute_speeds(xy, max_speed=100.0, max_lateral_accel=5.0)
+    np.testing.assert_allclose(speeds, 10.0, rtol=1e-3)
+    # 最高速度で頭打ちになる
+    np.testing.assert_allclose(speed_profile.compute_speeds(xy, max_speed=4.0), 4.0)
+
+
+def test_apply_speed_profile_adds_column_without_touching_input():
+    t = np.linspace(0.0, 2 * np.pi, 50, endpoint=False)
+    data = Trajectory(['x', 'y'], 10.0 * np.column_stack((np.cos(t), np.sin(t))))
+    result = speed_profile.apply_speed_profile(data)
+    assert result.fieldnames == ['x', 'y', speed_profile.SPEED_COLUMN]
+    assert len(result[speed_profile.SPEED_COLUMN]) == 50
+    assert speed_profile.SPEED_COLUMN not in data
+    with pytest.raises(ValueError):
+        speed_profile.compute_speeds(data.xy[:2])
@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+import pytest
+
+import curve_engine
+from trajectory import Trajectory
+from workers import BackgroundRunner
+
+
+class FakeRoot:
+    """after() で登録された呼び出しを run_until_idle() でまとめて実行する Tk の代わり"""
+
+    def __init__(self):
+        self.pending = []
+
+    def after(self, ms, fn):
+        self.pending.append(fn)
+        return fn
+
+    def after_cancel(self, handle):
+        if handle in self.pending:
+            self.pending.remove(handle)
+
+    def run_until_idle(self, runner, timeout=60.0):
+        deadline = time.monotonic() + timeout
+        while runner.jobs:
+            assert time.monotonic() < deadline, "ジョブが終わらない"
+            pending, self.pending = self.pending, []
+            for fn in pending:
+                fn()
+            time.sleep(0.01)
+
+
+def circle(n):
+    t = np.linspace(0.0, 2 * np.pi, n, endpoint=False)
+    return Trajectory(['x', 'y'], np.column_stack((np.cos(t), np.sin(t))))
+
+
+@pytest.fixture
+def root():
+    return FakeRoot()
+
+
+@pytest.fixture
+def runner(root):
+    runner = BackgroundRunner(root, max_processes=1)
+    yield runner
+    runner.shutdown()
+
+
+def test_process_job_reports_progress_and_result(root, runner):
+    seen = []
+    results = []
+    runner.submit("作り直し", curve_engine.resample_all, circle(200_000), use_process=True,
+                  on_progress=lambda job: seen.append(job.message), on_done=results.append)
+    root.run_until_idle(runner)
+    assert len(results[0]) == 200_000
+    assert "スプラインの当てはめ" in seen and "列の補間" in seen
+
+
+def test_cancel_terminates_process_and_next_job_still_runs(root, runner):
+    events = []
+    runner.submit("作り直し", curve_engine.resample_all, circle(2_000_000), use_process=True,
+                  on_done=lambda result: events.append('done'), on_cancel=lambda: events.append('cancel'))
+    time.sleep(0.5)
+    runner.cancel_all()
+    root.run_until_idle(runner, timeout=5.0)
+    assert events == ['cancel']
+    assert runner._idle_processes == []
+
+    # 例外は on_error に届き、次のジョブは新しいプロセスで動く
+    errors = []
+    runner.submit("サンプリング", curve_engine.sample_closed_curve, circle(2), 5, use_process=True,
+                  on_error=errors.append)
+    runner.submit("サンプリング", curve_engine.sample_closed_curve, circle(50), 10, use_process=True,
+                  on_done=lambda result: events.append(len(result)))
+    root.run_until_idle(runner)
+    assert isinstance(errors[0], ValueError)
+    assert events == ['cancel', 10]
+    assert len(runner._idle_processes) == 1